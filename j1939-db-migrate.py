@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import sys
+import os
+import getopt
+import sqlite3
+
+from j1939dec.schema import SCHEMA_VERSION, getVersion, migrate,\
+     pendingMigrations
+
+
+#
+# Subroutines
+#
+def usage():
+    print("""
+Usage:
+  """ + os.path.basename(sys.argv[0]) + """ [-n] <DB file>
+
+  Upgrades a J1939 DB, in place, to the current schema version (""" \
+  + str(SCHEMA_VERSION) + """).
+
+  Flags:
+    -n    only show the schema version and the pending migrations
+
+Example:
+  """ + os.path.basename(sys.argv[0]) + """ -n j1939da-pgn-spn-oct22.db
+  """ + os.path.basename(sys.argv[0]) + """ j1939da-pgn-spn-oct22.db
+""")
+
+
+def showProgress(ver, desc, secs):
+    print("  version %d: %s [%0.2f s]" % (ver, desc, secs))
+
+
+#
+# Main
+#
+
+dry_run = False
+
+try:
+    (opts, args) = getopt.getopt(sys.argv[1:], "n")
+except getopt.GetoptError as e:
+    print("ERROR - getopt() [" + str(e) + "]")
+    usage()
+    sys.exit(1)
+
+for (k,v) in opts:
+    if k == "-n":
+        dry_run = True
+
+if len(args) != 1:
+    usage()
+    sys.exit(1)
+
+db_file = args[0]
+if not os.path.exists(db_file):
+    print("ERROR - " + db_file + ": Not found!")
+    sys.exit(1)
+
+rc = 0
+try:
+    dbcon = sqlite3.connect(db_file)
+    ver = getVersion(dbcon)
+    print(db_file + ": schema version " + str(ver))
+
+    if ver > SCHEMA_VERSION:
+        print("WARNING - DB is newer than this script (schema version "\
+              + str(SCHEMA_VERSION) + ")")
+    elif dry_run:
+        for (ver, desc, func) in pendingMigrations(dbcon):
+            print("  pending version %d: %s" % (ver, desc))
+    elif ver < SCHEMA_VERSION:
+        migrate(dbcon, showProgress)
+        print(db_file + ": upgraded to schema version "\
+              + str(getVersion(dbcon)))
+    dbcon.close()
+
+except sqlite3.DatabaseError as e:
+    # Migrations that did not complete are rolled back
+    print("ERROR - DB Exception [" + str(e) + "]")
+    rc = 1
+
+# Graceful exit
+sys.exit(rc)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import sys
+import os
+import time
+import getopt
+import sqlite3
+
+from j1939dec.schema import openReadOnly
+from j1939dec.snapshot import SnapshotPlan, exportSnapshot
+
+
+#
+# Subroutines
+#
+def usage():
+    print("""
+Usage:
+  """ + os.path.basename(sys.argv[0]) + """ [-c] <DB file> <snapshot file>
+
+  Writes the decode tables of a J1939 DB to a binary snapshot that jjd.py,
+  jcd.py and jbd.py can map with --snapshot instead of loading the DB.
+
+  Flags:
+    -c    only check whether the snapshot was made from this DB (exit status
+          1 if it is stale)
+
+Example:
+  """ + os.path.basename(sys.argv[0]) + """ j1939da-pgn-spn-oct22.db j1939da-pgn-spn-oct22.snap
+  """ + os.path.basename(sys.argv[0]) + """ -c j1939da-pgn-spn-oct22.db j1939da-pgn-spn-oct22.snap
+""")
+
+
+#
+# Main
+#
+
+check = False
+
+try:
+    (opts, args) = getopt.getopt(sys.argv[1:], "c")
+except getopt.GetoptError as e:
+    print("ERROR - getopt() [" + str(e) + "]")
+    usage()
+    sys.exit(1)
+
+for (k,v) in opts:
+    if k == "-c":
+        check = True
+
+if len(args) != 2:
+    usage()
+    sys.exit(1)
+
+(db_file, snap_file) = args
+if not os.path.exists(db_file):
+    print("ERROR - " + db_file + ": Not found!")
+    sys.exit(1)
+
+rc = 0
+if check:
+    if not os.path.exists(snap_file):
+        print("ERROR - " + snap_file + ": Not found!")
+        sys.exit(1)
+    try:
+        plan = SnapshotPlan(snap_file)
+        if plan.isStale(db_file):
+            print(snap_file + ": stale (not made from " + db_file + ")")
+            rc = 1
+        else:
+            print(snap_file + ": up to date with " + db_file + " (made "\
+                  + time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                  time.gmtime(plan.created)) + ")")
+        plan.close()
+    except ValueError as e:
+        print("ERROR - " + str(e))
+        rc = 1
+    sys.exit(rc)
+
+t0 = time.perf_counter()
+try:
+    dbcon = openReadOnly(db_file)
+    (num_pgns, num_spns, num_sas) = exportSnapshot(dbcon, db_file, snap_file)
+    dbcon.close()
+
+    print("Wrote " + str(num_pgns) + " PGNs, " + str(num_spns) + " SPNs and "\
+          + str(num_sas) + " source addresses to " + snap_file\
+          + " in %0.2f s (%0.1f KiB)" % (time.perf_counter() - t0,
+                                         os.path.getsize(snap_file) / 1024.0))
+
+except sqlite3.DatabaseError as e:
+    print("ERROR - DB Exception [" + str(e) + "]")
+    rc = 1
+
+# Graceful exit
+sys.exit(rc)
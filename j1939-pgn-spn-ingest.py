@@ -2,29 +2,17 @@
 import sys
 import re
 import os
+import json
+import time
 import getopt
 import sqlite3
+import zipfile
 
-#
-# Definitions
-#
-NUM_FLDS = 46
-#x REQD_FLD_IDX_L = [4, 5, 6, 7, 20, 21, 22, 23, 24, 29, 34, 35]
-PGN_FLD_MAP = {
-  "pgn": 4,
-  "label": 5,
-  "acronym": 6,
-  "description": 7}
-SPN_FLD_MAP = {
-  "transmission_rate": 15,
-  "sp_start_bit": 20,
-  "spn": 21,
-  "label": 22,
-  "description": 23,
-  "bit_len": 24,
-  "unit": 29,
-  "scale_factor": 34,
-  "offset": 35}
+from j1939dec.ingest import NUM_FLDS, DA_SHEET, DA_HEADER_L, INGEST_PRAGMA_L,\
+     UPDATE_PRAGMA_L, BulkLoader, createIndexes, createSATable, createTables,\
+     getMeta, loadWorkbook, setMeta, splitRecord, updateDB
+from j1939dec.schema import SCHEMA_VERSION, migrate
+from j1939dec.xlsx import XLSXReader
 
 
 #
@@ -32,15 +20,30 @@ SPN_FLD_MAP = {
 #
 def usage():
     print("""
-Usage: 
-  """ + os.path.basename(sys.argv[0]) + """ [-h] <tab-separated file>
+Usage:
+  """ + os.path.basename(sys.argv[0]) + """ [-h] [-o <DB file>|-u <DB file>] [-r <revision>] \
+[-c <change log>] <tab-separated file>|<.xlsx file>
 
   Flags:
     -h    display header
+    -o    DB file to create (default: input file name with .db extension,
+          in the current directory)
+    -u    existing DB file to update to the new DA revision: only added,
+          changed and removed PGN/SPN (and, from an .xlsx, SA) rows are
+          written, in one transaction
+    -r    DA revision recorded in the DB (default: input file name)
+    -c    with -u, write the change log (JSON) to this file
+
+  A tab-separated file is an export of the "SPs & PGs" sheet. An .xlsx file
+  is the Digital Annex workbook itself: the "SPs & PGs" sheet and the source
+  address sheets are read directly, so no export and no separate
+  j1939-source-add-ingest.py run is needed.
 
 Example:
   """ + os.path.basename(sys.argv[0]) + """ -h j1939da-pgn-spn-oct22.tsv
   """ + os.path.basename(sys.argv[0]) + """ j1939da-pgn-spn-oct22.tsv
+  """ + os.path.basename(sys.argv[0]) + """ -o j1939da-pgn-spn-oct22.db "J1939DA Oct22.xlsx"
+  """ + os.path.basename(sys.argv[0]) + """ -u j1939da-pgn-spn-oct22.db -r Apr24 -c changes.json "J1939DA Apr24.xlsx"
 """)
 
 
@@ -67,210 +70,81 @@ def getHeader(tsv_file, regx):
     return ret_d
 
 
+def getSheetHeader(rdr):
+    ret_d = {}
+    sheet = rdr.findSheet(DA_SHEET)
+    if not sheet:
+        return ret_d
 
-def transTabsToSpaces(iline):
-    in_dq = False
-    oline = ""
+    for (row_num, cells_l) in rdr.iterRows(sheet):
+        if cells_l[:len(DA_HEADER_L)] == DA_HEADER_L:
+            for n,fld in enumerate(cells_l):
+                ret_d[n] = fld
+            break
 
-    for c in iline:
-        if c == '"':
-            # Toggle if already inside double quote
-            if in_dq:
-                in_dq = False
-            else:
-                in_dq = True
-    
-        if c == '\t' and in_dq:
-            c = ' '
-    
-        oline += c
-    
-    return oline
-
-
-def procLine(line, dbcon):
-    rv = 0
-    err = ""
-    pgn_insert = False
-
-    flds_l = line.split('\t')
-#x    print("num_flds:", len(flds_l))
-
-    if len(flds_l) > NUM_FLDS:
-        # There are tab characters in between double quotes. Let's convert
-        # them to spaces
-        line = transTabsToSpaces(line)
-        flds_l = line.split('\t')
-        
-        if len(flds_l) != NUM_FLDS:
-            err = "Number of fields != " + str(NUM_FLDS)\
-                + "! [" + str(len(flds_l)) + "]"
-            rv = 1
-            return (rv, err)
-
-    # Create a cursor
-    cur = dbcon.cursor()
-
-    # First check and see if pgn is already in pgn table
-    q = "SELECT count(*) FROM pgn where pgn = ?"
-    res = cur.execute(q, (flds_l[PGN_FLD_MAP["pgn"]],))
-    for row in res:
-        if row[0] == 0:
-            pgn_insert = True
-
-    if pgn_insert:
-        # Check if pgn is a number
-        try:
-            pgn = int(flds_l[PGN_FLD_MAP["pgn"]])
-        except ValueError as e:
-            err = "PGN is not INTEGER!"
-            rv = 0
-            return (rv, err)
-
-        q = ""\
-          + "INSERT INTO pgn "\
-          + "("\
-            + "pgn, "\
-            + "label, "\
-            + "acronym, "\
-            + "description"\
-          + ") "\
-          + "VALUES "\
-            + "(?, ?, ?, ?)"
-
-        try:
-            cur.execute(q, (flds_l[PGN_FLD_MAP["pgn"]], 
-                            flds_l[PGN_FLD_MAP["label"]], 
-                            flds_l[PGN_FLD_MAP["acronym"]], 
-                            flds_l[PGN_FLD_MAP["description"]]))
-            dbcon.commit()
-        except Error as e:
-            err = str(e)
-            rv = 1 
-
-    # Extract/calculate the following values:
-    #  - values for byte_num and bit_start from sp_start_bit
-    #  - value for bit_len
-    #  - value for bit_start
-    byte_num = None
-    bit_len = None
-    bit_start = None
-
-    ssb = flds_l[SPN_FLD_MAP["sp_start_bit"]]
-    if "." in ssb:
-        # Value would be somthing like "2.1", "4.3", etc.
-        ssb_flds_l = ssb.split(".") 
-        byte_num = int(ssb_flds_l[0])
-        bit_start = int(ssb_flds_l[1])
-
-    # The value of bit length is a string that looks like:
-    #  - 11 bits
-    #  - 1 byte
-    #  - 3 bytes
-    bl = flds_l[SPN_FLD_MAP["bit_len"]]
-    mobj = re.match("(\d+) (bytes|bits|byte)", bl)
-    if mobj:
-        if mobj.group(2) == "bits":
-            bit_len = int(mobj.group(1))
-        elif mobj.group(2) == "byte" or mobj.group(2) == "bytes":
-            bit_len = int(mobj.group(1)) * 8
-        else:
-            rv = 1
-            err = "Bits, Bytes or Byte not found in SP Length [" + bl \
-                + "] [PGN=" + flds_l[PGN_FLD_MAP["pgn"]] + "; "\
-                + "SPN=" + flds_l[SPN_FLD_MAP["spn"]] + "]"
-            return (rv, err)
-#j    else:
-#j        rv = 1
-#j        err = "Unexpected SP Length value [" + bl + "] [PGN = "\
-#j            + flds_l[PGN_FLD_MAP["pgn"]] + "; "\
-#j            + "SPN=" + flds_l[SPN_FLD_MAP["spn"]] + "]"
-#j        return (rv, err)
-        
-
-    # Insert into spn table
-    q = ""\
-      + "INSERT INTO spn "\
-      + "("\
-        + "spn, "\
-        + "pgn_id, "\
-        + "label, "\
-        + "sp_start_bit, "\
-        + "byte_num, "\
-        + "bit_start, "\
-        + "bit_len, "\
-        + "unit, "\
-        + "scale_factor, "\
-        + "offset, "\
-        + "transmission_rate, "\
-        + "description"\
-      + ") "\
-      + "VALUES "\
-        + "(?, (SELECT pgn_id FROM pgn WHERE pgn = ?), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    return ret_d
 
-    try:
-        cur.execute(q, (flds_l[SPN_FLD_MAP["spn"]], 
-                        flds_l[PGN_FLD_MAP["pgn"]], 
-                        flds_l[SPN_FLD_MAP["label"]], 
-                        flds_l[SPN_FLD_MAP["sp_start_bit"]], 
-                        byte_num,
-                        bit_start,
-                        bit_len,
-                        flds_l[SPN_FLD_MAP["unit"]], 
-                        flds_l[SPN_FLD_MAP["scale_factor"]], 
-                        flds_l[SPN_FLD_MAP["offset"]], 
-                        flds_l[SPN_FLD_MAP["transmission_rate"]], 
-                        flds_l[SPN_FLD_MAP["description"]]))
-        dbcon.commit()
-    except sqlite3.DatabaseError as e:
-        err = flds_l[PGN_FLD_MAP["pgn"]] + ":" + flds_l[SPN_FLD_MAP["spn"]] + "  " + str(e)
-        rv = 1 
 
-    return (rv, err)
+def procLine(line, loader):
+    (rv, err, flds_l) = splitRecord(line, NUM_FLDS)
+    if rv != 0:
+        return (rv, err)
 
+    return loader.addRecord(flds_l)
 
-def createTables(dbcon):
-    q = ""\
-      + "CREATE TABLE pgn ("\
-        + "pgn_id INTEGER PRIMARY KEY, "\
-        + "pgn INTEGER, "\
-        + "label TEXT, "\
-        + "acronym TEXT, "\
-        + "description TEXT"\
-      + ")"
 
-    cur = dbcon.cursor()
-    cur.execute(q)
-    dbcon.commit()
+def loadInput(infile, is_xlsx, dbcon):
+    # Loads the DA into the (empty) pgn, spn and, for an .xlsx, sa tables of
+    # dbcon and returns the BulkLoader
+    loader = BulkLoader(dbcon)
+    if is_xlsx:
+        createSATable(dbcon)
+        rdr = XLSXReader(infile)
+        loadWorkbook(rdr, loader)
+        rdr.close()
+    else:
+        loadTSV(infile, loader)
+    loader.finish()
 
-    q = ""\
-      + "CREATE TABLE spn ("\
-        + "spn_id INTEGER PRIMARY KEY, "\
-        + "spn INTEGER, "\
-        + "pgn_id INTEGER REFERENCES pgn(pgn_id) ON DELETE CASCADE "\
-          + "ON UPDATE CASCADE, "\
-        + "sp_start_bit TEXT, "\
-        + "byte_num INTEGER, "\
-        + "bit_len INTEGER, "\
-        + "bit_start INTEGER, "\
-        + "unit TEXT, "\
-        + "scale_factor FLOAT, "\
-        + "offset FLOAT, "\
-        + "label TEXT, "\
-        + "transmission_rate TEXT, "\
-        + "description TEXT"\
-      + ")"
-
-    cur.execute(q)
-    dbcon.commit()
+    return loader
 
 
-    q = ""\
-      + "create unique index spn_spn_pgnid on spn(spn, pgn_id)"
-    cur.execute(q)
-    dbcon.commit()
+def loadTSV(tsvfile, loader):
+    regx1 = re.compile("^\t\t\t\t[0-9]+")
+    regx2 = re.compile("^\(R\)\t[\t(R)]|^\t\(R\)[\t\(R\)]")
+    regx3 = re.compile("^\t\t\t\tN/A")
 
-    return True
+    prev_line = ""
+    with open(tsvfile) as fo:
+        for n,line in enumerate(fo, 1):
+            mobj1 = regx1.match(line)
+            mobj2 = regx2.match(line)
+            if mobj1 or mobj2:
+                # Start of "next" line. Write previous line to file
+                if prev_line != "":
+                    (rv, err) = procLine(prev_line, loader)
+                    if rv != 0:
+                        print("ERROR - " + err + " [Line #: " + str(n) + "]")
+
+                prev_line = line
+            else:
+                if prev_line == "":
+                    # Possibly header lines
+                    pass
+                else:
+                    mobj3 = regx3.match(line)
+                    if mobj3:
+                        # Line starts with: \t\t\t\tN/A...
+                        # Not applicable lines..
+                        break
+
+                    prev_line += line
+
+        # Process the last line
+        if prev_line != "":
+            (rv, err) = procLine(prev_line, loader)
+            if rv != 0:
+                print("ERROR - " + err + " [Last valid line]")
 
 
 #
@@ -278,9 +152,13 @@ def createTables(dbcon):
 #
 
 show_flds = False
+dbfile = None
+update = False
+revision = None
+change_file = None
 
 try:
-    (opts, args) = getopt.getopt(sys.argv[1:], "h")
+    (opts, args) = getopt.getopt(sys.argv[1:], "c:hr:o:u:")
 except getopt.GetoptError as e:
     print("ERROR - getopt() [" + str(e) + "]")
     usage()
@@ -289,6 +167,20 @@ except getopt.GetoptError as e:
 for (k,v) in opts:
     if k == "-h":
         show_flds = True
+    elif k == "-o":
+        dbfile = v
+    elif k == "-u":
+        dbfile = v
+        update = True
+    elif k == "-r":
+        revision = v
+    elif k == "-c":
+        change_file = v
+
+if change_file and not update:
+    print("ERROR - -c (change log) requires -u!")
+    usage()
+    sys.exit(1)
 
 
 if len(args) != 1:
@@ -296,19 +188,89 @@ if len(args) != 1:
     sys.exit(1)
 
 
-tsvfile = args[0]
-
-regx1 = re.compile("^\t\t\t\t[0-9]+")
-regx2 = re.compile("^\(R\)\t[\t(R)]|^\t\(R\)[\t\(R\)]")
-regx3 = re.compile("^\t\t\t\tN/A")
-header_d = getHeader(tsvfile, regx1)
+infile = args[0]
+is_xlsx = infile.lower().endswith(".xlsx")
 
 if show_flds:
-    print(header_d)
+    if is_xlsx:
+        rdr = XLSXReader(infile)
+        print(getSheetHeader(rdr))
+        rdr.close()
+    else:
+        print(getHeader(infile, re.compile("^\t\t\t\t[0-9]+")))
     sys.exit(0)
 
 
-dbfile = os.path.basename(tsvfile.replace(".tsv", ".db"))
+if not revision:
+    revision = os.path.splitext(os.path.basename(infile))[0]
+
+meta_d = {
+    "da_revision": revision,
+    "da_source": os.path.basename(infile),
+    "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+if update:
+    if not os.path.exists(dbfile):
+        print("ERROR - " + dbfile + ": Not found!")
+        sys.exit(1)
+
+    rc = 0
+    t0 = time.perf_counter()
+    try:
+        # The new DA is loaded into a scratch DB in memory and diffed
+        # against the existing one
+        new_con = sqlite3.connect(":memory:")
+        createTables(new_con)
+        loadInput(infile, is_xlsx, new_con)
+
+        dbcon = sqlite3.connect(dbfile)
+        for q in UPDATE_PRAGMA_L:
+            dbcon.execute(q)
+        prev_revision = getMeta(dbcon, "da_revision")
+
+        # Older DBs are brought up to the current schema first
+        if migrate(dbcon):
+            print("Upgraded " + dbfile + " to schema version "\
+                  + str(SCHEMA_VERSION))
+
+        change_d = updateDB(dbcon, new_con, is_xlsx, meta_d)
+        dbcon.close()
+        new_con.close()
+
+        change_d["from"] = prev_revision
+        change_d["to"] = revision
+        if change_file:
+            with open(change_file, "w") as fo:
+                json.dump(change_d, fo, sort_keys=True)
+                fo.write("\n")
+
+        pgn_d = change_d["pgns"]
+        spn_d = change_d["spns"]
+        print("Updated " + dbfile + " from revision " + str(prev_revision)\
+              + " to " + revision + " in %0.2f s" % (
+                  time.perf_counter() - t0))
+        print("  PGNs: %d added, %d changed, %d removed" % (
+            len(pgn_d["added"]), len(pgn_d["changed"]),
+            len(pgn_d["removed"])))
+        print("  SPNs: %d added, %d changed, %d removed" % (
+            spn_d["added"], spn_d["changed"], spn_d["removed"]))
+        if "sas" in change_d:
+            print("  SAs: %d added, %d removed" % (
+                change_d["sas"]["added"], change_d["sas"]["removed"]))
+        print("  " + str(len(change_d["affected_pgns"])) + " PGNs affected")
+
+    except sqlite3.DatabaseError as e:
+        # Nothing is kept; the transaction is rolled back
+        print("ERROR - DB Exception [" + str(e) + "]")
+        rc = 1
+    except (zipfile.BadZipFile, KeyError) as e:
+        print("ERROR - " + infile + ": Not a usable .xlsx workbook [" + str(e) + "]")
+        rc = 1
+
+    sys.exit(rc)
+
+if not dbfile:
+    dbfile = os.path.splitext(os.path.basename(infile))[0] + ".db"
 
 # Ensure that db file does not already exist
 if os.path.exists(dbfile):
@@ -316,49 +278,50 @@ if os.path.exists(dbfile):
     print(msg)
     sys.exit(1)
 
+rc = 0
+tmp_file = dbfile + ".tmp"
+if os.path.exists(tmp_file):
+    os.remove(tmp_file)
+
+t0 = time.perf_counter()
+dbcon = None
 try:
-    dbcon = sqlite3.connect(dbfile)
+    dbcon = sqlite3.connect(tmp_file)
+    for q in INGEST_PRAGMA_L:
+        dbcon.execute(q)
     createTables(dbcon)
 
-    prev_line = ""
-    with open(tsvfile) as fo:
-        for n,line in enumerate(fo, 1):
-            mobj1 = regx1.match(line)
-            mobj2 = regx2.match(line)
-            if mobj1 or mobj2:
-                # Start of "next" line. Write previous line to file
-                if prev_line != "":
-                    (rv, err) = procLine(prev_line, dbcon)
-                    if rv != 0:
-                        print("ERROR - " + err + " [Line #: " + str(n) + "]")
-    
-                prev_line = line
-            else:
-                if prev_line == "":
-                    # Possibly header lines
-                    pass
-                else:
-                    mobj3 = regx3.match(line)
-                    if mobj3:
-                        # Line starts with: \t\t\t\tN/A...
-                        # Not applicable lines..
-                        break
-    
-                    prev_line += line
-    
-        # Process the last line
-        if prev_line != "":
-            (rv, err) = procLine(prev_line, dbcon)
-            if rv != 0:
-                print("ERROR - " + err + " [Last valid line]")
+    loader = loadInput(infile, is_xlsx, dbcon)
+    setMeta(dbcon, meta_d)
+    dbcon.commit()
+    createIndexes(dbcon)
+    migrate(dbcon)
+    dbcon.close()
+
+    os.replace(tmp_file, dbfile)
+
+    secs = time.perf_counter() - t0
+    msg = "Ingested " + str(loader.num_pgns) + " PGNs"
+    if is_xlsx:
+        msg += ", " + str(loader.num_spns) + " SPNs and "\
+            + str(loader.num_sas) + " source addresses"
+    else:
+        msg += " and " + str(loader.num_spns) + " SPNs"
+    print(msg + " into " + dbfile + " in %0.2f s (%d rows/sec)" % (
+        secs, loader.numRows() / max(secs, 1e-6)))
 
 except sqlite3.DatabaseError as e:
     print("ERROR - DB Exception [" + str(e) + "]")
     rc = 1
+except (zipfile.BadZipFile, KeyError) as e:
+    print("ERROR - " + infile + ": Not a usable .xlsx workbook [" + str(e) + "]")
+    rc = 1
 finally:
-    # Close db connection
-    dbcon.close()
-    rc = 0
+    # A failed ingest leaves no DB file behind
+    if dbcon:
+        dbcon.close()
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
 
 # Greaceful exit
 sys.exit(rc)
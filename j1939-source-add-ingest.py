@@ -2,17 +2,12 @@
 import sys
 import re
 import os
+import time
 import getopt
 import sqlite3
 
-#
-# Definitions
-#
-NUM_FLDS = 5
-REQD_FLD_IDX_L = [1, 2]
-SA_FLD_MAP = {
-  "sa": 1,
-  "label": 2}
+from j1939dec.ingest import NUM_SA_FLDS, UPDATE_PRAGMA_L, BulkLoader,\
+     createSATable, splitRecord
 
 #
 # Subroutines
@@ -56,83 +51,12 @@ def getHeader(tsv_file, regx):
 
 
 
-def transTabsToSpaces(iline):
-    in_dq = False
-    oline = ""
+def procLine(line, loader):
+    (rv, err, flds_l) = splitRecord(line, NUM_SA_FLDS)
+    if rv != 0:
+        return (rv, err)
 
-    for c in iline:
-        if c == '"':
-            # Toggle if already inside double quote
-            if in_dq:
-                in_dq = False
-            else:
-                in_dq = True
-    
-        if c == '\t' and in_dq:
-            c = ' '
-    
-        oline += c
-    
-    return oline
-
-
-def procLine(line, dbcon):
-    rv = 0
-    err = ""
-    pgn_insert = False
-
-    flds_l = line.split('\t')
-#x    print("num_flds:", len(flds_l))
-
-    if len(flds_l) > NUM_FLDS:
-        # There are tab characters in between double quotes. Let's convert
-        # them to spaces
-        line = transTabsToSpaces(line)
-        flds_l = line.split('\t')
-        
-        if len(flds_l) != NUM_FLDS:
-            err = "Number of fields != " + str(NUM_FLDS)\
-                + "! [" + str(len(flds_l)) + "]"
-            rv = 1
-            return (rv, err)
-
-    # Create a cursor
-    cur = dbcon.cursor()
-
-    # Insert into spn table
-    q = ""\
-      + "INSERT INTO sa "\
-      + "("\
-        + "sa, "\
-        + "label"\
-      + ") "\
-      + "VALUES "\
-        + "(?, ?)"
-
-    try:
-        cur.execute(q, (flds_l[SA_FLD_MAP["sa"]], 
-                        flds_l[SA_FLD_MAP["label"]]))
-        dbcon.commit()
-    except sqlite3.DatabaseError as e:
-        err = str(e)
-        rv = 1 
-
-    return (rv, err)
-
-
-def createTable(dbcon):
-    q = ""\
-      + "CREATE TABLE IF NOT EXISTS sa ("\
-        + "sa_id INTEGER PRIMARY KEY, "\
-        + "sa INTEGER, "\
-        + "label TEXT"\
-      + ")"
-
-    cur = dbcon.cursor()
-    cur.execute(q)
-    dbcon.commit()
-
-    return True
+    return loader.addSARecord(flds_l)
 
 
 #
@@ -177,9 +101,15 @@ if not os.path.exists(db_file):
     print(msg)
     sys.exit(1)
 
+rc = 0
+t0 = time.perf_counter()
 try:
     dbcon = sqlite3.connect(db_file)
-    createTable(dbcon)
+    for q in UPDATE_PRAGMA_L:
+        dbcon.execute(q)
+    createSATable(dbcon)
+
+    loader = BulkLoader(dbcon)
 
     prev_line = ""
     with open(tsvfile) as fo:
@@ -188,7 +118,7 @@ try:
             if mobj:
                 # Start of "next" line. Write previous line to file
                 if prev_line != "":
-                    (rv, err) = procLine(prev_line, dbcon)
+                    (rv, err) = procLine(prev_line, loader)
                     if rv != 0:
                         print("ERROR - " + err + " [Line #: " + str(n) + "]")
     
@@ -202,17 +132,24 @@ try:
     
         # Process the last line
         if prev_line != "":
-            (rv, err) = procLine(prev_line, dbcon)
+            (rv, err) = procLine(prev_line, loader)
             if rv != 0:
                 print("ERROR - " + err + " [Last valid line]")
 
+    loader.finish()
+
+    secs = time.perf_counter() - t0
+    print("Ingested " + str(loader.num_sas) + " source addresses into "\
+          + db_file + " in %0.2f s (%d rows/sec)" % (
+              secs, loader.num_sas / max(secs, 1e-6)))
+
 except sqlite3.DatabaseError as e:
+    # Nothing of this file is kept; the transaction is rolled back
     print("ERROR - DB Exception [" + str(e) + "]")
     rc = 1
 finally:
     # Close db connection
     dbcon.close()
-    rc = 0
 
 # Greaceful exit
 sys.exit(rc)
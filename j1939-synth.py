@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import sys
+import os
+import time
+import getopt
+
+from j1939dec.reader import FORMAT_L
+from j1939dec.synth import DEFAULT_SEED, DEFAULT_START, LogWriter, SynthDA,\
+     TrafficGen, parseMix
+
+
+#
+# Subroutines
+#
+def usage():
+    print("""
+Usage:
+  """ + os.path.basename(sys.argv[0]) + """ [-s <seed>] [-p <PGNs>] [-n <SPNs>] [-a <SAs>] \
+[--mix=<layouts>] [--multi=<fraction>] [--da=<file>] [--sa=<file>] \
+[--log=<file>|-] [-f <format>] [-N <frames>] [-t <seconds>] [--rate=<factor>] \
+[--start=<epoch>]
+
+  Writes a synthetic Digital Annex (in the layouts read by
+  j1939-pgn-spn-ingest.py and j1939-source-add-ingest.py) and/or a CAN log of
+  traffic for it. The same seed and options always give the same files, so a
+  log can be generated later, or elsewhere, for a DA made earlier.
+
+  Flags:
+    -s    seed (default: """ + str(DEFAULT_SEED) + """)
+    -p    number of PGNs (default: 500)
+    -n    maximum number of SPNs per single-frame PGN (default: 8)
+    -a    number of source addresses (default: 8)
+    -f    log format (default: candump-L): """ + ", ".join(FORMAT_L) + """
+    -N    number of frames to write
+    -t    seconds of traffic to write
+
+    --mix     SPN layout weights (default: bits=3,bytes=5,span=1):
+              bits = fields within one byte, bytes = byte aligned 1/2/4
+              bytes, span = unaligned fields across byte boundaries
+    --multi   fraction of PGNs longer than 8 bytes, sent as TP BAM sessions
+              (default: 0.05)
+    --da      write the "SPs & PGs" TSV to this file
+    --sa      write the source address TSV to this file
+    --log     write the CAN log to this file ("-" for STDOUT); requires -N
+              and/or -t
+    --rate    multiply every transmission period by this factor (default: 1;
+              0.1 = ten times the bus load)
+    --start   timestamp of the first frame (default: """ + str(DEFAULT_START) + """)
+
+Example:
+  """ + os.path.basename(sys.argv[0]) + """ -s 7 -p 2000 --da=synth-da.tsv --sa=synth-sa.tsv
+  """ + os.path.basename(sys.argv[0]) + """ -s 7 -p 2000 -f asc -t 3600 --log=synth.asc
+  """ + os.path.basename(sys.argv[0]) + """ -s 7 -p 2000 -N 1000000000 --log=- | jjd.py -f csv -i -
+""")
+
+
+#
+# Main
+#
+
+seed = DEFAULT_SEED
+num_pgns = 500
+max_spns = 8
+num_sas = 8
+mix_d = None
+multi = 0.05
+da_file = None
+sa_file = None
+log_file = None
+lformat = "candump-L"
+num_frames = None
+duration = None
+rate_scale = 1.0
+start = DEFAULT_START
+
+try:
+    (opts, args) = getopt.getopt(sys.argv[1:], "a:f:n:N:p:s:t:",
+                                 ["da=", "log=", "mix=", "multi=", "rate=",
+                                  "sa=", "start="])
+except getopt.GetoptError as e:
+    print("ERROR - getopt() [" + str(e) + "]")
+    usage()
+    sys.exit(1)
+
+try:
+    for (k,v) in opts:
+        if k == "-s":
+            seed = v
+        elif k == "-p":
+            num_pgns = int(v)
+        elif k == "-n":
+            max_spns = int(v)
+        elif k == "-a":
+            num_sas = int(v)
+        elif k == "-f":
+            lformat = v
+        elif k == "-N":
+            num_frames = int(v)
+        elif k == "-t":
+            duration = float(v)
+        elif k == "--mix":
+            mix_d = parseMix(v)
+        elif k == "--multi":
+            multi = float(v)
+        elif k == "--da":
+            da_file = v
+        elif k == "--sa":
+            sa_file = v
+        elif k == "--log":
+            log_file = v
+        elif k == "--rate":
+            rate_scale = float(v)
+        elif k == "--start":
+            start = float(v)
+except ValueError as e:
+    print("ERROR - Invalid value for " + k + " [" + str(e) + "]")
+    sys.exit(1)
+
+if args or not (da_file or sa_file or log_file):
+    usage()
+    sys.exit(1)
+
+if num_pgns < 1 or max_spns < 1 or num_sas < 1 or rate_scale <= 0:
+    print("ERROR - -p, -n, -a and --rate must be positive!")
+    sys.exit(1)
+
+if log_file and num_frames is None and duration is None:
+    print("ERROR - A log requires a number of frames (-N) or seconds (-t)!")
+    sys.exit(1)
+
+if lformat not in FORMAT_L:
+    print("ERROR - Unsupported log format [" + lformat + "]!")
+    sys.exit(1)
+
+# Progress goes to STDERR, as the log may go to STDOUT
+try:
+    t0 = time.perf_counter()
+    da = SynthDA(seed, num_pgns, max_spns, mix_d, multi, num_sas)
+
+    if da_file:
+        with open(da_file, "w") as fo:
+            n = da.writeTSV(fo)
+        print("Wrote " + str(len(da.pgn_l)) + " PGNs and " + str(n)\
+              + " SPNs to " + da_file, file=sys.stderr)
+
+    if sa_file:
+        with open(sa_file, "w") as fo:
+            n = da.writeSATSV(fo)
+        print("Wrote " + str(n) + " source addresses to " + sa_file,
+              file=sys.stderr)
+
+    if log_file:
+        gen = TrafficGen(da, seed, start, rate_scale)
+        if log_file == "-":
+            fo = sys.stdout
+        else:
+            fo = open(log_file, "w")
+        n = LogWriter(fo, lformat, start).write(gen.frames(num_frames,
+                                                           duration))
+        if fo is not sys.stdout:
+            fo.close()
+
+        secs = time.perf_counter() - t0
+        print("Wrote " + str(n) + " frames (" + str(gen.num_tp_sessions)\
+              + " TP sessions) to " + log_file + " in %0.2f s "\
+              "(%d frames/sec)" % (secs, n / max(secs, 1e-6)),
+              file=sys.stderr)
+
+except ValueError as e:
+    print("ERROR - " + str(e))
+    sys.exit(1)
+except BrokenPipeError:
+    # The reader of STDOUT has gone away
+    sys.stderr.close()
+    sys.exit(0)
+
+# Graceful exit
+sys.exit(0)
@@ -0,0 +1,6 @@
+#
+# J1939 decoder support package shared by jjd.py and jcd.py
+#
+# The library API: from j1939dec import Decoder (see j1939dec.decoder)
+#
+from j1939dec.decoder import Decoder
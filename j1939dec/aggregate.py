@@ -0,0 +1,279 @@
+#
+# Windowed aggregation per signal
+#
+# Decoded values are summarized per (source address, SPN) and time window in
+# one pass, and one row per signal and window is written instead of every
+# value: count, min, max, mean and approximate percentiles.
+#
+# Windows are aligned to multiples of the slide (step) since the epoch, so
+# one-minute windows start on the minute. Values are summed up per pane of
+# one step; a tumbling window (slide = window) is one pane, a sliding window
+# is the merge of the panes it covers. A window is written as soon as the
+# log time passes its end, so only the panes of one window are held, i.e.
+# memory depends on the number of signals and not on the length of the log.
+# Values older than the pane being filled (out of order by more than a
+# step) are counted as late and left out.
+#
+# Percentiles come from a QuantileSketch: values are counted in buckets
+# whose bounds grow geometrically, so any percentile is within ACCURACY
+# (relative) of the true value, and sketches of two panes merge by adding
+# their bucket counts.
+#
+import json
+import math
+
+
+#
+# Definitions
+#
+ACCURACY = 0.01
+PERCENTILE_L = [50.0, 95.0, 99.0]
+
+# Values closer to 0 than this are counted as 0
+MIN_VALUE = 1e-9
+
+GAMMA = (1.0 + ACCURACY) / (1.0 - ACCURACY)
+INV_LOG_GAMMA = 1.0 / math.log(GAMMA)
+
+
+#
+# Subroutines
+#
+def parsePercentiles(spec):
+    # "50,95,99.9" -> [50.0, 95.0, 99.9]
+    pct_l = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        pct = float(item)
+        if not 0.0 <= pct <= 100.0:
+            raise ValueError("Percentile out of range [" + item + "]")
+        pct_l.append(pct)
+
+    return pct_l
+
+
+def pctName(pct):
+    # 50.0 -> "p50", 99.9 -> "p99.9"
+    return "p%g" % pct
+
+
+class QuantileSketch:
+    __slots__ = ("pos_d", "neg_d", "num_zero", "count")
+
+    def __init__(self):
+        self.pos_d = {}
+        self.neg_d = {}
+        self.num_zero = 0
+        self.count = 0
+
+    def add(self, val):
+        self.count += 1
+        if val > MIN_VALUE:
+            k = math.ceil(math.log(val) * INV_LOG_GAMMA)
+            self.pos_d[k] = self.pos_d.get(k, 0) + 1
+        elif val < -MIN_VALUE:
+            k = math.ceil(math.log(-val) * INV_LOG_GAMMA)
+            self.neg_d[k] = self.neg_d.get(k, 0) + 1
+        else:
+            self.num_zero += 1
+
+    def merge(self, other):
+        for (k, n) in other.pos_d.items():
+            self.pos_d[k] = self.pos_d.get(k, 0) + n
+        for (k, n) in other.neg_d.items():
+            self.neg_d[k] = self.neg_d.get(k, 0) + n
+        self.num_zero += other.num_zero
+        self.count += other.count
+
+    def copy(self):
+        sk = QuantileSketch()
+        sk.pos_d = dict(self.pos_d)
+        sk.neg_d = dict(self.neg_d)
+        sk.num_zero = self.num_zero
+        sk.count = self.count
+
+        return sk
+
+    def quantiles(self, q_l):
+        # Values at the (sorted) quantiles q_l (0 - 1)
+        if not self.count:
+            return [math.nan] * len(q_l)
+
+        # Buckets in value order: negative ones from the largest magnitude
+        bucket_l = [(-2.0 * GAMMA ** k / (GAMMA + 1.0), n)
+                    for (k, n) in sorted(self.neg_d.items(), reverse=True)]
+        if self.num_zero:
+            bucket_l.append((0.0, self.num_zero))
+        bucket_l.extend((2.0 * GAMMA ** k / (GAMMA + 1.0), n)
+                        for (k, n) in sorted(self.pos_d.items()))
+
+        val_l = []
+        it = iter(bucket_l)
+        (val, seen) = next(it)
+        for q in q_l:
+            rank = q * (self.count - 1)
+            while seen <= rank:
+                (val, n) = next(it)
+                seen += n
+            val_l.append(val)
+
+        return val_l
+
+
+class WindowAggregator:
+    def __init__(self, out, oformat="csv", window=60.0, slide=None,
+                 pct_l=None):
+        self.out = out
+        self.oformat = oformat
+        self.window = window
+        self.slide = slide or window
+        self.num_panes = int(round(window / self.slide))
+        if self.num_panes < 1\
+           or abs(self.num_panes * self.slide - window) > 1e-9 * window:
+            raise ValueError("The window must be a multiple of the slide")
+        self.pct_l = sorted(PERCENTILE_L if pct_l is None else pct_l)
+        self.q_l = [pct / 100.0 for pct in self.pct_l]
+
+        # Pane being filled: index (start / slide) and key -> [count, sum,
+        # min, max, sketch], with key SPN << 8 | SA; then the closed panes
+        # that are still part of a window
+        self.cur_idx = None
+        self.cur_d = {}
+        self.pane_l = []
+
+        # key -> (pgn, unit)
+        self.meta_d = {}
+
+        self.num_values = 0
+        self.num_late = 0
+        self.num_untimed = 0
+        self.num_windows = 0
+        self.num_rows = 0
+
+    def header(self):
+        if self.oformat != "csv":
+            return None
+
+        return "Window Start,Window End,PGN,Source Add,SPN,Count,Min,Max,"\
+            + "Mean," + ",".join(pctName(pct).upper() for pct in self.pct_l)\
+            + ",Unit"
+
+    def add(self, rec):
+        # rec: a decodeValues() record
+        (ts, pgn, dest_add, sa, val_l) = rec
+        if ts is None:
+            self.num_untimed += 1
+            return
+
+        idx = int(ts // self.slide)
+        if idx != self.cur_idx:
+            if self.cur_idx is None:
+                self.cur_idx = idx
+            elif idx > self.cur_idx:
+                self.advance(idx)
+            else:
+                self.num_late += len(val_l)
+                return
+
+        cur_d = self.cur_d
+        for (i, val) in val_l:
+            key = i.spn << 8 | sa
+            st = cur_d.get(key)
+            if st is None:
+                sk = QuantileSketch()
+                sk.add(val)
+                cur_d[key] = [1, val, val, val, sk]
+                if key not in self.meta_d:
+                    self.meta_d[key] = (pgn, i.unit)
+            else:
+                st[0] += 1
+                st[1] += val
+                if val < st[2]:
+                    st[2] = val
+                elif val > st[3]:
+                    st[3] = val
+                st[4].add(val)
+        self.num_values += len(val_l)
+
+    def advance(self, idx):
+        # Close panes up to (not including) pane idx, writing every window
+        # that ends on the way
+        while self.cur_idx < idx:
+            if self.cur_d:
+                self.pane_l.append((self.cur_idx, self.cur_d))
+                self.cur_d = {}
+            self.cur_idx += 1
+
+            first = self.cur_idx - self.num_panes
+            while self.pane_l and self.pane_l[0][0] < first:
+                self.pane_l.pop(0)
+            if not self.pane_l:
+                # Nothing left to write until pane idx
+                self.cur_idx = idx
+                break
+            self.writeWindow(self.cur_idx)
+
+    def writeWindow(self, end_idx):
+        # Write the window made of the panes before end_idx
+        merged_d = {}
+        for (pane_idx, pane_d) in self.pane_l:
+            for (key, st) in pane_d.items():
+                mst = merged_d.get(key)
+                if mst is None:
+                    merged_d[key] = st if self.num_panes == 1 else\
+                        [st[0], st[1], st[2], st[3], st[4].copy()]
+                else:
+                    mst[0] += st[0]
+                    mst[1] += st[1]
+                    mst[2] = min(mst[2], st[2])
+                    mst[3] = max(mst[3], st[3])
+                    mst[4].merge(st[4])
+
+        start = (end_idx - self.num_panes) * self.slide
+        end = end_idx * self.slide
+        row_l = []
+        for key in sorted(merged_d, key=lambda key: (key & 0xFF, key >> 8)):
+            (count, total, min_val, max_val, sk) = merged_d[key]
+            (pgn, unit) = self.meta_d[key]
+            # Estimates are kept within the exact min and max, which are
+            # also the 0th and 100th percentiles
+            pval_l = [min_val if q <= 0.0 else max_val if q >= 1.0\
+                      else min(max(val, min_val), max_val)
+                      for (q, val) in zip(self.q_l, sk.quantiles(self.q_l))]
+            row_l.append(self.formatRow(start, end, pgn, key & 0xFF, key >> 8,
+                                        count, min_val, max_val,
+                                        total / count, pval_l, unit))
+
+        self.out.write("".join(row_l))
+        self.num_windows += 1
+        self.num_rows += len(row_l)
+
+    def formatRow(self, start, end, pgn, sa, spn, count, min_val, max_val,
+                  mean, pval_l, unit):
+        if self.oformat == "csv":
+            return "%0.6f,%0.6f,%d,%d,%d,%d,%0.2f,%0.2f,%0.2f," % (
+                start, end, pgn, sa, spn, count, min_val, max_val, mean)\
+                + ",".join("%0.2f" % val for val in pval_l) + "," + unit\
+                + "\n"
+
+        row_d = {"start": start, "end": end, "pgn": pgn, "sa": sa,
+                 "spn": spn, "count": count, "min": min_val, "max": max_val,
+                 "mean": mean}
+        for (pct, val) in zip(self.pct_l, pval_l):
+            row_d[pctName(pct)] = val
+        row_d["unit"] = unit
+
+        return json.dumps(row_d, separators=(",", ":")) + "\n"
+
+    def close(self):
+        # Write the windows still open at the end of the input
+        if self.cur_idx is not None:
+            self.advance(self.cur_idx + self.num_panes)
+
+    def describe(self):
+        return "Aggregation: %d values in %d windows, %d rows, %d signals, "\
+               "%d late values, %d frames without timestamps" % (
+                   self.num_values, self.num_windows, self.num_rows,
+                   len(self.meta_d), self.num_late, self.num_untimed)
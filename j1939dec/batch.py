@@ -0,0 +1,229 @@
+#
+# NumPy batch decoder
+#
+# Frames are decoded a block at a time: CAN IDs as a uint32 array, payload
+# lengths as a uint16 array and the first 8 bytes of the payloads as an
+# (N, 8) uint8 matrix. Frames are grouped by PGN and source address and
+# every SPN of the group is extracted with one shift/mask/scale/offset over
+# the whole group, with the payload viewed as a little-endian uint64 per
+# frame. The shift, mask and sentinel ranges are the SPNDesc fields compiled
+# by the decode plan. As in the line decoder, a field is only taken from
+# frames long enough to hold it.
+#
+# Reassembled TP payloads longer than 8 bytes are kept as they are. SPNs
+# past their first 8 bytes are extracted one frame at a time, from the
+# frames of the group that hold them.
+#
+# The result is one contiguous float64 value array per (PGN, SA, SPN) along
+# with a timestamp array of the same length.
+#
+import numpy as np
+
+
+#
+# Definitions
+#
+BLOCK_SIZE = 65536
+
+
+#
+# Subroutines
+#
+def framesToArrays(frames):
+    # frames: list of (timestamp, can_id, data) tuples from FrameReader.
+    # Payloads are padded with 0xFF ("not available") up to 8 bytes; the
+    # ones longer than that are returned in long_d, by frame index.
+    n = len(frames)
+    ts = np.empty(n, dtype=np.float64)
+    ids = np.empty(n, dtype=np.uint32)
+    dlen = np.empty(n, dtype=np.uint16)
+    long_d = {}
+    buf = bytearray()
+
+    for (i, (t, can_id, data)) in enumerate(frames):
+        ts[i] = np.nan if t is None else t
+        ids[i] = can_id
+        dlen[i] = len(data)
+        if len(data) > 8:
+            long_d[i] = data
+        buf += data[:8].ljust(8, b"\xff")
+
+    payload = np.frombuffer(bytes(buf), dtype=np.uint8).reshape(-1, 8)
+
+    return (ts, ids, payload, dlen, long_d)
+
+
+def iterBlocks(frames, block_size=BLOCK_SIZE):
+    block_l = []
+    for frame in frames:
+        block_l.append(frame)
+        if len(block_l) == block_size:
+            yield framesToArrays(block_l)
+            block_l = []
+
+    if block_l:
+        yield framesToArrays(block_l)
+
+
+def compileGroup(spn_l):
+    # Turn the SPNDescs of one PGN into (spn, nbytes, shift, mask, err_min,
+    # scale, offset) tuples: NumPy scalars for fields within the first 8
+    # bytes, Python ints for the ones past them. SPNs that cannot be
+    # extracted are left out.
+    cspn_l = []
+    for i in spn_l:
+        if i.shift is None:
+            continue
+
+        if i.nbytes > 8:
+            cspn_l.append((i.spn, i.nbytes, i.shift, i.mask, i.err_min,
+                           i.scale_factor, i.offset))
+        else:
+            cspn_l.append((i.spn, i.nbytes, np.uint64(i.shift),
+                           np.uint64(i.mask), np.uint64(i.err_min),
+                           i.scale_factor, i.offset))
+
+    return cspn_l
+
+
+def extractLong(g_pos, g_dlen, long_d, nbytes, shift, mask, err_min, scale,
+                offset):
+    # A field past the first 8 bytes: (group indexes, values) of the frames
+    # that hold it, with "error" and "not available" values left out
+    sel_l = []
+    val_l = []
+    for j in np.flatnonzero(g_dlen >= nbytes):
+        pint = int.from_bytes(long_d[int(g_pos[j])], "little")
+        raw = (pint >> shift) & mask
+        if raw < err_min:
+            sel_l.append(j)
+            val_l.append(raw * scale + offset)
+
+    return (np.array(sel_l, dtype=np.intp), np.array(val_l, dtype=np.float64))
+
+
+def decodeBlock(plan, ts, ids, payload, dlen, long_d, out_d=None,
+                cache_d=None):
+    # Returns {(pgn, sa, spn): ([ts array, ...], [value array, ...])}; the
+    # lists collect one array pair per block and are joined by
+    # joinColumns().
+    if out_d is None:
+        out_d = {}
+    if cache_d is None:
+        cache_d = {}
+
+    # Only bits 25 and 24 == '00' are supported, as in the line decoder.
+    # pos maps what is left back to the frame indexes of long_d.
+    pos = np.arange(len(ids))
+    ok = ((ids >> 24) & 3) == 0
+    if not ok.all():
+        ts = ts[ok]
+        ids = ids[ok]
+        payload = payload[ok]
+        dlen = dlen[ok]
+        pos = pos[ok]
+
+    words = np.ascontiguousarray(payload).view("<u8").ravel()
+
+    pf = (ids >> 16) & 0xFF
+    pgn = np.where(pf < 240, pf << 8, (ids >> 8) & 0xFFFF)
+    key = (pgn.astype(np.uint32) << 8) | (ids & 0xFF)
+
+    # Stable sort so that frames keep their time order inside a group
+    order = np.argsort(key, kind="stable")
+    skey = key[order]
+    bounds = np.flatnonzero(np.diff(skey)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(skey)]))
+
+    for (start, end) in zip(starts, ends):
+        if start == end:
+            continue
+
+        k = int(skey[start])
+        (g_pgn, g_sa) = (k >> 8, k & 0xFF)
+
+        cspn_l = cache_d.get(g_pgn)
+        if cspn_l is None:
+            pgn_info = plan.getPGN(g_pgn)
+            cspn_l = compileGroup(pgn_info[2]) if pgn_info else []
+            cache_d[g_pgn] = cspn_l
+
+        if not cspn_l:
+            continue
+
+        idx = order[start:end]
+        g_words = words[idx]
+        g_ts = ts[idx]
+        g_dlen = dlen[idx]
+        min_dlen = int(g_dlen.min())
+
+        for (spn, nbytes, shift, mask, err_min, scale, offset) in cspn_l:
+            if nbytes > 8:
+                if not long_d:
+                    continue
+                (sel, val) = extractLong(pos[idx], g_dlen, long_d, nbytes,
+                                         shift, mask, err_min, scale, offset)
+                if not len(val):
+                    continue
+                s_ts = g_ts[sel]
+            else:
+                raw = (g_words >> shift) & mask
+
+                # Drop "error" and "not available" values, and fields past
+                # the end of the frame, as the line decoder does
+                avail = raw < err_min
+                if min_dlen < nbytes:
+                    avail &= g_dlen >= nbytes
+                if not avail.all():
+                    raw = raw[avail]
+                    s_ts = g_ts[avail]
+                else:
+                    s_ts = g_ts
+
+                if not len(raw):
+                    continue
+
+                val = raw.astype(np.float64)
+                val *= scale
+                val += offset
+
+            col = out_d.get((g_pgn, g_sa, spn))
+            if col is None:
+                col = ([], [])
+                out_d[(g_pgn, g_sa, spn)] = col
+            col[0].append(s_ts)
+            col[1].append(val)
+
+    return out_d
+
+
+def joinColumns(out_d):
+    # One contiguous timestamp and value array per (pgn, sa, spn)
+    ret_d = {}
+    for (key, (ts_l, val_l)) in out_d.items():
+        ret_d[key] = (np.concatenate(ts_l), np.concatenate(val_l))
+
+    return ret_d
+
+
+def decodeFrames(plan, frames, block_size=BLOCK_SIZE):
+    out_d = {}
+    cache_d = {}
+    for (ts, ids, payload, dlen, long_d) in iterBlocks(frames, block_size):
+        decodeBlock(plan, ts, ids, payload, dlen, long_d, out_d, cache_d)
+
+    return joinColumns(out_d)
+
+
+def saveColumns(cols_d, npz_file):
+    # Arrays are named <pgn>_<sa>_<spn>_ts and <pgn>_<sa>_<spn>_val
+    arr_d = {}
+    for ((pgn, sa, spn), (ts, val)) in cols_d.items():
+        name = "%d_%d_%d" % (pgn, sa, spn)
+        arr_d[name + "_ts"] = ts
+        arr_d[name + "_val"] = val
+
+    np.savez(npz_file, **arr_d)
+
+    return len(cols_d)
@@ -0,0 +1,244 @@
+#
+# Bulk decoding of a directory tree
+#
+# Every file below the input directory is decoded by a pool of long-lived
+# worker processes into processed_<name> under the same relative path in the
+# output directory. The decode plan is loaded once in the parent; forked
+# workers share it instead of opening the DB per file.
+#
+# Completed files are recorded (size, mtime, SHA-256) in an append-only
+# manifest in the output directory, so an interrupted run picks up where it
+# stopped. Outputs are written to a temporary file and renamed into place,
+# so a partial output file never appears under its final name.
+#
+import io
+import os
+import json
+import time
+import hashlib
+import multiprocessing
+
+from j1939dec.snapshot import loadPlan
+from j1939dec.decode import decodeStream
+from j1939dec.output import formatHeader
+from j1939dec.tp import TPReassembler
+
+
+#
+# Definitions
+#
+MANIFEST_FILE = ".jbd-manifest.jsonl"
+OUTPUT_PREFIX = "processed_"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Per-worker decode plan; inherited from the parent when workers are forked
+_plan = None
+
+
+#
+# Subroutines
+#
+class _HashingFile(io.RawIOBase):
+    # Raw binary reader that feeds everything read through a hash, so the
+    # input is hashed in the same pass that decodes it
+    def __init__(self, fo):
+        self.fo = fo
+        self.hobj = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.fo.readinto(b)
+        if n:
+            self.hobj.update(memoryview(b)[:n])
+        return n
+
+    def close(self):
+        self.fo.close()
+        super().close()
+
+
+def hashFile(fname):
+    hobj = hashlib.sha256()
+    with open(fname, "rb") as fo:
+        for blk in iter(lambda: fo.read(HASH_BLOCK_SIZE), b""):
+            hobj.update(blk)
+
+    return hobj.hexdigest()
+
+
+def loadManifest(out_dir):
+    # Later entries override earlier ones; a torn last line (interrupted
+    # write) is ignored
+    man_d = {}
+    man_file = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(man_file):
+        return man_d
+
+    with open(man_file) as fo:
+        for line in fo:
+            try:
+                ent = json.loads(line)
+            except ValueError:
+                continue
+            man_d[ent["file"]] = ent
+
+    return man_d
+
+
+def appendManifest(mfo, ent):
+    mfo.write(json.dumps(ent, sort_keys=True) + "\n")
+    mfo.flush()
+    os.fsync(mfo.fileno())
+
+
+def findInputs(in_dir):
+    # Relative paths of all regular files below in_dir, in a stable order
+    rel_l = []
+    for (dpath, dnames, fnames) in os.walk(in_dir):
+        dnames.sort()
+        for fname in sorted(fnames):
+            rel_l.append(os.path.relpath(os.path.join(dpath, fname), in_dir))
+
+    return rel_l
+
+
+def outputPath(out_dir, rel):
+    (dname, fname) = os.path.split(rel)
+    return os.path.join(out_dir, dname, OUTPUT_PREFIX + fname)
+
+
+def isDone(in_dir, out_dir, rel, man_d):
+    # A file is done if the manifest has it with the same size and mtime (or,
+    # if only the mtime changed, the same content hash) and its output exists
+    ent = man_d.get(rel)
+    if not ent or not os.path.exists(outputPath(out_dir, rel)):
+        return False
+
+    st = os.stat(os.path.join(in_dir, rel))
+    if st.st_size != ent["size"]:
+        return False
+    if st.st_mtime_ns == ent["mtime_ns"]:
+        return True
+
+    return hashFile(os.path.join(in_dir, rel)) == ent["sha256"]
+
+
+def initWorker(dbfile, snap_file=None):
+    global _plan
+
+    if _plan is None:
+        _plan = loadPlan(dbfile, snap_file)
+
+
+def decodeFile(job):
+    # Returns the manifest entry of the file, or {"file": ..., "error": ...}
+    # if it could not be decoded, so that one bad file does not end the run
+    (in_file, out_file, rel, oformat, iformat, reassemble) = job
+
+    t0 = time.perf_counter()
+    try:
+        ent = _decodeFile(in_file, out_file, rel, oformat, iformat,
+                          reassemble)
+    except Exception as e:
+        return {"file": rel, "error": str(e) or type(e).__name__}
+    ent["seconds"] = round(time.perf_counter() - t0, 3)
+
+    return ent
+
+
+def _decodeFile(in_file, out_file, rel, oformat, iformat, reassemble):
+    st = os.stat(in_file)
+
+    (dname, fname) = os.path.split(out_file)
+    tmp_file = os.path.join(dname, "." + fname + ".tmp")
+
+    hfo = _HashingFile(open(in_file, "rb"))
+    ifo = io.TextIOWrapper(io.BufferedReader(hfo, HASH_BLOCK_SIZE),
+                           errors="replace")
+    try:
+        with open(tmp_file, "w", buffering=HASH_BLOCK_SIZE) as ofo:
+            if formatHeader(oformat):
+                print(formatHeader(oformat), file=ofo)
+            tp = TPReassembler() if reassemble else None
+            rdr = decodeStream(ifo, _plan, oformat, iformat, ofo, tp)
+            if not rdr.fmt and rdr.num_lines:
+                raise ValueError("Unknown log format")
+            ofo.flush()
+            os.fsync(ofo.fileno())
+
+        # The hash is of the whole file, also if the decode stopped early
+        buf = bytearray(HASH_BLOCK_SIZE)
+        while hfo.readinto(buf):
+            pass
+        os.replace(tmp_file, out_file)
+    finally:
+        ifo.close()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return {
+        "file": rel,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": hfo.hobj.hexdigest(),
+        "lines": rdr.num_lines,
+        "frames": rdr.num_frames}
+
+
+def decodeTree(in_dir, out_dir, dbfile, oformat=None, iformat=None, jobs=None,
+               progress=None, reassemble=True, snap_file=None):
+    # Returns (number of files decoded, number of files skipped, number of
+    # files that failed). progress(ent) is called per file, with the error
+    # entry of decodeFile() for failed files; these are not added to the
+    # manifest and are tried again on the next run.
+    if not jobs:
+        jobs = os.cpu_count() or 1
+
+    man_d = loadManifest(out_dir)
+
+    # The output directory may live inside the input directory
+    out_abs = os.path.abspath(out_dir) + os.sep
+    if out_abs == os.path.abspath(in_dir) + os.sep:
+        out_abs = None
+
+    job_l = []
+    num_skipped = 0
+    for rel in findInputs(in_dir):
+        fname = os.path.basename(rel)
+        if fname == MANIFEST_FILE or fname.startswith(OUTPUT_PREFIX):
+            continue
+        if out_abs and os.path.abspath(os.path.join(in_dir, rel)).startswith(out_abs):
+            continue
+        if isDone(in_dir, out_dir, rel, man_d):
+            num_skipped += 1
+            continue
+
+        out_file = outputPath(out_dir, rel)
+        os.makedirs(os.path.dirname(out_file), exist_ok=True)
+        job_l.append((os.path.join(in_dir, rel), out_file, rel, oformat,
+                      iformat, reassemble))
+
+    if not job_l:
+        return (0, num_skipped, 0)
+
+    # Load the plan before the pool is started, so that forked workers share
+    # it copy-on-write instead of each reading the DB again
+    initWorker(dbfile, snap_file)
+
+    num_done = 0
+    num_failed = 0
+    man_file = os.path.join(out_dir, MANIFEST_FILE)
+    with open(man_file, "a") as mfo:
+        with multiprocessing.Pool(jobs, initWorker, (dbfile, snap_file)) as pool:
+            for ent in pool.imap_unordered(decodeFile, job_l):
+                if "error" in ent:
+                    num_failed += 1
+                else:
+                    appendManifest(mfo, ent)
+                    num_done += 1
+                if progress:
+                    progress(ent)
+
+    return (num_done, num_skipped, num_failed)
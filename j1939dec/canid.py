@@ -0,0 +1,80 @@
+#
+# Decoded CAN IDs
+#
+# decodeID() turns a 29-bit CAN ID into its PGN, destination and source
+# addresses, their labels and the SPNs of the PGN. ID dumps and logs hold
+# millions of lines but only a few hundred distinct IDs, so LRUCache keeps
+# the result (or anything made from it) per ID, up to a bounded number of
+# IDs, and counts hits and misses.
+#
+from collections import OrderedDict, namedtuple
+
+from j1939dec.output import MSG_RESERVED, msgNotInDB, splitID
+
+
+#
+# Definitions
+#
+# dest_add/dest are None for PDU2 PGNs; spn_l holds (label, spn) pairs
+IDInfo = namedtuple("IDInfo", ["can_id", "priority", "pgn", "dest_add", "sa",
+                               "label", "acronym", "dest", "source",
+                               "spn_l"])
+
+CACHE_SIZE = 4096
+
+
+#
+# Subroutines
+#
+def decodeID(can_id, plan):
+    # (IDInfo, None), or (None, error message)
+    if (can_id >> 24) & 3:
+        return (None, MSG_RESERVED)
+
+    (pgn, dest_add, sa) = splitID(can_id)
+    pgn_info = plan.getPGN(pgn)
+    if not pgn_info:
+        return (None, msgNotInDB(pgn, sa))
+
+    (label, acronym, spn_l) = pgn_info
+    dest = None if dest_add is None else plan.getSALabel(dest_add)
+    info = IDInfo(can_id, (can_id >> 26) & 7, pgn, dest_add, sa, label,
+                  acronym, dest, plan.getSALabel(sa),
+                  [(i[0], i[1]) for i in spn_l])
+
+    return (info, None)
+
+
+class LRUCache:
+    def __init__(self, func, size=CACHE_SIZE):
+        # func(key) makes the value of a key that is not cached
+        self.func = func
+        self.size = size
+        self.cache_d = OrderedDict()
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get(self, key):
+        cache_d = self.cache_d
+        try:
+            val = cache_d[key]
+        except KeyError:
+            self.num_misses += 1
+            val = cache_d[key] = self.func(key)
+            if len(cache_d) > self.size:
+                cache_d.popitem(last=False)
+            return val
+
+        self.num_hits += 1
+        cache_d.move_to_end(key)
+
+        return val
+
+    def hitRatio(self):
+        return self.num_hits / max(self.num_hits + self.num_misses, 1)
+
+    def describe(self):
+        return "ID cache: %d hits, %d misses (%0.1f%% hits), %d of %d IDs" % (
+            self.num_hits, self.num_misses, 100.0 * self.hitRatio(),
+            len(self.cache_d), self.size)
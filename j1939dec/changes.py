@@ -0,0 +1,123 @@
+#
+# Change-only (report-by-exception) output
+#
+# A ChangeFilter passes an SPN value on only if it differs from the last
+# value passed on for the same (source address, SPN) by more than the
+# deadband of the SPN, or if the heartbeat interval has passed since then.
+# The first value of every signal is always passed on. Comparing with the
+# last value passed on (not the last value seen) means a slow drift is
+# still reported once it adds up to more than the deadband.
+#
+# A deadband is absolute, relative (a fraction of the last value), or the
+# sum of both; the default of 0 passes every change.
+#
+# The last-value table is compact: a dict from (SPN << 8 | SA) to a slot in
+# two arrays of doubles, the last value and the time it was passed on.
+#
+import math
+from array import array
+
+
+#
+# Definitions
+#
+# (absolute, relative) deadband of SPNs without one of their own
+DEFAULT_BAND = (0.0, 0.0)
+
+
+#
+# Subroutines
+#
+def parseDeadbands(spec):
+    # "190:25,110:1,*:0.5%" -> ({190: (25.0, 0.0), 110: (1.0, 0.0)},
+    #                           (0.0, 0.005))
+    # "<spn>:<abs>+<rel>%" sets both
+    band_d = {}
+    default = DEFAULT_BAND
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        (spn, sep, band) = item.partition(":")
+        if not sep:
+            raise ValueError("Expected <spn>:<deadband> [" + item + "]")
+
+        abs_db = 0.0
+        rel_db = 0.0
+        for part in band.split("+"):
+            part = part.strip()
+            if part.endswith("%"):
+                rel_db = float(part[:-1]) / 100.0
+            else:
+                abs_db = float(part)
+        if abs_db < 0 or rel_db < 0:
+            raise ValueError("Negative deadband [" + item + "]")
+
+        if spn.strip() == "*":
+            default = (abs_db, rel_db)
+        else:
+            band_d[int(spn, 0)] = (abs_db, rel_db)
+
+    return (band_d, default)
+
+
+class ChangeFilter:
+    def __init__(self, band_d=None, default=DEFAULT_BAND, heartbeat=None):
+        self.band_d = band_d or {}
+        self.default = default
+        self.heartbeat = heartbeat or 0.0
+
+        self.slot_d = {}
+        self.val_a = array("d")
+        self.ts_a = array("d")
+
+        self.num_in = 0
+        self.num_out = 0
+
+    def band(self, spn):
+        return self.band_d.get(spn, self.default)
+
+    def test(self, key, ts, val, abs_db, rel_db):
+        # True if the value is to be passed on; key is SPN << 8 | SA
+        self.num_in += 1
+
+        slot = self.slot_d.get(key)
+        if slot is None:
+            self.slot_d[key] = len(self.val_a)
+            self.val_a.append(val)
+            self.ts_a.append(math.nan if ts is None else ts)
+            self.num_out += 1
+            return True
+
+        last = self.val_a[slot]
+        if abs(val - last) <= abs_db + rel_db * abs(last):
+            # Within the deadband; only the heartbeat passes it on. Frames
+            # without a timestamp have no heartbeat (nan compares False).
+            if not self.heartbeat or ts is None\
+               or not ts - self.ts_a[slot] >= self.heartbeat:
+                return False
+
+        self.val_a[slot] = val
+        self.ts_a[slot] = math.nan if ts is None else ts
+        self.num_out += 1
+
+        return True
+
+    def filterRecord(self, rec):
+        # A decodeValues() record with only the values to pass on, or None
+        (ts, pgn, dest_add, sa, val_l) = rec
+        band_d = self.band_d
+        default = self.default
+
+        val_l = [(i, val) for (i, val) in val_l
+                 if self.test(i.spn << 8 | sa, ts, val,
+                              *band_d.get(i.spn, default))]
+        if not val_l:
+            return None
+
+        return (ts, pgn, dest_add, sa, val_l)
+
+    def describe(self):
+        return "Changes: %d of %d values written (%0.1f%%), %d signals" % (
+            self.num_out, self.num_in,
+            100.0 * self.num_out / max(self.num_in, 1), len(self.slot_d))
@@ -0,0 +1,115 @@
+#
+# Frame decoder
+#
+# Decodes (timestamp, can_id, data) frames against a DecodePlan and writes
+# the output of one of the formatters in j1939dec.output to "out".
+# decodeValues() is the same decode without any text, for sinks that store
+# numbers.
+#
+import sys
+
+from j1939dec.reader import FrameReader
+from j1939dec.output import FLUSH_THROUGHPUT, BufferedSink, makeFormatter
+from j1939dec.idfilter import filterFrames, readerFilter
+
+
+#
+# Subroutines
+#
+def procFrame(frame, plan, oformat, out=None):
+    # One frame, without the Begin/End lines; CSV and JSON Lines errors go
+    # to STDERR. For many frames, use decodeFrames() (or a formatter from
+    # j1939dec.output), which compiles every CAN ID only once.
+    if out is None:
+        out = sys.stdout
+
+    out.write(makeFormatter(oformat, plan, markers=False).format(frame))
+
+
+def decodeValues(frame, plan):
+    # Returns (timestamp, pgn, dest add, source add, [(SPNDesc, value), ...])
+    # with dest add 255 for PDU2 PGNs, or None if the frame cannot be decoded
+    (epoch_ts, can_id, can_data) = frame
+
+    if (can_id >> 24) & 3:
+        return None
+
+    pf = (can_id >> 16) & 0xFF
+    if pf < 240:
+        pgn = pf << 8
+        dest_add = (can_id >> 8) & 0xFF
+    else:
+        pgn = (can_id >> 8) & 0xFFFF
+        dest_add = 255
+
+    pgn_info = plan.getPGN(pgn)
+    if not pgn_info:
+        return None
+
+    pint = int.from_bytes(can_data, "little")
+    dlen = len(can_data)
+
+    val_l = []
+    for i in pgn_info[2]:
+        if i.shift is None or i.nbytes > dlen:
+            continue
+
+        raw = (pint >> i.shift) & i.mask
+        if raw >= i.err_min:
+            continue
+
+        val_l.append((i, raw * i.scale_factor + i.offset))
+
+    return (epoch_ts, pgn, dest_add, can_id & 0xFF, val_l)
+
+
+def decodeStream(ifo, plan, oformat, iformat=None, out=None, tp=None,
+                 flush=FLUSH_THROUGHPUT, id_filter=None, changes=None,
+                 stats=None, timers=None):
+    # Decode every frame of an input stream; returns the FrameReader so that
+    # callers can look at its line/frame counters. If a TPReassembler is
+    # given, TP.CM/TP.DT frames are reassembled before decoding. Only frames
+    # whose CAN ID passes id_filter (an IDFilter) are decoded, and only the
+    # values that changes (a ChangeFilter) passes on are written. A
+    # DecodeStats (stats) is given the counts and times of the run, and
+    # StageTimers (timers, see j1939dec.profiling) time every stage; the
+    # stats are stage timers as well, so only one of the two is used.
+    if out is None:
+        out = sys.stdout
+
+    if stats or timers:
+        ifo = (stats or timers).wrapInput(ifo)
+    rdr = FrameReader(ifo, iformat, readerFilter(id_filter, tp))
+    frames = filterFrames(rdr, id_filter, tp)
+    if stats:
+        stats.rdr = rdr
+        stats.id_filter = id_filter
+        stats.tp = tp
+
+    decodeFrames(frames, plan, oformat, out, flush, changes, stats, timers)
+
+    return rdr
+
+
+def decodeFrames(frames, plan, oformat, out=None, flush=FLUSH_THROUGHPUT,
+                 changes=None, stats=None, timers=None):
+    # Decode an iterable of frames; returns the number of frames
+    if out is None:
+        out = sys.stdout
+
+    fmt = makeFormatter(oformat, plan, changes=changes)
+    sink = BufferedSink(out, flush)
+    format = fmt.format
+    write = sink.write
+
+    n = 0
+    if stats:
+        n = stats.run(frames, fmt, write)
+    elif timers:
+        n = timers.run(frames, fmt, write)
+    else:
+        for n,frame in enumerate(frames, 1):
+            write(format(frame))
+    sink.flush()
+
+    return n
@@ -0,0 +1,280 @@
+#
+# Decoder library API
+#
+# A Decoder is made once from a DB (and optionally its snapshot) and reused
+# for any number of frames, logs and lookups, without going through the
+# command line tools or their text output:
+#
+#   from j1939dec import Decoder
+#
+#   with Decoder("j1939da-pgn-spn-oct22.db") as dec:
+#       for rec in dec.decodeFile("can-msgs.txt"):
+#           for val in rec.values:
+#               print(rec.ts, rec.sa, val.spn, val.value, val.unit)
+#       print(dec.pgnInfo(61444))
+#
+# Records are named tuples; a frame is (timestamp or None, 29-bit CAN ID,
+# data bytes), as read by j1939dec.reader. The decode tables are loaded on
+# first use and the DB is only opened for the pgnInfo(), pgnSPNs(),
+# spnInfo() and saInfo() lookups, so a Decoder used for one or the other
+# only pays for what it uses.
+#
+import os
+import sqlite3
+from collections import namedtuple
+
+from j1939dec.canid import LRUCache, decodeID
+from j1939dec.decode import decodeStream, decodeValues
+from j1939dec.idfilter import filterFrames, readerFilter
+from j1939dec.output import FLUSH_THROUGHPUT
+from j1939dec.reader import FrameReader, parseLine
+from j1939dec.profiling import Profiler, defaultFile, inputSize
+from j1939dec.schema import getVersion, openReadOnly
+from j1939dec.snapshot import dbFingerprint, loadPlan
+from j1939dec.tp import TPReassembler
+
+
+#
+# Definitions
+#
+# dest_add is 255 for PDU2 PGNs
+Record = namedtuple("Record", ["ts", "pgn", "dest_add", "sa", "values"])
+SPNValue = namedtuple("SPNValue", ["spn", "label", "value", "unit"])
+
+PGNInfo = namedtuple("PGNInfo", ["pgn", "acronym", "label", "description"])
+SPNInfo = namedtuple("SPNInfo", ["spn", "label", "sp_start_bit", "byte_num",
+                                 "bit_len", "bit_start", "scale_factor",
+                                 "offset", "transmission_rate",
+                                 "description"])
+
+
+#
+# Subroutines
+#
+class Decoder:
+    def __init__(self, dbfile, snap_file=None, warn=None):
+        # warn(msg) is told why a snapshot was not used
+        if not os.path.exists(dbfile) and not (snap_file
+                                               and os.path.exists(snap_file)):
+            raise FileNotFoundError(dbfile + ": Not found!")
+
+        self.dbfile = dbfile
+        self.snap_file = snap_file
+        self.warn = warn
+
+        self._plan = None
+        self.dbcon = None
+        self.id_cache = LRUCache(self._decodeID)
+
+    @property
+    def plan(self):
+        # The decode plan (DecodePlan or SnapshotPlan), loaded on first use
+        if self._plan is None:
+            self._plan = loadPlan(self.dbfile, self.snap_file, self.warn)
+
+        return self._plan
+
+    def db(self):
+        if self.dbcon is None:
+            self.dbcon = openReadOnly(self.dbfile)
+
+        return self.dbcon
+
+    def close(self):
+        if self.dbcon:
+            self.dbcon.close()
+            self.dbcon = None
+        if self._plan is not None and hasattr(self._plan, "close"):
+            self._plan.close()
+        self._plan = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #
+    # Decoding
+    #
+    def decodeFrame(self, frame):
+        # A Record, or None if the frame cannot be decoded
+        rec = decodeValues(frame, self.plan)
+        if rec is None:
+            return None
+
+        (ts, pgn, dest_add, sa, val_l) = rec
+
+        return Record(ts, pgn, dest_add, sa,
+                      [SPNValue(i.spn, i.label, val, i.unit)
+                       for (i, val) in val_l])
+
+    def decodeLine(self, line, iformat=None):
+        # One line of a log; None if it is not a CAN message or cannot be
+        # decoded
+        frame = parseLine(line, iformat)
+        if not frame:
+            return None
+
+        return self.decodeFrame(frame)
+
+    def decodeFrames(self, frames, reassemble=True, id_filter=None):
+        # Records of the frames that can be decoded, multi-packet messages
+        # reassembled first; id_filter is an IDFilter
+        tp = TPReassembler() if reassemble else None
+        if tp:
+            frames = tp.process(frames)
+        if id_filter:
+            frames = id_filter.filter(frames)
+
+        decodeFrame = self.decodeFrame
+        for frame in frames:
+            rec = decodeFrame(frame)
+            if rec:
+                yield rec
+
+    def decodeFile(self, ifo, iformat=None, reassemble=True, id_filter=None):
+        # Records of a log, given as a file name or an open text file;
+        # iformat is detected if not given
+        if isinstance(ifo, (str, os.PathLike)):
+            with open(ifo) as fo:
+                yield from self.decodeFile(fo, iformat, reassemble, id_filter)
+            return
+
+        tp = TPReassembler() if reassemble else None
+        rdr = FrameReader(ifo, iformat, readerFilter(id_filter, tp))
+        frames = filterFrames((frame for frame in rdr if frame), id_filter,
+                              tp)
+
+        decodeFrame = self.decodeFrame
+        for frame in frames:
+            rec = decodeFrame(frame)
+            if rec:
+                yield rec
+
+    def writeFile(self, ifo, oformat, out=None, iformat=None, reassemble=True,
+                  flush=FLUSH_THROUGHPUT, id_filter=None, changes=None,
+                  stats=None, timers=None):
+        # Write the text output (see j1939dec.output) of a log to out;
+        # returns the FrameReader with the line/frame counters. stats is a
+        # j1939dec.stats.DecodeStats, timers the StageTimers of a profiler.
+        tp = TPReassembler() if reassemble else None
+
+        return decodeStream(ifo, self.plan, oformat, iformat, out, tp, flush,
+                            id_filter, changes, stats, timers)
+
+    #
+    # Profiling
+    #
+    def dbVersion(self):
+        # What identifies the decode tables: the DB's schema version, DA
+        # revision, size and change counter, or the snapshot used
+        ver_d = {"db": self.dbfile}
+        snap_file = getattr(self._plan, "snap_file", None)
+        if snap_file:
+            ver_d["snapshot"] = snap_file
+        if not os.path.exists(self.dbfile):
+            return ver_d
+
+        (ver_d["db_size"], ver_d["db_counter"], digest) = dbFingerprint(
+            self.dbfile, False)
+        dbcon = self.db()
+        ver_d["schema_version"] = getVersion(dbcon)
+        try:
+            row = dbcon.execute("SELECT value FROM meta WHERE key = ?",
+                                ("da_revision",)).fetchone()
+        except sqlite3.OperationalError:
+            # DBs built before the meta table existed
+            row = None
+        ver_d["da_revision"] = row[0] if row else None
+
+        return ver_d
+
+    def profiler(self, mode, out_file=None, ifo=None, tag_d=None):
+        # A Profiler tagged with the input (a file name or open file) and
+        # the DB version; use it as a context manager around the decode,
+        # and pass its timers to writeFile() in "stages" mode
+        tag_d = dict(tag_d or {})
+        if isinstance(ifo, (str, os.PathLike)):
+            tag_d.setdefault("input", str(ifo))
+            tag_d.setdefault("input_size", os.path.getsize(ifo))
+        elif ifo is not None:
+            tag_d.setdefault("input", getattr(ifo, "name", None))
+            tag_d.setdefault("input_size", inputSize(ifo))
+        tag_d.update(self.dbVersion())
+
+        return Profiler(mode, out_file or defaultFile("j1939dec", mode),
+                        tag_d)
+
+    #
+    # Lookups
+    #
+    def _decodeID(self, can_id):
+        return decodeID(can_id, self.plan)
+
+    def idInfo(self, can_id):
+        # (canid.IDInfo, None), or (None, error message)
+        return self.id_cache.get(can_id)
+
+    def pgnInfo(self, pgn):
+        # A PGNInfo, or None if the PGN is not in the DB
+        q = ""\
+          + "SELECT "\
+            + "pgn, "\
+            + "acronym, "\
+            + "label, "\
+            + "description "\
+          + "FROM "\
+            + "pgn "\
+          + "WHERE pgn = ?"
+
+        row = self.db().execute(q, (pgn,)).fetchone()
+
+        return PGNInfo(*row) if row else None
+
+    def pgnSPNs(self, pgn):
+        # [(spn, label), ...] of the SPNs of a PGN
+        q = ""\
+          + "SELECT "\
+            + "spn, "\
+            + "label "\
+          + "FROM "\
+            + "spn "\
+          + "WHERE pgn_id = (SELECT pgn_id FROM pgn WHERE pgn = ?)"
+
+        return self.db().execute(q, (pgn,)).fetchall()
+
+    def spnInfo(self, pgn, spn):
+        # An SPNInfo, or None if the SPN is not in the PGN
+        q = ""\
+          + "SELECT "\
+            + "spn, "\
+            + "label, "\
+            + "sp_start_bit, "\
+            + "byte_num, "\
+            + "bit_len, "\
+            + "bit_start, "\
+            + "scale_factor, "\
+            + "offset, "\
+            + "transmission_rate, "\
+            + "description "\
+          + "FROM "\
+            + "spn "\
+          + "WHERE pgn_id = (SELECT pgn_id FROM pgn WHERE pgn = ?) AND spn = ?"
+
+        row = self.db().execute(q, (pgn, spn)).fetchone()
+
+        return SPNInfo(*row) if row else None
+
+    def saInfo(self, sa):
+        # The label of a source address, or None if it is not in the DB
+        q = ""\
+          + "SELECT "\
+            + "label "\
+          + "FROM "\
+            + "sa "\
+          + "WHERE sa = ?"
+
+        row = self.db().execute(q, (sa,)).fetchone()
+
+        return row[0] if row else None
@@ -0,0 +1,238 @@
+#
+# CAN ID filters
+#
+# A filter selects frames by their 29-bit CAN ID only, so it can be applied
+# by the log reader right after the ID of a line is parsed, before the
+# payload is parsed and before any decode table lookup. Every constraint
+# that is given must hold; within a constraint, any of its values will do:
+#
+#   pgn    PGN (PDU1 PGNs without the destination address)
+#   sa     source address
+#   da     destination address (255 for PDU2 PGNs, as in the decoded output)
+#   prio   priority (0 - 7)
+#   mask   (id, mask) pairs; can_id & mask == id & mask
+#   range  (lo, hi) pairs; lo <= can_id <= hi
+#
+# The outcome is cached per CAN ID, as a log only holds a few hundred
+# distinct IDs.
+#
+# With PGN and/or SA constraints, the filter can also build regular
+# expressions for the hex text of the matching IDs. The reader then scans
+# blocks of the raw log with them and only splits and parses the lines they
+# hit, which skips most of a log when few of its frames are wanted. This
+# relies on IDs being written in upper case with at least seven hex digits,
+# as candump and PEAK do; ASC logs (no leading zeros) are not pre-scanned.
+# Every expression starts with literal text, which is what lets the regular
+# expression engine skip ahead quickly, so a few expressions are scanned
+# one after the other rather than one with alternatives.
+#
+# Multi-packet (TP) messages get their PGN from the TP.CM payload, so a
+# filter made by forTP() passes every TP.CM/TP.DT frame of the wanted
+# source addresses; the reassembled messages then go through filter().
+#
+import re
+
+
+#
+# Definitions
+#
+PF_TP_CM = 0xEC
+PF_TP_DT = 0xEB
+
+# Results cached per filter; the cache starts over when full
+ID_CACHE_SIZE = 65536
+
+# More expressions than this make the pre-scan slower than parsing
+MAX_NEEDLES = 16
+
+HEX = "[0-9A-F]"
+
+
+#
+# Subroutines
+#
+def parseInt(text):
+    # Hex with a 0x prefix, decimal otherwise (leading zeros and all, which
+    # int(text, 0) does not take)
+    text = text.strip()
+    try:
+        if text[:2].lower() == "0x":
+            return int(text[2:], 16)
+        return int(text, 10)
+    except ValueError:
+        raise ValueError("Invalid number [" + text + "]") from None
+
+
+def parseIntList(spec, max_val=None):
+    # "61444,0xFEF1,65260-65270" -> [61444, 65265, 65260, ..., 65270]
+    val_l = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        (lo, sep, hi) = item.partition("-")
+        lo = parseInt(lo)
+        hi = parseInt(hi) if sep else lo
+        if lo > hi or lo < 0 or (max_val is not None and hi > max_val):
+            raise ValueError("Out of range [" + item + "]")
+        val_l.extend(range(lo, hi + 1))
+
+    return val_l
+
+
+def parseMasks(spec):
+    # "0x00FEF100/0x00FFFF00,..." -> [(0x00FEF100, 0x00FFFF00), ...]
+    mask_l = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        (can_id, sep, mask) = item.partition("/")
+        if not sep:
+            raise ValueError("Expected <id>/<mask> [" + item + "]")
+        mask_l.append((parseInt(can_id), parseInt(mask)))
+
+    return mask_l
+
+
+def parseRanges(spec):
+    # "0x18FEF100-0x18FEF1FF,..." -> [(0x18FEF100, 0x18FEF1FF), ...]
+    range_l = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        (lo, sep, hi) = item.partition("-")
+        if not sep:
+            raise ValueError("Expected <low id>-<high id> [" + item + "]")
+        (lo, hi) = (parseInt(lo), parseInt(hi))
+        if lo > hi:
+            raise ValueError("Expected <low id>-<high id> [" + item + "]")
+        range_l.append((lo, hi))
+
+    return range_l
+
+
+class IDFilter:
+    def __init__(self, pgn_l=None, sa_l=None, da_l=None, prio_l=None,
+                 mask_l=None, range_l=None, pass_tp=False):
+        self.pgn_s = set(pgn_l) if pgn_l else None
+        self.sa_s = set(sa_l) if sa_l else None
+        self.da_s = set(da_l) if da_l else None
+        self.prio_s = set(prio_l) if prio_l else None
+        self.mask_l = list(mask_l) if mask_l else None
+        self.range_l = list(range_l) if range_l else None
+        self.pass_tp = pass_tp
+
+        self.cache_d = {}
+        self.num_tested = 0
+
+    def forTP(self):
+        # The same filter, also passing the TP frames of the wanted SAs
+        return IDFilter(self.pgn_s, self.sa_s, self.da_s, self.prio_s,
+                        self.mask_l, self.range_l, True)
+
+    def test(self, can_id):
+        pf = (can_id >> 16) & 0xFF
+        sa = can_id & 0xFF
+
+        if self.sa_s is not None and sa not in self.sa_s:
+            return False
+
+        if self.pass_tp and (pf == PF_TP_CM or pf == PF_TP_DT)\
+           and not (can_id >> 24) & 3:
+            return True
+
+        if pf < 240:
+            pgn = pf << 8
+            da = (can_id >> 8) & 0xFF
+        else:
+            pgn = (can_id >> 8) & 0xFFFF
+            da = 255
+
+        if self.pgn_s is not None and pgn not in self.pgn_s:
+            return False
+        if self.da_s is not None and da not in self.da_s:
+            return False
+        if self.prio_s is not None and (can_id >> 26) & 7 not in self.prio_s:
+            return False
+        if self.mask_l is not None and not any(
+                can_id & mask == val & mask for (val, mask) in self.mask_l):
+            return False
+        if self.range_l is not None and not any(
+                lo <= can_id <= hi for (lo, hi) in self.range_l):
+            return False
+
+        return True
+
+    def keep(self, can_id):
+        ok = self.cache_d.get(can_id)
+        if ok is None:
+            if len(self.cache_d) >= ID_CACHE_SIZE:
+                self.cache_d.clear()
+            ok = self.cache_d[can_id] = self.test(can_id)
+            self.num_tested += 1
+
+        return ok
+
+    def filter(self, frames):
+        keep = self.keep
+        for frame in frames:
+            if keep(frame[1]):
+                yield frame
+
+    def prescanRegexes(self):
+        # Regular expressions for the last six hex digits (PF, PS, SA) of
+        # the IDs that can pass, followed by the end of the ID text; a line
+        # without a hit by any of them cannot pass. None if there are too
+        # many to be quicker than parsing, or no PGN or SA constraint to
+        # build them from.
+        pfps_l = None
+        if self.pgn_s is not None:
+            pfps_s = set()
+            for pgn in self.pgn_s:
+                pf = (pgn >> 8) & 0xFF
+                if pf < 240:
+                    pfps_s.add("%02X" % pf + HEX + HEX)
+                else:
+                    pfps_s.add("%04X" % (pgn & 0xFFFF))
+            if self.pass_tp:
+                pfps_s.add("%02X" % PF_TP_CM + HEX + HEX)
+                pfps_s.add("%02X" % PF_TP_DT + HEX + HEX)
+            pfps_l = sorted(pfps_s)
+
+        sa_l = None
+        if self.sa_s is not None:
+            sa_l = ["%02X" % sa for sa in sorted(self.sa_s)]
+
+        if pfps_l and sa_l and len(pfps_l) * len(sa_l) <= MAX_NEEDLES:
+            needle_l = [pfps + sa for pfps in pfps_l for sa in sa_l]
+        elif pfps_l and len(pfps_l) <= MAX_NEEDLES:
+            needle_l = [pfps + HEX + HEX for pfps in pfps_l]
+        elif sa_l and len(sa_l) <= MAX_NEEDLES:
+            # Matches at the end of the ID, so that the SA is the literal
+            # the scan starts from
+            needle_l = sa_l
+        else:
+            return None
+
+        return [re.compile(needle + r"[\s#]") for needle in needle_l]
+
+
+def readerFilter(id_filter, tp=None):
+    # The filter for FrameReader when TP messages are reassembled after it
+    if id_filter and tp:
+        return id_filter.forTP()
+
+    return id_filter
+
+
+def filterFrames(frames, id_filter, tp=None):
+    # Reassemble TP messages (if tp is given) from the frames of a reader
+    # made with readerFilter(), and apply the filter to the result
+    if tp:
+        frames = tp.process(frames)
+        if id_filter:
+            frames = id_filter.filter(frames)
+
+    return frames
@@ -0,0 +1,615 @@
+#
+# Digital Annex bulk loader
+#
+# Shared by j1939-pgn-spn-ingest.py and j1939-source-add-ingest.py. Records
+# come in as lists of fields, in the column layout of the DA sheets, either
+# from a TSV export or straight from the .xlsx (see j1939dec.xlsx). PGNs are
+# de-duplicated in memory and rows are written with executemany() in batches,
+# all inside one transaction.
+#
+import re
+import sys
+import sqlite3
+
+from j1939dec.schema import fillDecodeColumns
+
+
+#
+# Definitions
+#
+NUM_FLDS = 46
+#x REQD_FLD_IDX_L = [4, 5, 6, 7, 20, 21, 22, 23, 24, 29, 34, 35]
+PGN_FLD_MAP = {
+  "pgn": 4,
+  "label": 5,
+  "acronym": 6,
+  "description": 7}
+SPN_FLD_MAP = {
+  "transmission_rate": 15,
+  "sp_start_bit": 20,
+  "spn": 21,
+  "label": 22,
+  "description": 23,
+  "bit_len": 24,
+  "unit": 29,
+  "scale_factor": 34,
+  "offset": 35}
+
+NUM_SA_FLDS = 5
+SA_FLD_MAP = {
+  "sa": 1,
+  "label": 2}
+
+# Sheets of the DA workbook that are ingested
+DA_SHEET = "SPs & PGs"
+SA_SHEET_L = ["Global Source Addresses (B2)", "IG1 Source Addresses (B3)"]
+
+DA_HEADER_L = ["Revised", "PG Revised", "SP Revised"]
+SA_HEADER_L = ["Revised", "Function ID", "Function Description"]
+
+REGX_BIT_LEN = re.compile(r"(\d+) (bytes|bits|byte)")
+
+# Rows are handed to executemany() in batches of this size; the whole ingest
+# is still one transaction
+BATCH_SIZE = 10000
+
+# For a new DB that is built in a temporary file and renamed into place at
+# the end: there is nothing to recover after a crash, so no journal is needed
+INGEST_PRAGMA_L = [
+  "PRAGMA journal_mode = OFF",
+  "PRAGMA synchronous = OFF",
+  "PRAGMA temp_store = MEMORY",
+  "PRAGMA cache_size = -65536"]
+
+# For an existing DB the rollback journal stays on; only the syncs are skipped
+UPDATE_PRAGMA_L = [
+  "PRAGMA synchronous = OFF",
+  "PRAGMA temp_store = MEMORY",
+  "PRAGMA cache_size = -65536"]
+
+PGN_INSERT = ""\
+  + "INSERT INTO pgn "\
+  + "("\
+    + "pgn_id, "\
+    + "pgn, "\
+    + "label, "\
+    + "acronym, "\
+    + "description"\
+  + ") "\
+  + "VALUES "\
+    + "(?, ?, ?, ?, ?)"
+
+SPN_INSERT = ""\
+  + "INSERT INTO spn "\
+  + "("\
+    + "spn, "\
+    + "pgn_id, "\
+    + "label, "\
+    + "sp_start_bit, "\
+    + "byte_num, "\
+    + "bit_start, "\
+    + "bit_len, "\
+    + "unit, "\
+    + "scale_factor, "\
+    + "offset, "\
+    + "transmission_rate, "\
+    + "description"\
+  + ") "\
+  + "VALUES "\
+    + "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+SA_INSERT = ""\
+  + "INSERT INTO sa "\
+  + "("\
+    + "sa, "\
+    + "label"\
+  + ") "\
+  + "VALUES "\
+    + "(?, ?)"
+
+
+#
+# Subroutines
+#
+def transTabsToSpaces(iline):
+    # Splitting on double quotes puts every quoted piece at an odd index
+    parts_l = iline.split('"')
+    for i in range(1, len(parts_l), 2):
+        parts_l[i] = parts_l[i].replace('\t', ' ')
+
+    return '"'.join(parts_l)
+
+
+def splitRecord(line, num_flds):
+    # Splits one (stitched) TSV record into fields; returns (rv, err, flds_l)
+    flds_l = line.split('\t')
+#x    print("num_flds:", len(flds_l))
+
+    if len(flds_l) > num_flds:
+        # There are tab characters in between double quotes. Let's convert
+        # them to spaces
+        line = transTabsToSpaces(line)
+        flds_l = line.split('\t')
+
+        if len(flds_l) != num_flds:
+            err = "Number of fields != " + str(num_flds)\
+                + "! [" + str(len(flds_l)) + "]"
+            return (1, err, None)
+
+    return (0, "", flds_l)
+
+
+def createTables(dbcon):
+    q = ""\
+      + "CREATE TABLE pgn ("\
+        + "pgn_id INTEGER PRIMARY KEY, "\
+        + "pgn INTEGER, "\
+        + "label TEXT, "\
+        + "acronym TEXT, "\
+        + "description TEXT"\
+      + ")"
+
+    cur = dbcon.cursor()
+    cur.execute(q)
+    dbcon.commit()
+
+    q = ""\
+      + "CREATE TABLE spn ("\
+        + "spn_id INTEGER PRIMARY KEY, "\
+        + "spn INTEGER, "\
+        + "pgn_id INTEGER REFERENCES pgn(pgn_id) ON DELETE CASCADE "\
+          + "ON UPDATE CASCADE, "\
+        + "sp_start_bit TEXT, "\
+        + "byte_num INTEGER, "\
+        + "bit_len INTEGER, "\
+        + "bit_start INTEGER, "\
+        + "unit TEXT, "\
+        + "scale_factor FLOAT, "\
+        + "offset FLOAT, "\
+        + "label TEXT, "\
+        + "transmission_rate TEXT, "\
+        + "description TEXT"\
+      + ")"
+
+    cur.execute(q)
+    dbcon.commit()
+
+    return True
+
+
+def createIndexes(dbcon):
+    # Built once the tables are loaded, which is cheaper than keeping them up
+    # to date row by row
+    cur = dbcon.cursor()
+
+    q = ""\
+      + "create unique index spn_spn_pgnid on spn(spn, pgn_id)"
+    cur.execute(q)
+
+    q = ""\
+      + "create index pgn_pgn on pgn(pgn)"
+    cur.execute(q)
+    dbcon.commit()
+
+    return True
+
+
+def _createSATable(dbcon):
+    # The DDL of createSATable(), inside the caller's transaction
+    q = ""\
+      + "CREATE TABLE IF NOT EXISTS sa ("\
+        + "sa_id INTEGER PRIMARY KEY, "\
+        + "sa INTEGER, "\
+        + "label TEXT"\
+      + ")"
+
+    cur = dbcon.cursor()
+    cur.execute(q)
+    cur.execute("CREATE INDEX IF NOT EXISTS sa_sa ON sa(sa, label)")
+
+
+def createSATable(dbcon):
+    _createSATable(dbcon)
+    dbcon.commit()
+
+    return True
+
+
+class BulkLoader:
+    def __init__(self, dbcon, batch_size=BATCH_SIZE):
+        self.dbcon = dbcon
+        self.batch_size = batch_size
+
+        # pgn -> pgn_id and (spn, pgn_id) pairs ingested so far: the first
+        # record of a PGN creates its pgn row and an SPN is only ingested
+        # once per PGN
+        self.pgn_d = {}
+        self.spn_s = set()
+
+        self.pgn_l = []
+        self.spn_l = []
+        self.sa_l = []
+
+        self.num_pgns = 0
+        self.num_spns = 0
+        self.num_sas = 0
+
+    def addRecord(self, flds_l):
+        # One record of the "SPs & PGs" sheet; returns (rv, err)
+        rv = 0
+        err = ""
+
+        # Check if pgn is a number
+        try:
+            pgn = int(flds_l[PGN_FLD_MAP["pgn"]])
+        except ValueError as e:
+            err = "PGN is not INTEGER!"
+            rv = 0
+            return (rv, err)
+
+        # First check and see if pgn is already known
+        pgn_id = self.pgn_d.get(pgn)
+        if pgn_id is None:
+            pgn_id = len(self.pgn_d) + 1
+            self.pgn_d[pgn] = pgn_id
+            self.pgn_l.append((pgn_id,
+                               flds_l[PGN_FLD_MAP["pgn"]],
+                               flds_l[PGN_FLD_MAP["label"]],
+                               flds_l[PGN_FLD_MAP["acronym"]],
+                               flds_l[PGN_FLD_MAP["description"]]))
+            self.num_pgns += 1
+
+        # Extract/calculate the following values:
+        #  - values for byte_num and bit_start from sp_start_bit
+        #  - value for bit_len
+        #  - value for bit_start
+        byte_num = None
+        bit_len = None
+        bit_start = None
+
+        ssb = flds_l[SPN_FLD_MAP["sp_start_bit"]]
+        if "." in ssb:
+            # Value would be somthing like "2.1", "4.3", etc.
+            ssb_flds_l = ssb.split(".")
+            byte_num = int(ssb_flds_l[0])
+            bit_start = int(ssb_flds_l[1])
+
+        # The value of bit length is a string that looks like:
+        #  - 11 bits
+        #  - 1 byte
+        #  - 3 bytes
+        bl = flds_l[SPN_FLD_MAP["bit_len"]]
+        mobj = REGX_BIT_LEN.match(bl)
+        if mobj:
+            if mobj.group(2) == "bits":
+                bit_len = int(mobj.group(1))
+            elif mobj.group(2) == "byte" or mobj.group(2) == "bytes":
+                bit_len = int(mobj.group(1)) * 8
+            else:
+                rv = 1
+                err = "Bits, Bytes or Byte not found in SP Length [" + bl \
+                    + "] [PGN=" + flds_l[PGN_FLD_MAP["pgn"]] + "; "\
+                    + "SPN=" + flds_l[SPN_FLD_MAP["spn"]] + "]"
+                return (rv, err)
+
+        # Same check as the unique index on spn(spn, pgn_id), done here so
+        # that a duplicate does not fail a whole batch
+        spn = flds_l[SPN_FLD_MAP["spn"]]
+        try:
+            spn_key = (int(spn), pgn_id)
+        except ValueError:
+            spn_key = (spn, pgn_id)
+
+        if spn_key in self.spn_s:
+            err = flds_l[PGN_FLD_MAP["pgn"]] + ":" + spn + "  "\
+                + "UNIQUE constraint failed: spn.spn, spn.pgn_id"
+            rv = 1
+            return (rv, err)
+        self.spn_s.add(spn_key)
+
+        self.spn_l.append((spn,
+                           pgn_id,
+                           flds_l[SPN_FLD_MAP["label"]],
+                           flds_l[SPN_FLD_MAP["sp_start_bit"]],
+                           byte_num,
+                           bit_start,
+                           bit_len,
+                           flds_l[SPN_FLD_MAP["unit"]],
+                           flds_l[SPN_FLD_MAP["scale_factor"]],
+                           flds_l[SPN_FLD_MAP["offset"]],
+                           flds_l[SPN_FLD_MAP["transmission_rate"]],
+                           flds_l[SPN_FLD_MAP["description"]]))
+        self.num_spns += 1
+
+        if len(self.spn_l) >= self.batch_size:
+            self.flush()
+
+        return (rv, err)
+
+    def addSARecord(self, flds_l):
+        # One record of a source address sheet
+        self.sa_l.append((flds_l[SA_FLD_MAP["sa"]],
+                          flds_l[SA_FLD_MAP["label"]]))
+        self.num_sas += 1
+
+        if len(self.sa_l) >= self.batch_size:
+            self.flush()
+
+        return (0, "")
+
+    def flush(self):
+        # PGN rows go first; SPN rows carry the pgn_id assigned in addRecord()
+        if self.pgn_l:
+            self.dbcon.executemany(PGN_INSERT, self.pgn_l)
+            del self.pgn_l[:]
+        if self.spn_l:
+            self.dbcon.executemany(SPN_INSERT, self.spn_l)
+            del self.spn_l[:]
+        if self.sa_l:
+            self.dbcon.executemany(SA_INSERT, self.sa_l)
+            del self.sa_l[:]
+
+    def finish(self):
+        self.flush()
+        self.dbcon.commit()
+
+    def numRows(self):
+        return self.num_pgns + self.num_spns + self.num_sas
+
+
+def sheetRecords(rows, header_l, num_flds):
+    # Generator over XLSXReader.iterRows(): skips everything up to and
+    # including the header row and yields (rv, err, row number, flds_l) for
+    # the rows after it, padded to num_flds fields
+    rows = iter(rows)
+    for (row_num, cells_l) in rows:
+        if cells_l[:len(header_l)] == header_l:
+            break
+
+    for (row_num, cells_l) in rows:
+        if len(cells_l) > num_flds:
+            err = "Number of fields != " + str(num_flds)\
+                + "! [" + str(len(cells_l)) + "]"
+            yield (1, err, row_num, None)
+            continue
+
+        yield (0, "", row_num, cells_l + [""] * (num_flds - len(cells_l)))
+
+
+def loadWorkbook(rdr, loader, out=None):
+    # Feeds the PGN/SPN sheet and the source address sheets of an
+    # XLSXReader into a BulkLoader. Returns the names of the sheets loaded.
+    if out is None:
+        out = sys.stdout
+
+    sheet_l = []
+
+    sheet = rdr.findSheet(DA_SHEET)
+    if not sheet:
+        print("ERROR - Sheet \"" + DA_SHEET + "\" not found!", file=out)
+        return sheet_l
+
+    pgn_fld = PGN_FLD_MAP["pgn"]
+    for (rv, err, row_num, flds_l) in sheetRecords(rdr.iterRows(sheet),
+                                                    DA_HEADER_L, NUM_FLDS):
+        if flds_l:
+            # Same end marker as in the TSV export: \t\t\t\tN/A...
+            if flds_l[pgn_fld] == "N/A" and not any(flds_l[:pgn_fld]):
+                break
+            if not flds_l[pgn_fld]:
+                continue
+            (rv, err) = loader.addRecord(flds_l)
+        if rv != 0:
+            print("ERROR - " + err + " [" + sheet + " row #: " + str(row_num)\
+                  + "]", file=out)
+    sheet_l.append(sheet)
+
+    sa_fld = SA_FLD_MAP["sa"]
+    for name in SA_SHEET_L:
+        sheet = rdr.findSheet(name)
+        if not sheet:
+            print("WARNING - Sheet \"" + name + "\" not found!", file=out)
+            continue
+
+        for (rv, err, row_num, flds_l) in sheetRecords(rdr.iterRows(sheet),
+                                                        SA_HEADER_L,
+                                                        NUM_SA_FLDS):
+            if flds_l:
+                # Ranges ("128-247") and notes are not addresses
+                if not flds_l[sa_fld].isdigit():
+                    continue
+                (rv, err) = loader.addSARecord(flds_l)
+            if rv != 0:
+                print("ERROR - " + err + " [" + sheet + " row #: "\
+                      + str(row_num) + "]", file=out)
+        sheet_l.append(sheet)
+
+    return sheet_l
+
+
+def createMetaTable(dbcon):
+    q = ""\
+      + "CREATE TABLE IF NOT EXISTS meta ("\
+        + "key TEXT PRIMARY KEY, "\
+        + "value TEXT"\
+      + ")"
+
+    dbcon.execute(q)
+
+    return True
+
+
+def getMeta(dbcon, key):
+    try:
+        row = dbcon.execute("SELECT value FROM meta WHERE key = ?",
+                            (key,)).fetchone()
+    except sqlite3.OperationalError:
+        # DBs built before the meta table existed
+        return None
+
+    return row[0] if row else None
+
+
+def setMeta(dbcon, meta_d):
+    createMetaTable(dbcon)
+    dbcon.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                      sorted(meta_d.items()))
+
+
+def _pgnRows(dbcon):
+    # pgn -> (pgn_id, label, acronym, description); the first row of a PGN
+    # wins, as in the decoders
+    pgn_d = {}
+    q = "SELECT pgn_id, pgn, label, acronym, description FROM pgn "\
+        + "ORDER BY pgn_id"
+    for row in dbcon.execute(q):
+        if row[1] not in pgn_d:
+            pgn_d[row[1]] = (row[0],) + row[2:]
+
+    return pgn_d
+
+
+def _spnRows(dbcon):
+    # (pgn, spn) -> (spn_id, label, sp_start_bit, ..., description)
+    spn_d = {}
+    q = ""\
+      + "SELECT "\
+        + "pgn.pgn, "\
+        + "spn.spn, "\
+        + "spn.spn_id, "\
+        + "spn.label, "\
+        + "spn.sp_start_bit, "\
+        + "spn.byte_num, "\
+        + "spn.bit_start, "\
+        + "spn.bit_len, "\
+        + "spn.unit, "\
+        + "spn.scale_factor, "\
+        + "spn.offset, "\
+        + "spn.transmission_rate, "\
+        + "spn.description "\
+      + "FROM "\
+        + "spn JOIN pgn ON spn.pgn_id = pgn.pgn_id "\
+      + "ORDER BY spn.spn_id"
+    for row in dbcon.execute(q):
+        spn_d.setdefault((row[0], row[1]), row[2:])
+
+    return spn_d
+
+
+def updateDB(dbcon, new_con, with_sa=False, meta_d=None):
+    # Brings the pgn, spn (and, with_sa, sa) tables of dbcon in line with
+    # those of new_con, a DB freshly loaded from the new DA, recomputes the
+    # decode columns and records meta_d. Rows are matched on PGN, (PGN, SPN)
+    # and (SA, label); existing pgn_ids and spn_ids are kept. Everything is
+    # applied in one transaction, committed at the end or rolled back.
+    # Returns the change log.
+    try:
+        change_d = _updateTables(dbcon, new_con, with_sa)
+        fillDecodeColumns(dbcon)
+        if meta_d:
+            setMeta(dbcon, meta_d)
+    except BaseException:
+        dbcon.rollback()
+        raise
+    dbcon.commit()
+
+    return change_d
+
+
+def _updateTables(dbcon, new_con, with_sa):
+    old_pgn_d = _pgnRows(dbcon)
+    new_pgn_d = _pgnRows(new_con)
+    old_spn_d = _spnRows(dbcon)
+    new_spn_d = _spnRows(new_con)
+
+    pgn_added_l = sorted(set(new_pgn_d) - set(old_pgn_d))
+    pgn_removed_l = sorted(set(old_pgn_d) - set(new_pgn_d))
+    pgn_changed_l = sorted(pgn for pgn in set(old_pgn_d) & set(new_pgn_d)
+                           if old_pgn_d[pgn][1:] != new_pgn_d[pgn][1:])
+
+    spn_added_l = sorted(set(new_spn_d) - set(old_spn_d))
+    spn_removed_l = sorted(set(old_spn_d) - set(new_spn_d))
+    spn_changed_l = sorted(key for key in set(old_spn_d) & set(new_spn_d)
+                           if old_spn_d[key][1:] != new_spn_d[key][1:])
+
+    cur = dbcon.cursor()
+
+    # PGNs that go away take their SPNs with them
+    for pgn in pgn_removed_l:
+        pgn_id = old_pgn_d[pgn][0]
+        cur.execute("DELETE FROM spn WHERE pgn_id = ?", (pgn_id,))
+        cur.execute("DELETE FROM pgn WHERE pgn_id = ?", (pgn_id,))
+
+    cur.executemany("UPDATE pgn SET label = ?, acronym = ?, description = ? "
+                    + "WHERE pgn_id = ?",
+                    [new_pgn_d[pgn][1:] + (old_pgn_d[pgn][0],)
+                     for pgn in pgn_changed_l])
+
+    pgn_id_d = dict((pgn, row[0]) for (pgn, row) in old_pgn_d.items())
+    for pgn in pgn_added_l:
+        cur.execute("INSERT INTO pgn (pgn, label, acronym, description) "
+                    + "VALUES (?, ?, ?, ?)", (pgn,) + new_pgn_d[pgn][1:])
+        pgn_id_d[pgn] = cur.lastrowid
+
+    pgn_removed_s = set(pgn_removed_l)
+    cur.executemany("DELETE FROM spn WHERE spn_id = ?",
+                    [(old_spn_d[key][0],) for key in spn_removed_l
+                     if key[0] not in pgn_removed_s])
+
+    cur.executemany("UPDATE spn SET label = ?, sp_start_bit = ?, "
+                    + "byte_num = ?, bit_start = ?, bit_len = ?, unit = ?, "
+                    + "scale_factor = ?, offset = ?, transmission_rate = ?, "
+                    + "description = ? WHERE spn_id = ?",
+                    [new_spn_d[key][1:] + (old_spn_d[key][0],)
+                     for key in spn_changed_l])
+
+    cur.executemany(SPN_INSERT,
+                    [(spn, pgn_id_d[pgn]) + new_spn_d[(pgn, spn)][1:]
+                     for (pgn, spn) in spn_added_l])
+
+    # Every PGN whose decoding may differ after the update
+    affected_s = set(pgn_added_l) | set(pgn_removed_l) | set(pgn_changed_l)
+    for key in spn_added_l + spn_removed_l + spn_changed_l:
+        affected_s.add(key[0])
+
+    change_d = {
+        "pgns": {
+            "added": pgn_added_l,
+            "changed": pgn_changed_l,
+            "removed": pgn_removed_l},
+        "spns": {
+            "added": len(spn_added_l),
+            "changed": len(spn_changed_l),
+            "removed": len(spn_removed_l)},
+        "affected_pgns": sorted(affected_s)}
+
+    if with_sa:
+        _createSATable(dbcon)
+        old_sa_d = {}
+        for (sa_id, sa, label) in cur.execute(
+                "SELECT sa_id, sa, label FROM sa ORDER BY sa_id"):
+            old_sa_d.setdefault((sa, label), []).append(sa_id)
+        new_sa_l = new_con.execute(
+            "SELECT sa, label FROM sa ORDER BY sa_id").fetchall()
+
+        # Rows are matched one for one, so duplicates are kept as they are
+        sa_added_l = []
+        for row in new_sa_l:
+            if old_sa_d.get(row):
+                old_sa_d[row].pop(0)
+            else:
+                sa_added_l.append(row)
+        sa_removed_l = [sa_id for id_l in old_sa_d.values() for sa_id in id_l]
+
+        cur.executemany("DELETE FROM sa WHERE sa_id = ?",
+                        [(sa_id,) for sa_id in sa_removed_l])
+        cur.executemany(SA_INSERT, sa_added_l)
+
+        sa_s = set(row[0] for row in sa_added_l)
+        sa_s.update(key[0] for (key, id_l) in old_sa_d.items() if id_l)
+        change_d["sas"] = {
+            "added": len(sa_added_l),
+            "removed": len(sa_removed_l),
+            "affected_sas": sorted(sa_s)}
+
+    return change_d
@@ -0,0 +1,411 @@
+#
+# Live (asyncio) decoding
+#
+# Lines are read from STDIN, TCP connections or UDP datagrams by producer
+# tasks, put on a bounded queue, and decoded by a single consumer that
+# writes into a buffered sink:
+#
+#   source -> FrameQueue (max_size lines) -> decoder -> AsyncSink -> STDOUT
+#
+# Backpressure is explicit at both ends of the queue:
+#   block        a full queue stops the producers from reading, so a slow
+#                decoder or output pushes back on the pipe or TCP sender
+#                (UDP cannot be paused; datagrams arriving at a full queue
+#                are dropped and counted)
+#   drop-oldest  a full queue drops its oldest line to make room, so the
+#                output stays current and the count of dropped lines says
+#                how far behind it would have fallen
+#
+# The sink collects output and writes it out when FLUSH_SIZE bytes are
+# buffered or the queue has run empty, i.e. in large writes under load and
+# frame by frame when the bus is quiet; on a pipe, writes wait for the
+# reader (StreamWriter.drain()).
+#
+# Per-frame latency is taken from the time a line is received to the time
+# its decoded output is handed to the sink's write.
+#
+import io
+import os
+import sys
+import stat
+import time
+import asyncio
+import collections
+
+from j1939dec.reader import FrameReader
+from j1939dec.output import makeFormatter
+from j1939dec.idfilter import readerFilter
+
+
+#
+# Definitions
+#
+QUEUE_SIZE = 10000
+FLUSH_SIZE = 64 * 1024
+
+# Number of most recent frames the latency percentiles are taken over
+LATENCY_WINDOW = 65536
+
+POLICY_L = ["block", "drop-oldest"]
+
+
+#
+# Subroutines
+#
+def parseAddress(val, host="127.0.0.1"):
+    # "[host:]port" -> (host, port)
+    (h, sep, port) = val.rpartition(":")
+    if sep and h:
+        host = h
+
+    return (host, int(port))
+
+
+class FrameQueue:
+    def __init__(self, max_size=QUEUE_SIZE, policy="block"):
+        if policy not in POLICY_L:
+            raise ValueError("Unsupported queue policy [" + policy + "]")
+
+        self.max_size = max_size
+        self.policy = policy
+        self.item_q = collections.deque()
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.closed = False
+
+        self.num_put = 0
+        self.num_dropped = 0
+        self.high_water = 0
+
+    def putNowait(self, item):
+        # Returns False if the item was dropped; a closed queue takes no
+        # more items
+        if self.closed:
+            return False
+
+        item_q = self.item_q
+        if len(item_q) >= self.max_size:
+            if self.policy == "block":
+                self.num_dropped += 1
+                return False
+            item_q.popleft()
+            self.num_dropped += 1
+
+        item_q.append(item)
+        self.num_put += 1
+        if len(item_q) > self.high_water:
+            self.high_water = len(item_q)
+        if len(item_q) >= self.max_size:
+            self.not_full.clear()
+        self.not_empty.set()
+
+        return True
+
+    async def put(self, item):
+        if self.policy == "block":
+            while len(self.item_q) >= self.max_size and not self.closed:
+                await self.not_full.wait()
+        self.putNowait(item)
+
+    def close(self):
+        # Wakes up the consumer, and producers waiting for room
+        self.closed = True
+        self.not_empty.set()
+        self.not_full.set()
+
+    async def get(self):
+        # Returns None once the queue is closed and empty
+        item_q = self.item_q
+        while not item_q:
+            if self.closed:
+                return None
+            self.not_empty.clear()
+            await self.not_empty.wait()
+
+        item = item_q.popleft()
+        if not item_q:
+            self.not_empty.clear()
+        self.not_full.set()
+
+        return item
+
+    def empty(self):
+        return not self.item_q
+
+
+class AsyncSink:
+    def __init__(self, ofo, flush_size=FLUSH_SIZE):
+        self.ofo = ofo
+        self.flush_size = flush_size
+        self.writer = None
+        self.buf = io.StringIO()
+        self.size = 0
+        self.ts_l = []
+
+        self.num_writes = 0
+        self.latency_l = collections.deque(maxlen=LATENCY_WINDOW)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.num_frames = 0
+
+    async def open(self):
+        # Pipes and sockets get a non-blocking transport (on a duplicate of
+        # the descriptor, so that closing it leaves the file open); files
+        # and terminals are written directly
+        mode = os.fstat(self.ofo.fileno()).st_mode
+        if stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode):
+            self.ofo.flush()
+            loop = asyncio.get_running_loop()
+            pipe = os.fdopen(os.dup(self.ofo.fileno()), "wb")
+            (transport, protocol) = await loop.connect_write_pipe(
+                asyncio.streams.FlowControlMixin, pipe)
+            self.writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    def frameDone(self, recv_time):
+        # Called after a frame's output went into buf
+        self.ts_l.append(recv_time)
+        self.size = self.buf.tell()
+
+    async def flush(self):
+        text = self.buf.getvalue()
+        if text:
+            data = text.encode()
+            if self.writer:
+                self.writer.write(data)
+                await self.writer.drain()
+            else:
+                self.ofo.buffer.write(data)
+                self.ofo.flush()
+            self.num_writes += 1
+            self.buf = io.StringIO()
+            self.size = 0
+
+        now = time.perf_counter()
+        for recv_time in self.ts_l:
+            lat = now - recv_time
+            self.latency_l.append(lat)
+            self.latency_sum += lat
+            if lat > self.latency_max:
+                self.latency_max = lat
+        self.num_frames += len(self.ts_l)
+        self.ts_l = []
+
+    async def close(self):
+        await self.flush()
+        if self.writer:
+            # drain() only waits for the transport buffer to go below its
+            # high-water mark; with no limit it waits until all is written
+            self.writer.transport.set_write_buffer_limits(0)
+            await self.writer.drain()
+            self.writer.close()
+            # O_NONBLOCK is shared with the original descriptor (and with
+            # STDERR after 2>&1)
+            os.set_blocking(self.ofo.fileno(), True)
+
+    def latencyStats(self):
+        # (mean, p50, p99, max) in seconds
+        lat_l = sorted(self.latency_l)
+        if not lat_l:
+            return (0.0, 0.0, 0.0, 0.0)
+
+        return (self.latency_sum / self.num_frames,
+                lat_l[len(lat_l) // 2],
+                lat_l[min(len(lat_l) - 1, int(0.99 * len(lat_l)))],
+                self.latency_max)
+
+
+class UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, frame_q):
+        self.frame_q = frame_q
+
+    def datagram_received(self, data, addr):
+        # A datagram carries one or more log lines
+        now = time.perf_counter()
+        for line in data.decode(errors="replace").splitlines():
+            self.frame_q.putNowait((now, line))
+
+
+class LiveDecoder:
+    def __init__(self, plan, oformat, iformat=None, tp=None,
+                 queue_size=QUEUE_SIZE, policy="block", ofo=None,
+                 id_filter=None, changes=None):
+        self.plan = plan
+        self.oformat = oformat
+        self.iformat = iformat
+        self.tp = tp
+        self.id_filter = id_filter
+        self.ofo = ofo or sys.stdout
+
+        self.fmt = makeFormatter(oformat, plan, changes=changes)
+        self.frame_q = FrameQueue(queue_size, policy)
+        self.sink = AsyncSink(self.ofo)
+        self.stop_evt = None
+
+        # Producer tasks of TCP connections, and the STDIN pipe transport
+        self.client_s = set()
+        self.stdin_transport = None
+
+        self.parser = None
+        self.num_lines = 0
+        self.num_rejected = 0
+        self.num_filtered = 0
+        self.num_decoded = 0
+        self.start_time = None
+
+    def setFormat(self, line):
+        # Without --in-format, the format is the first one that parses a
+        # line; live input cannot wait for a sample of lines
+        rdr = FrameReader(None, self.iformat,
+                          readerFilter(self.id_filter, self.tp))
+        fmt = self.iformat or rdr.detect([line])
+        if fmt:
+            self.iformat = fmt
+            self.parser = rdr.parser_d[fmt]
+
+    async def readStream(self, reader):
+        frame_q = self.frame_q
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            await frame_q.put((time.perf_counter(),
+                               line.decode(errors="replace")))
+
+    async def readStdin(self):
+        if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+            # A file (< can.log) cannot be polled; read it directly and let
+            # the decoder run after every line
+            for line in sys.stdin:
+                await self.frame_q.put((time.perf_counter(), line))
+                await asyncio.sleep(0)
+            return
+
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=FLUSH_SIZE)
+        (self.stdin_transport, protocol) = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        try:
+            await self.readStream(reader)
+        finally:
+            self.stdin_transport.close()
+
+    async def handleTCP(self, reader, writer):
+        # Cancelled by run() on stop()
+        task = asyncio.current_task()
+        self.client_s.add(task)
+        try:
+            await self.readStream(reader)
+        finally:
+            self.client_s.discard(task)
+            writer.close()
+
+    async def decode(self):
+        frame_q = self.frame_q
+        sink = self.sink
+        format = self.fmt.format
+        tp = self.tp
+        keep = self.id_filter.keep if self.id_filter and tp else None
+
+        while True:
+            item = await frame_q.get()
+            if item is None:
+                break
+
+            (recv_time, line) = item
+            self.num_lines += 1
+            if not self.parser:
+                self.setFormat(line)
+            frame = self.parser(line) if self.parser else None
+            if not frame:
+                if frame is False:
+                    self.num_filtered += 1
+                else:
+                    self.num_rejected += 1
+                continue
+
+            frames = tp.process([frame]) if tp else (frame,)
+            for frame in frames:
+                if keep and not keep(frame[1]):
+                    # TP frames passed for reassembly, or a reassembled
+                    # message of an unwanted PGN
+                    continue
+                self.num_decoded += 1
+                sink.buf.write(format(frame))
+                sink.frameDone(recv_time)
+
+            if sink.size >= sink.flush_size or frame_q.empty():
+                await sink.flush()
+
+        await sink.close()
+
+    async def run(self, stdin=False, tcp_addr=None, udp_addr=None,
+                  header=None):
+        # Decodes until STDIN ends, or, for network sources, until stop()
+        loop = asyncio.get_running_loop()
+        self.stop_evt = asyncio.Event()
+        self.start_time = time.perf_counter()
+
+        await self.sink.open()
+        if header:
+            print(header, file=self.sink.buf)
+            await self.sink.flush()
+
+        decoder = asyncio.ensure_future(self.decode())
+
+        server = None
+        transport = None
+        if tcp_addr:
+            server = await asyncio.start_server(self.handleTCP, *tcp_addr)
+        if udp_addr:
+            (transport, protocol) = await loop.create_datagram_endpoint(
+                lambda: UDPProtocol(self.frame_q), local_addr=udp_addr)
+
+        reader = None
+        if stdin:
+            reader = asyncio.ensure_future(self.readStdin())
+            stopper = asyncio.ensure_future(self.stop_evt.wait())
+            await asyncio.wait([reader, stopper],
+                               return_when=asyncio.FIRST_COMPLETED)
+            stopper.cancel()
+        else:
+            await self.stop_evt.wait()
+
+        if server:
+            server.close()
+        if transport:
+            transport.close()
+
+        # Stop the producers that are still reading (on stop(), with input
+        # still coming), so that the queue only has to be drained
+        task_l = list(self.client_s)
+        if reader and not reader.done():
+            task_l.append(reader)
+        for task in task_l:
+            task.cancel()
+        if task_l:
+            await asyncio.gather(*task_l, return_exceptions=True)
+
+        self.frame_q.close()
+        await decoder
+
+    def stop(self):
+        if self.stop_evt:
+            self.stop_evt.set()
+
+    def describe(self):
+        secs = time.perf_counter() - self.start_time
+        (lat_mean, lat_p50, lat_p99, lat_max) = self.sink.latencyStats()
+
+        frame_q = self.frame_q
+
+        return "Live: %d lines, %d frames decoded, %d rejected, %d filtered, "\
+               "%d dropped (%s, queue %d, high water %d), %0.0f frames/sec, "\
+               "latency mean %0.3f ms, p50 %0.3f ms, p99 %0.3f ms, max "\
+               "%0.3f ms, %d writes" % (
+                   self.num_lines, self.num_decoded, self.num_rejected,
+                   self.num_filtered, frame_q.num_dropped, frame_q.policy,
+                   frame_q.max_size, frame_q.high_water,
+                   self.num_decoded / max(secs, 1e-6), lat_mean * 1000.0,
+                   lat_p50 * 1000.0, lat_p99 * 1000.0, lat_max * 1000.0,
+                   self.sink.num_writes)
@@ -0,0 +1,377 @@
+#
+# Output formatters
+#
+# A formatter turns one (timestamp, can_id, data) frame into the text for
+# that frame. Everything that only depends on the CAN ID (PGN, addresses,
+# labels, the list of SPNs and their fixed text) is compiled the first time
+# an ID is seen and cached, so per frame only the values are formatted:
+#
+#   human  the multi-line listing of jjd.py without -f
+#   csv    one line per SPN value, columns CSV_HEADER
+#   jsonl  one JSON object per SPN value, keys JSONL_KEY_L in that order:
+#          ts (seconds or null), pgn, da (255 for PDU2 PGNs), sa, spn,
+#          label, value, unit
+#
+# CSV and JSON Lines output only ever contains rows of that schema; frames
+# that cannot be decoded are reported on the error stream instead. With a
+# ChangeFilter (j1939dec.changes), they only hold the rows it passes on.
+#
+# BufferedSink collects the text and writes it out in large blocks
+# ("throughput") or after every frame ("latency").
+#
+import sys
+import json
+
+
+#
+# Definitions
+#
+CSV_HEADER = "Epoch Timestamp,PGN,Dest Add,Source Add,SPN,Value,Unit"
+JSONL_KEY_L = ["ts", "pgn", "da", "sa", "spn", "label", "value", "unit"]
+
+OUTPUT_FORMAT_L = ["human", "csv", "jsonl"]
+
+FLUSH_THROUGHPUT = "throughput"
+FLUSH_LATENCY = "latency"
+FLUSH_L = [FLUSH_THROUGHPUT, FLUSH_LATENCY]
+FLUSH_SIZE = 1024 * 1024
+
+# Compiled CAN IDs kept per formatter; the cache starts over when full
+ID_CACHE_SIZE = 65536
+
+MSG_RESERVED = "ERROR - Bits 25 and 24 (little-endian) of 29-bit CAN frame "\
+    + "not '00' is currently unsupported!"
+
+
+#
+# Subroutines
+#
+def splitID(can_id):
+    # (pgn, dest add or None for PDU2 PGNs, source add)
+    pf = (can_id >> 16) & 0xFF
+    if pf < 240:
+        return (pf << 8, (can_id >> 8) & 0xFF, can_id & 0xFF)
+
+    return ((can_id >> 8) & 0xFFFF, None, can_id & 0xFF)
+
+
+def msgNotInDB(pgn, sa):
+    return "ERROR - PGN=" + str(pgn) + " and/or SA=" + str(sa) + " not in DB!"
+
+
+class Formatter:
+    header = None
+
+    def __init__(self, plan, err=None):
+        self.plan = plan
+        self.err = err
+        self.id_d = {}
+        self.num_lookups = 0
+
+    def error(self, msg):
+        print(msg, file=self.err or sys.stderr)
+
+    def lookup(self, can_id):
+        # The compiled entry of a CAN ID
+        id_d = self.id_d
+        if len(id_d) >= ID_CACHE_SIZE:
+            id_d.clear()
+        self.num_lookups += 1
+
+        if (can_id >> 24) & 3:
+            ent = (MSG_RESERVED, None)
+        else:
+            (pgn, dest_add, sa) = splitID(can_id)
+            pgn_info = self.plan.getPGN(pgn)
+            if not pgn_info:
+                ent = (msgNotInDB(pgn, sa), None)
+            else:
+                ent = self.compileID(pgn, dest_add, sa, pgn_info)
+
+        id_d[can_id] = ent
+
+        return ent
+
+
+class RowFormatter(Formatter):
+    # One row per SPN value. Subclasses give the text around the values
+    # (idPart(), spnParts(), tsPart()) and the text of a value (valueText).
+    # format() is the steps extract() (extractValues() and filterChanges())
+    # and formatFrame() (formatRows()), or formatError(); the stage timers
+    # of j1939dec.profiling run them one by one.
+    def __init__(self, plan, err=None, changes=None):
+        Formatter.__init__(self, plan, err)
+        self.changes = changes
+
+    def compileID(self, pgn, dest_add, sa, pgn_info):
+        # (ID text, [(shift, mask, nbytes, err_min, scale, offset, text
+        # before value, text after value, (change key, absolute deadband,
+        # relative deadband) or None without changes), ...])
+        spn_l = []
+        for i in pgn_info[2]:
+            if i.shift is None:
+                continue
+            (pre, suf) = self.spnParts(i)
+            chg = None
+            if self.changes:
+                chg = (i.spn << 8 | sa,) + self.changes.band(i.spn)
+            spn_l.append((i.shift, i.mask, i.nbytes, i.err_min,
+                          i.scale_factor, i.offset, pre, suf, chg))
+
+        return (self.idPart(pgn, dest_add, sa), spn_l)
+
+    def extractValues(self, spn_l, can_data):
+        # [(value, text before, text after, change), ...] of the fields the
+        # payload holds, without "error" and "not available" values
+        pint = int.from_bytes(can_data, "little")
+        dlen = len(can_data)
+        val_l = []
+        for (shift, mask, nbytes, err_min, scale, offset, pre, suf,
+             chg) in spn_l:
+            if nbytes > dlen:
+                continue
+            raw = (pint >> shift) & mask
+            if raw >= err_min:
+                continue
+            val_l.append((raw * scale + offset, pre, suf, chg))
+
+        return val_l
+
+    def filterChanges(self, epoch_ts, val_l):
+        # The values the ChangeFilter passes on
+        test = self.changes.test
+        return [ent for ent in val_l
+                if test(ent[3][0], epoch_ts, ent[0], ent[3][1], ent[3][2])]
+
+    def formatRows(self, id_part, val_l):
+        value_text = self.valueText
+        return "".join([id_part + pre + value_text(val) + suf
+                        for (val, pre, suf, chg) in val_l])
+
+    def extract(self, frame, spn_l):
+        val_l = self.extractValues(spn_l, frame[2])
+        if self.changes:
+            val_l = self.filterChanges(frame[0], val_l)
+
+        return val_l
+
+    def formatFrame(self, frame, id_part, val_l):
+        return self.formatRows(self.tsPart(frame[0]) + id_part, val_l)
+
+    def formatError(self, msg):
+        # Errors go to the error stream, not into the rows
+        self.error(msg)
+        return ""
+
+    def format(self, frame):
+        # The steps above, inline
+        (epoch_ts, can_id, can_data) = frame
+
+        (id_part, spn_l) = self.id_d.get(can_id) or self.lookup(can_id)
+        if spn_l is None:
+            self.error(id_part)
+            return ""
+
+        val_l = self.extractValues(spn_l, can_data)
+        if self.changes:
+            val_l = self.filterChanges(epoch_ts, val_l)
+
+        return self.formatRows(self.tsPart(epoch_ts) + id_part, val_l)
+
+
+class CSVFormatter(RowFormatter):
+    header = CSV_HEADER
+    valueText = "%0.2f".__mod__
+
+    def idPart(self, pgn, dest_add, sa):
+        # Dest Add is 255 for PDU2 PGNs (and, as it always has been in this
+        # format, for destination address 0)
+        return "," + str(pgn) + "," + str(dest_add or 255) + "," + str(sa)
+
+    def spnParts(self, i):
+        return ("," + str(i.spn) + ",", "," + i.unit + "\n")
+
+    def tsPart(self, epoch_ts):
+        return "" if epoch_ts is None else "%0.6f" % epoch_ts
+
+
+class JSONLFormatter(RowFormatter):
+    valueText = repr
+
+    def idPart(self, pgn, dest_add, sa):
+        return ',"pgn":%d,"da":%d,"sa":%d' % (
+            pgn, 255 if dest_add is None else dest_add, sa)
+
+    def spnParts(self, i):
+        return (',"spn":%s,"label":%s,"value":' % (json.dumps(i.spn),
+                                                   json.dumps(i.label)),
+                ',"unit":%s}\n' % json.dumps(i.unit))
+
+    def tsPart(self, epoch_ts):
+        return '{"ts":null' if epoch_ts is None else '{"ts":' + repr(epoch_ts)
+
+
+class HumanFormatter(Formatter):
+    # Errors are part of the listing. With markers, every frame is wrapped
+    # in "===Begin/End CAN message #n===" lines. A frame is formatted in the
+    # same steps as by RowFormatter.
+    def __init__(self, plan, err=None, markers=True, prg_nm=None):
+        Formatter.__init__(self, plan, err)
+        self.markers = markers
+        self.prg_nm = prg_nm or sys.argv[0]
+        self.num = 0
+
+    def compileID(self, pgn, dest_add, sa, pgn_info):
+        (label, acronym, spn_in_l) = pgn_info
+        plan = self.plan
+        prg_nm = self.prg_nm
+
+        head = "%12s: %s (%s)\n" % ("PGN", label, pgn)\
+            + "%12s: %s\n" % ("Acronym", acronym)\
+            + "%12s: %s\n" % ("PGN Details", prg_nm + " -p " + str(pgn))\
+            + "%12s: %s (%d)\n" % ("Source Add", plan.getSALabel(sa), sa)
+        if dest_add:
+            head += "%12s: %s (%d)\n" % ("Dest Add",
+                                         plan.getSALabel(dest_add), dest_add)
+        head += "\n\n"
+
+        # (desc, "SPN" line, "%12s: " value prefix, unit suffix, "Details"
+        # lines); desc is None for a NULL SPN
+        spn_l = []
+        for i in spn_in_l:
+            if i.shift is None:
+                spn_l.append((None, "%12s: %s\n" % ("SPN", "NULL"), None,
+                              None, None))
+                continue
+            if i.unit:
+                suf = " (" + i.unit + ")\n"
+            else:
+                suf = "\n"
+            cmd = prg_nm + " -p " + str(pgn) + " -s " + str(i.spn)
+            spn_l.append((i, "%12s: %s (%s)\n" % ("SPN", i.label, i.spn),
+                          "%12s: " % "Value", suf,
+                          "%12s: %s\n\n\n" % ("Details", cmd)))
+
+        return (head, spn_l)
+
+    def extract(self, frame, spn_l):
+        # [(SPN entry, raw value), ...] of the NULL SPNs (raw None) and the
+        # values the payload holds, without "error" and "not available"
+        can_data = frame[2]
+        pint = int.from_bytes(can_data, "little")
+        dlen = len(can_data)
+        val_l = []
+        for ent in spn_l:
+            i = ent[0]
+            if i is None:
+                val_l.append((ent, None))
+                continue
+            if i.nbytes > dlen:
+                continue
+            raw = (pint >> i.shift) & i.mask
+            if raw >= i.err_min:
+                continue
+            val_l.append((ent, raw))
+
+        return val_l
+
+    def wrap(self, text):
+        if not self.markers:
+            return text
+
+        self.num += 1
+        return "\n\n===Begin CAN message #" + str(self.num) + "===\n\n"\
+            + text + "===End CAN message #" + str(self.num) + "===\n\n\n"
+
+    def formatFrame(self, frame, head, val_l):
+        (epoch_ts, can_id, can_data) = frame
+
+        raw = "%08X#%s" % (can_id, can_data.hex().upper())
+        if epoch_ts is not None:
+            raw = "(%0.6f) %s" % (epoch_ts, raw)
+        part_l = ["%12s: %s\n\n" % ("Raw CAN msg", raw), head]
+
+        for ((i, spn_line, val_pre, val_suf, details), raw) in val_l:
+            if i is None:
+                part_l.append(spn_line)
+                continue
+
+            blen = i.bit_len
+            if blen > 8 and blen % 8 == 0:
+                raw_line = "%12s: 0x%0*X (%d)\n" % ("Hex Val", blen // 4,
+                                                    raw, raw)
+            else:
+                raw_line = "%12s: %sb (%s, %d)\n" % (
+                    "Binary Val", format(raw, "0" + str(blen) + "b"),
+                    hex(raw), raw)
+            part_l.append(spn_line + raw_line + val_pre + "%0.2f" % (
+                raw * i.scale_factor + i.offset) + val_suf + details)
+
+        return self.wrap("".join(part_l))
+
+    def formatError(self, msg):
+        return self.wrap(msg + "\n")
+
+    def format(self, frame):
+        (head, spn_l) = self.id_d.get(frame[1]) or self.lookup(frame[1])
+        if spn_l is None:
+            return self.formatError(head)
+
+        return self.formatFrame(frame, head, self.extract(frame, spn_l))
+
+
+FORMATTER_D = {
+    "human": HumanFormatter,
+    "csv": CSVFormatter,
+    "jsonl": JSONLFormatter}
+
+
+def makeFormatter(oformat, plan, err=None, markers=True, changes=None):
+    # oformat None is the human readable listing; markers only apply to it,
+    # and a ChangeFilter only to the others
+    if not oformat or oformat == "human":
+        return HumanFormatter(plan, err, markers)
+
+    return FORMATTER_D[oformat](plan, err, changes)
+
+
+def formatHeader(oformat):
+    # The line to start the output with, or None
+    if not oformat:
+        return None
+
+    return FORMATTER_D[oformat].header
+
+
+class BufferedSink:
+    def __init__(self, fo, flush=FLUSH_THROUGHPUT, buf_size=FLUSH_SIZE):
+        if flush not in FLUSH_L:
+            raise ValueError("Unsupported flush policy [" + str(flush) + "]")
+
+        self.fo = fo
+        self.latency = flush == FLUSH_LATENCY
+        self.buf_size = buf_size
+        self.buf_l = []
+        self.size = 0
+
+    def write(self, text):
+        if self.latency:
+            # One write (and flush) per frame
+            if text:
+                self.fo.write(text)
+                self.fo.flush()
+            return
+
+        self.buf_l.append(text)
+        self.size += len(text)
+        if self.size >= self.buf_size:
+            self.fo.write("".join(self.buf_l))
+            self.buf_l = []
+            self.size = 0
+
+    def flush(self):
+        if self.buf_l:
+            self.fo.write("".join(self.buf_l))
+            self.buf_l = []
+            self.size = 0
+        self.fo.flush()
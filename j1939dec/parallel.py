@@ -0,0 +1,168 @@
+#
+# Parallel decoding of a single large log file
+#
+# The file is split into byte ranges that start and end on line boundaries.
+# The ranges are decoded by a process pool in which every worker holds its
+# own decode plan (loaded from the DB or mapped from a snapshot), and the
+# output is written back in the original order, either to one stream or to
+# ordered part files.
+#
+import io
+import os
+import itertools
+import collections
+import multiprocessing
+
+from j1939dec.snapshot import loadPlan
+from j1939dec.reader import DETECT_LINES, FrameReader
+from j1939dec.output import formatHeader, makeFormatter
+from j1939dec.tp import TPReassembler
+from j1939dec.idfilter import filterFrames, readerFilter
+
+
+#
+# Definitions
+#
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Formats whose timestamps depend on every line before them cannot be split
+UNSPLITTABLE_L = ["candump-td"]
+
+# Per-worker decode plan, loaded once by initWorker()
+_plan = None
+
+
+#
+# Subroutines
+#
+def splitFile(fname, chunk_size=CHUNK_SIZE):
+    # Returns [(start, end), ...] byte ranges, each ending right after a
+    # newline (or at the end of the file)
+    size = os.path.getsize(fname)
+    bounds_l = [0]
+
+    with open(fname, "rb") as fo:
+        pos = chunk_size
+        while pos < size:
+            fo.seek(pos)
+            fo.readline()
+            pos = fo.tell()
+            if pos >= size:
+                break
+            bounds_l.append(pos)
+            pos += chunk_size
+
+    bounds_l.append(size)
+
+    return list(zip(bounds_l, bounds_l[1:]))
+
+
+def probeFormat(fname, iformat=None):
+    # Detect the format once, from the head of the file, and pick up header
+    # state (TRC $STARTTIME) that workers would otherwise never see
+    with open(fname, errors="replace") as fo:
+        head_l = list(itertools.islice(fo, DETECT_LINES))
+
+    rdr = FrameReader(head_l, iformat)
+    for frame in rdr:
+        pass
+
+    return (rdr.fmt, rdr.trc_start)
+
+
+def initWorker(dbfile, snap_file=None):
+    global _plan
+
+    _plan = loadPlan(dbfile, snap_file)
+
+
+def decodeChunk(job):
+    (fname, start, end, fmt, trc_start, oformat, part_file, reassemble,
+     id_filter) = job
+
+    with open(fname, "rb") as fo:
+        fo.seek(start)
+        buf = fo.read(end - start)
+
+    tp = TPReassembler() if reassemble else None
+    rdr = FrameReader(io.StringIO(buf.decode(errors="replace")), fmt,
+                      readerFilter(id_filter, tp))
+    rdr.trc_start = trc_start
+    del buf
+
+    if part_file:
+        tmp_file = part_file + ".tmp"
+        out = open(tmp_file, "w", buffering=1024 * 1024)
+        header = formatHeader(oformat)
+        if header:
+            print(header, file=out)
+    else:
+        out = io.StringIO()
+
+    # TP sessions that straddle a chunk boundary are lost; all others are
+    # reassembled within the chunk
+    frames = filterFrames(rdr, id_filter, tp)
+
+    # Human output is concatenated without Begin/End lines, as their
+    # numbers would restart in every chunk
+    format = makeFormatter(oformat, _plan, markers=False).format
+    out.write("".join(map(format, frames)))
+
+    if part_file:
+        out.close()
+        os.replace(tmp_file, part_file)
+        text = None
+    else:
+        text = out.getvalue()
+
+    return (text, rdr.num_lines, rdr.num_frames, rdr.num_rejected)
+
+
+def decodeParallel(fname, dbfile, oformat, out=None, jobs=None, iformat=None,
+                   part_prefix=None, chunk_size=CHUNK_SIZE, reassemble=True,
+                   snap_file=None, id_filter=None):
+    # Returns (format, number of lines, number of frames, number of rejected
+    # lines, number of parts), or None if the input format cannot be decoded
+    # in parallel. Frames dropped by id_filter are neither frames nor
+    # rejected.
+    if not jobs:
+        jobs = os.cpu_count() or 1
+
+    (fmt, trc_start) = probeFormat(fname, iformat)
+    if not fmt or fmt in UNSPLITTABLE_L:
+        return None
+
+    job_l = []
+    for (n, (start, end)) in enumerate(splitFile(fname, chunk_size)):
+        part_file = None
+        if part_prefix:
+            part_file = "%s.%05d" % (part_prefix, n)
+        job_l.append((fname, start, end, fmt, trc_start, oformat, part_file,
+                      reassemble, id_filter))
+
+    num_lines = 0
+    num_frames = 0
+    num_rejected = 0
+
+    # Results are collected strictly in submission order. At most two chunks
+    # per worker are in flight, so memory use does not depend on file size.
+    with multiprocessing.Pool(jobs, initWorker, (dbfile, snap_file)) as pool:
+        pending = collections.deque()
+        job_it = iter(job_l)
+
+        for job in itertools.islice(job_it, jobs * 2):
+            pending.append(pool.apply_async(decodeChunk, (job,)))
+
+        while pending:
+            (text, n_lines, n_frames, n_rejected) = pending.popleft().get()
+            if text:
+                out.write(text)
+            num_lines += n_lines
+            num_frames += n_frames
+            num_rejected += n_rejected
+
+            for job in itertools.islice(job_it, 1):
+                pending.append(pool.apply_async(decodeChunk, (job,)))
+
+    return (fmt, num_lines, num_frames, num_rejected,
+            len(job_l) if part_prefix else 0)
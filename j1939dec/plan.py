@@ -0,0 +1,205 @@
+#
+# In-memory decode plan
+#
+# The pgn, spn and sa tables are read once and kept in dictionaries keyed by
+# the integer PGN and source address, so that decoding a frame never has to
+# go back to SQLite.
+#
+import sys
+import time
+import sqlite3
+from collections import namedtuple
+
+
+#
+# Definitions
+#
+
+# One compiled spn row. The first eight fields are the spn table columns
+# procLine used to query; the rest describe how to get the raw value out of
+# the payload read as one little-endian integer:
+#   raw = (payload >> shift) & mask
+# "nbytes" is the payload length the field needs. Raw values from err_min to
+# na_min - 1 are "error", na_min and up are "not available". shift is None for
+# SPNs that cannot be extracted (no start position or length).
+SPNDesc = namedtuple("SPNDesc", [
+    "label", "spn", "byte_num", "bit_len", "bit_start", "scale_factor",
+    "offset", "unit", "shift", "mask", "nbytes", "err_min", "na_min"])
+
+
+#
+# Subroutines
+#
+def getFootprint(obj, seen=None):
+    # Approximate deep size (in bytes) of the containers used by the plan
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for (k, v) in obj.items():
+            size += getFootprint(k, seen) + getFootprint(v, seen)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            size += getFootprint(v, seen)
+
+    return size
+
+
+def _num(val, default):
+    # scale_factor and offset are empty strings for SPNs without scaling
+    if isinstance(val, (int, float)):
+        return float(val)
+
+    return default
+
+
+def compileSPN(label, spn, byte_num, bit_len, bit_start, scale_factor,
+               offset, unit):
+    scale_factor = _num(scale_factor, 1.0)
+    offset = _num(offset, 0.0)
+    if unit is None:
+        unit = ""
+
+    if not byte_num or not bit_len or bit_len < 1:
+        return SPNDesc(label, spn, byte_num, bit_len, bit_start, scale_factor,
+                       offset, unit, None, 0, 0, 0, 0)
+
+    if not bit_start:
+        bit_start = 1
+
+    shift = (byte_num - 1) * 8 + (bit_start - 1)
+    mask = (1 << bit_len) - 1
+    nbytes = (shift + bit_len + 7) // 8
+
+    # J1939-71 ranges: up to 8 bits, all ones is "not available" and all
+    # ones less one is "error" (none for 1-bit fields). Wider fields use
+    # their most significant byte: 0xFF is "not available", 0xFE is "error".
+    if bit_len == 1:
+        na_min = mask + 1
+        err_min = na_min
+    elif bit_len <= 8:
+        na_min = mask
+        err_min = mask - 1
+    else:
+        na_min = 0xFF << (bit_len - 8)
+        err_min = 0xFE << (bit_len - 8)
+
+    return SPNDesc(label, spn, byte_num, bit_len, bit_start, scale_factor,
+                   offset, unit, shift, mask, nbytes, err_min, na_min)
+
+
+class DecodePlan:
+    def __init__(self, dbcon):
+        # pgn_d: {pgn: (label, acronym, [spn tuple, ...])}
+        # sa_d:  {sa: label}
+        #
+        # Each spn entry is an SPNDesc, compiled once at load time
+        self.pgn_d = {}
+        self.sa_d = {}
+        self.num_spns = 0
+        self.load_time = 0.0
+        self.footprint = 0
+
+        self.load(dbcon)
+
+    def load(self, dbcon):
+        t0 = time.perf_counter()
+
+        pgn_d = {}
+        pgnid_d = {}
+        sa_d = {}
+
+        dbcur = dbcon.cursor()
+
+        q = ""\
+          + "SELECT "\
+            + "pgn_id, "\
+            + "pgn, "\
+            + "label, "\
+            + "acronym "\
+          + "FROM "\
+            + "pgn"
+
+        for (pgn_id, pgn, label, acronym) in dbcur.execute(q):
+            # The DA has a handful of duplicate PGN rows; the first one wins,
+            # just like the "WHERE pgn = ?" + fetchone() lookup did
+            if pgn in pgn_d:
+                pgnid_d[pgn_id] = pgn_d[pgn][2]
+                continue
+            spn_l = []
+            pgn_d[pgn] = (label, acronym, spn_l)
+            pgnid_d[pgn_id] = spn_l
+
+        # Schema v2 DBs (see schema.py) carry the shift, mask, byte span and
+        # sentinels precomputed; rows without them are compiled here
+        dec_cols = dbcur.execute("PRAGMA user_version").fetchone()[0] >= 2
+
+        q = ""\
+          + "SELECT "\
+            + "pgn_id, "\
+            + "label, "\
+            + "spn, "\
+            + "byte_num, "\
+            + "bit_len, "\
+            + "bit_start, "\
+            + "scale_factor, "\
+            + "offset, "\
+            + "unit"
+        if dec_cols:
+            q += ", dec_shift, dec_mask, dec_nbytes, dec_err_min, dec_na_min"
+        q += " FROM spn ORDER BY spn_id"
+
+        num_spns = 0
+        for row in dbcur.execute(q):
+            spn_l = pgnid_d.get(row[0])
+            if spn_l is None:
+                continue
+            if dec_cols and row[9] is not None:
+                unit = row[8] if row[8] is not None else ""
+                spn_l.append(SPNDesc(row[1], row[2], row[3], row[4],
+                                     row[5] or 1, _num(row[6], 1.0),
+                                     _num(row[7], 0.0), unit, *row[9:]))
+            else:
+                spn_l.append(compileSPN(*row[1:9]))
+            num_spns += 1
+
+        # The sa table is added by j1939-source-add-ingest.py and may not be
+        # there yet
+        try:
+            q = "SELECT sa, label FROM sa"
+            for (sa, label) in dbcur.execute(q):
+                if sa not in sa_d:
+                    sa_d[sa] = label
+        except sqlite3.OperationalError:
+            pass
+
+        dbcur.close()
+
+        self.pgn_d = pgn_d
+        self.sa_d = sa_d
+        self.num_spns = num_spns
+        self.load_time = time.perf_counter() - t0
+        self.footprint = getFootprint(pgn_d) + getFootprint(sa_d)
+
+        return True
+
+    def getPGN(self, pgn):
+        return self.pgn_d.get(pgn)
+
+    def getSALabel(self, sa):
+        return self.sa_d.get(sa)
+
+    def iterPGNs(self):
+        # Every (pgn, (label, acronym, [SPNDesc, ...]))
+        return iter(self.pgn_d.items())
+
+    def describe(self):
+        return "Decode plan: %d PGNs, %d SPNs, %d SAs loaded in %0.1f ms "\
+               "(~%0.1f KiB)" % (len(self.pgn_d), self.num_spns,
+                                 len(self.sa_d), self.load_time * 1000.0,
+                                 self.footprint / 1024.0)
@@ -0,0 +1,333 @@
+#
+# Profiling hooks (jjd.py/jcd.py --profile, Decoder.profiler())
+#
+# A Profiler runs in one of three modes:
+#
+#   cprofile     cProfile over the decode; a pstats file (python -m pstats,
+#                snakeviz, ...) and a JSON file with the tags and the top
+#                functions
+#   tracemalloc  tracemalloc snapshots at the start and end of the decode;
+#                a JSON file with the peak, the largest allocations and the
+#                growth between the snapshots, and the end snapshot itself
+#                (tracemalloc.Snapshot.load()) next to it
+#   stages       high-resolution timers around every stage of the text
+#                decode: reading lines, parsing them (with TP reassembly
+#                and the decode filters), the ID lookup, SPN extraction,
+#                formatting and writing; a JSON file
+#
+# The output is tagged with the input size and the DB version. Nothing is
+# added to the decode loops: cProfile and tracemalloc hook into the
+# interpreter, and the stage timers come with their own loop
+# (StageTimers.run(), over the formatter's own steps), which decodeFrames()
+# only runs when it is given one. The timers add their own cost to the
+# stages they time.
+#
+import os
+import json
+import time
+import platform
+
+
+#
+# Definitions
+#
+PROFILE_L = ["cprofile", "tracemalloc", "stages"]
+
+# Default output file per mode, after the program name
+PROFILE_EXT_D = {
+    "cprofile": ".pstats",
+    "tracemalloc": ".tracemalloc.json",
+    "stages": ".stages.json"}
+
+STAGE_L = ["read", "parse", "lookup", "extract", "format", "write"]
+
+# tracemalloc records the allocating line only: every further frame costs
+# a line number lookup on every allocation, which for a frame of a long
+# script (such as jjd.py's main code) slows the decode down tenfold
+TRACE_FRAMES = 1
+
+# Functions and allocations listed
+TOP_N = 30
+
+
+#
+# Subroutines
+#
+def defaultFile(prg_nm, mode):
+    return os.path.splitext(os.path.basename(prg_nm))[0] + PROFILE_EXT_D[mode]
+
+
+def inputSize(ifo):
+    # Size in bytes of an input file, or None for STDIN and pipes
+    try:
+        return os.fstat(ifo.fileno()).st_size if os.path.isfile(ifo.name)\
+            else None
+    except (AttributeError, OSError, TypeError, ValueError):
+        return None
+
+
+class TimedInput:
+    # A text input whose lines (or blocks, for the pre-scan) are timed as
+    # the "read" stage
+    def __init__(self, ifo, timers):
+        self.ifo = ifo
+        self.timers = timers
+        self.num_chars = 0
+
+    def __iter__(self):
+        it = iter(self.ifo)
+        pc = time.perf_counter_ns
+        stage_d = self.timers.stage_d
+        while True:
+            t0 = pc()
+            line = next(it, None)
+            stage_d["read"] += pc() - t0
+            if line is None:
+                return
+            self.num_chars += len(line)
+            yield line
+
+    def read(self, size=-1):
+        t0 = time.perf_counter_ns()
+        block = self.ifo.read(size)
+        self.timers.stage_d["read"] += time.perf_counter_ns() - t0
+        self.num_chars += len(block)
+
+        return block
+
+
+class StageTimers:
+    # With count_errors, frames that cannot be decoded (unknown PGN,
+    # reserved bits) are counted in num_errors instead of reported. With
+    # count_ids, frames are counted per CAN ID in id_count_d. j1939dec.stats
+    # builds on both.
+    def __init__(self, count_errors=False, count_ids=False):
+        # Nanoseconds per stage
+        self.stage_d = dict.fromkeys(STAGE_L, 0)
+        self.num_frames = 0
+        self.num_errors = 0
+        self.count_errors = count_errors
+        self.id_count_d = {} if count_ids else None
+        self.input = None
+
+    def wrapInput(self, ifo):
+        self.input = TimedInput(ifo, self)
+
+        return self.input
+
+    def run(self, frames, fmt, write, tick=None, tick_frames=None):
+        # The timed decode loop of decodeFrames(); returns the number of
+        # frames. A frame goes through the steps of the formatter's format()
+        # one at a time. tick() is called every tick_frames frames, with the
+        # stage times and counts up to date.
+        id_d = fmt.id_d
+        lookup = fmt.lookup
+        extract = fmt.extract
+        formatFrame = fmt.formatFrame
+        formatError = fmt.formatError
+        count_errors = self.count_errors
+        id_count_d = self.id_count_d
+        stage_d = self.stage_d
+        pc = time.perf_counter_ns
+
+        num_frames = self.num_frames
+        t_parse = t_lookup = t_extract = t_format = t_write = 0
+        n = 0
+        num_errors = 0
+        next_tick = tick_frames if tick else None
+        it = iter(frames)
+        while True:
+            read0 = stage_d["read"]
+            t0 = pc()
+            frame = next(it, None)
+            t1 = pc()
+            # Reading is timed on its own, within the parser's time
+            t_parse += t1 - t0 - (stage_d["read"] - read0)
+            if frame is None:
+                break
+
+            can_id = frame[1]
+            if id_count_d is not None:
+                id_count_d[can_id] = id_count_d.get(can_id, 0) + 1
+            (head, spn_l) = id_d.get(can_id) or lookup(can_id)
+            t2 = pc()
+            t_lookup += t2 - t1
+
+            if spn_l is None:
+                # The error is written (or counted) in the write stage
+                num_errors += 1
+                t3 = t4 = t2
+                write("" if count_errors else formatError(head))
+            else:
+                val_l = extract(frame, spn_l)
+                t3 = pc()
+                t_extract += t3 - t2
+
+                text = formatFrame(frame, head, val_l)
+                t4 = pc()
+                t_format += t4 - t3
+
+                write(text)
+            t_write += pc() - t4
+            n += 1
+
+            if n == next_tick:
+                self.addTimes(n, num_errors, t_parse, t_lookup, t_extract,
+                              t_format, t_write)
+                t_parse = t_lookup = t_extract = t_format = t_write = 0
+                n = 0
+                num_errors = 0
+                tick()
+
+        self.addTimes(n, num_errors, t_parse, t_lookup, t_extract, t_format,
+                      t_write)
+
+        return self.num_frames - num_frames
+
+    def addTimes(self, n, num_errors, t_parse, t_lookup, t_extract, t_format,
+                 t_write):
+        stage_d = self.stage_d
+        stage_d["parse"] += t_parse
+        stage_d["lookup"] += t_lookup
+        stage_d["extract"] += t_extract
+        stage_d["format"] += t_format
+        stage_d["write"] += t_write
+        self.num_frames += n
+        self.num_errors += num_errors
+
+    def summary(self):
+        n = max(self.num_frames, 1)
+        return {
+            "frames": self.num_frames,
+            "seconds": {stage: t / 1e9 for (stage, t) in self.stage_d.items()},
+            "ns_per_frame": {stage: t / n
+                             for (stage, t) in self.stage_d.items()}}
+
+
+class Profiler:
+    def __init__(self, mode, out_file, tag_d=None):
+        # tag_d: what was profiled (input, input size, DB version, ...)
+        if mode not in PROFILE_L:
+            raise ValueError("Unsupported profile mode [" + mode + "]")
+
+        self.mode = mode
+        self.out_file = out_file
+        self.tag_d = dict(tag_d or {})
+        self.timers = StageTimers() if mode == "stages" else None
+
+        self.prof = None
+        self.snap_l = []
+        self.peak = None
+        self.t_start = None
+        self.elapsed = None
+
+    def start(self):
+        if self.mode == "cprofile":
+            import cProfile
+
+            self.prof = cProfile.Profile()
+        elif self.mode == "tracemalloc":
+            import tracemalloc
+
+            tracemalloc.start(TRACE_FRAMES)
+            self.snap_l = [tracemalloc.take_snapshot()]
+
+        self.t_start = time.perf_counter()
+        if self.prof:
+            self.prof.enable()
+
+    def stop(self):
+        if self.prof:
+            self.prof.disable()
+        self.elapsed = time.perf_counter() - self.t_start
+
+        if self.mode == "tracemalloc":
+            import tracemalloc
+
+            self.snap_l.append(tracemalloc.take_snapshot())
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        self.write()
+
+    def tags(self):
+        tag_d = {"mode": self.mode,
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                 "python": platform.python_version(),
+                 "elapsed": self.elapsed}
+        tag_d.update(self.tag_d)
+        if self.timers and self.timers.input and tag_d.get("input_size")\
+           is None:
+            # STDIN: the characters read
+            tag_d["input_size"] = self.timers.input.num_chars
+
+        return tag_d
+
+    def write(self):
+        # Write the results; returns the files written
+        out_d = self.tags()
+        file_l = [self.out_file]
+
+        if self.mode == "cprofile":
+            import pstats
+
+            self.prof.dump_stats(self.out_file)
+            stats = pstats.Stats(self.prof)
+            top_l = sorted(stats.stats.items(), key=lambda item: -item[1][3])
+            out_d["functions"] = [
+                {"function": "%s:%d(%s)" % func, "calls": nc,
+                 "tottime": tt, "cumtime": ct}
+                for (func, (cc, nc, tt, ct, callers)) in top_l[:TOP_N]]
+            json_file = self.out_file + ".json"
+            file_l.append(json_file)
+        elif self.mode == "tracemalloc":
+            import tracemalloc
+
+            # Modules imported on the way are not part of the decode
+            filter_l = [tracemalloc.Filter(False, "<frozen importlib.*>"),
+                        tracemalloc.Filter(False, tracemalloc.__file__)]
+            (snap0, snap1) = [snap.filter_traces(filter_l)
+                              for snap in self.snap_l]
+            snap1.dump(self.out_file + ".snapshot")
+            file_l.append(self.out_file + ".snapshot")
+            out_d["peak"] = self.peak
+            out_d["traced"] = sum(stat.size for stat in
+                                  snap1.statistics("filename"))
+            out_d["top"] = [
+                {"line": str(stat.traceback[0]), "size": stat.size,
+                 "count": stat.count}
+                for stat in snap1.statistics("lineno")[:TOP_N]]
+            out_d["growth"] = [
+                {"line": str(stat.traceback[0]), "size_diff": stat.size_diff,
+                 "count_diff": stat.count_diff}
+                for stat in snap1.compare_to(snap0, "lineno")[:TOP_N]]
+            json_file = self.out_file
+        else:
+            out_d.update(self.timers.summary())
+            json_file = self.out_file
+
+        with open(json_file, "w") as fo:
+            json.dump(out_d, fo, indent=2)
+            fo.write("\n")
+
+        return file_l
+
+    def describe(self):
+        line = "Profile (%s): %0.2f s, written to %s" % (
+            self.mode, self.elapsed or 0.0, self.out_file)
+        if self.timers:
+            summary_d = self.timers.summary()
+            total = sum(summary_d["seconds"].values()) or 1.0
+            line += "\n  Stages: " + ", ".join(
+                "%s %0.2f s (%0.0f%%, %0.0f ns/frame)" % (
+                    stage, t, 100.0 * t / total,
+                    summary_d["ns_per_frame"][stage])
+                for (stage, t) in summary_d["seconds"].items())
+
+        return line
@@ -0,0 +1,366 @@
+#
+# Streaming CAN log reader
+#
+# The log format is detected once per input from its first lines, after which
+# every line goes through the one parser written for that format. Frames come
+# out as plain (timestamp, can_id, data) tuples:
+#   timestamp: float seconds, or None if the format carries no timestamp
+#   can_id:    29-bit CAN ID as an int
+#   data:      payload as bytes
+#
+# Supported formats:
+#   candump     can0  18FEF121   [8]  C7 FF FF C3 00 FF FF F0
+#   candump-L   (1715275504.474510) can0 0CF00203#CC0000FFF00000FF
+#   candump-t   (1715275504.474510)  can0  18FEF121   [8]  C7 FF ...  (-ta/-tz)
+#   candump-td  (000.000123)  can0  18FEF121   [8]  C7 FF ...  (-td)
+#   candump-tA  (2024-05-09 17:25:04.474510)  can0  18FEF121   [8]  C7 ...
+#   asc         Vector ASC ("base hex"), extended IDs only
+#   trc1        PEAK TRC, file versions 1.1 - 1.3
+#   trc2        PEAK TRC, file versions 2.0 - 2.1
+#
+# With an IDFilter (j1939dec.idfilter), the parsers test the CAN ID as soon
+# as it is parsed and return False for frames the filter drops, without
+# parsing their payload. Where the filter allows, whole blocks of the input
+# are first scanned for the IDs it passes, and only the lines with a hit are
+# parsed at all.
+#
+import re
+import itertools
+from datetime import datetime
+
+
+#
+# Definitions
+#
+DETECT_LINES = 50
+PRESCAN_BLOCK = 1024 * 1024
+
+# Formats whose lines cannot be skipped by the pre-scan: ASC IDs have no
+# leading zeros, and -td timestamps are summed over all lines
+NO_PRESCAN_L = ["asc", "candump-td"]
+FORMAT_L = ["candump", "candump-L", "candump-t", "candump-td", "candump-tA",
+            "asc", "trc1", "trc2"]
+
+# Days between the OLE automation epoch used by $STARTTIME in TRC files
+# (1899-12-30) and the Unix epoch
+TRC_EPOCH_DAYS = 25569
+
+REGX_ASC = re.compile(
+    r"\s*(\d+\.\d+)\s+\d+\s+([0-9A-Fa-f]+)x\s+(?:Rx|Tx)\s+[dD]\s+(\d+)"
+    r"((?:\s+[0-9A-Fa-f]{2})*)")
+REGX_TRC1 = re.compile(
+    r"\s*\d+\)\s+(\d+(?:\.\d+)?)\s+(?:\d+\s+)?(?:Rx|Tx)\s+([0-9A-Fa-f]{8})"
+    r"\s+(?:-\s+)?(\d+)((?:\s+[0-9A-Fa-f]{2})*)")
+REGX_TRC2 = re.compile(
+    r"\s*\d+\s+(\d+\.\d+)\s+DT\s+(?:\d+\s+)?([0-9A-Fa-f]{8})\s+(?:Rx|Tx)"
+    r"\s+(?:-\s+)?(\d+)((?:\s+[0-9A-Fa-f]{2})*)")
+
+
+#
+# Subroutines
+#
+def _parseCandumpBody(flds_l, ts, keep=None):
+    # flds_l: ["can0", "18FEF121", "[8]", "C7", "FF", ...]
+    if len(flds_l) < 3 or not flds_l[2].startswith("["):
+        return None
+
+    can_id = flds_l[1]
+    if len(can_id) < 7:
+        # 11-bit (standard) CAN ID; not J1939
+        return None
+
+    try:
+        can_id = int(can_id, 16)
+        if keep and not keep(can_id):
+            return False
+        dlc = int(flds_l[2][1:-1])
+        return (ts, can_id, bytes.fromhex("".join(flds_l[3:3 + dlc])))
+    except ValueError:
+        return None
+
+
+class FrameReader:
+    def __init__(self, ifo, fmt=None, id_filter=None):
+        self.ifo = ifo
+        self.fmt = fmt
+        self.id_filter = id_filter
+        self.keep = id_filter.keep if id_filter else None
+        self.num_lines = 0
+        self.num_frames = 0
+        self.num_rejected = 0
+        # Lines of frames dropped by the ID filter, and of those the lines
+        # that the pre-scan skipped without parsing them
+        self.num_filtered = 0
+        self.num_skipped = 0
+
+        # Parser state for formats with relative timestamps
+        self.td_acc = 0.0
+        self.trc_start = 0.0
+
+        self.parser_d = {
+            "candump": self.parseCandump,
+            "candump-L": self.parseCandumpL,
+            "candump-t": self.parseCandumpT,
+            "candump-td": self.parseCandumpTD,
+            "candump-tA": self.parseCandumpTA,
+            "asc": self.parseASC,
+            "trc1": self.parseTRC,
+            "trc2": self.parseTRC2}
+
+        if fmt and fmt not in FORMAT_L:
+            raise ValueError("Unsupported input format [" + fmt + "]")
+
+    #
+    # One parser per format. Each returns a frame tuple, None if the line
+    # is not a data frame in that format, or False if the ID filter drops
+    # the frame.
+    #
+    def parseCandump(self, line):
+        return _parseCandumpBody(line.split(), None, self.keep)
+
+    def parseCandumpL(self, line):
+        # (1715275504.474510) can0 0CF00203#CC0000FFF00000FF
+        flds_l = line.split()
+        if len(flds_l) != 3 or flds_l[0][0] != "(":
+            return None
+
+        (can_id, sep, data) = flds_l[2].partition("#")
+        if not sep or len(can_id) < 7 or data.startswith("#"):
+            # No separator, standard ID, or CAN FD frame
+            return None
+
+        try:
+            can_id = int(can_id, 16)
+            if self.keep and not self.keep(can_id):
+                return False
+            return (float(flds_l[0][1:-1]), can_id, bytes.fromhex(data))
+        except ValueError:
+            return None
+
+    def parseCandumpT(self, line, keep=True):
+        flds_l = line.split()
+        if len(flds_l) < 4 or flds_l[0][0] != "(":
+            return None
+
+        try:
+            ts = float(flds_l[0][1:-1])
+        except ValueError:
+            return None
+
+        return _parseCandumpBody(flds_l[1:], ts, self.keep if keep else None)
+
+    def parseCandumpTD(self, line):
+        frame = self.parseCandumpT(line, False)
+        if frame:
+            # Delta timestamps are summed up so that frames carry a time
+            # relative to the first frame of the input (including the frames
+            # the ID filter drops)
+            self.td_acc += frame[0]
+            if self.keep and not self.keep(frame[1]):
+                return False
+            frame = (self.td_acc, frame[1], frame[2])
+
+        return frame
+
+    def parseCandumpTA(self, line):
+        # (2024-05-09 17:25:04.474510)  can0  18FEF121   [8]  C7 FF ...
+        if not line.startswith("("):
+            return None
+
+        (ts, sep, rest) = line[1:].partition(")")
+        flds_l = rest.split()
+        if self.keep and len(flds_l) > 1:
+            # The timestamp is the slow part; test the ID first
+            try:
+                if not self.keep(int(flds_l[1], 16)):
+                    return False
+            except ValueError:
+                return None
+        try:
+            ts = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S.%f").timestamp()
+        except ValueError:
+            return None
+
+        return _parseCandumpBody(flds_l, ts)
+
+    def parseASC(self, line):
+        mobj = REGX_ASC.match(line)
+        if not mobj:
+            return None
+
+        can_id = int(mobj.group(2), 16)
+        if self.keep and not self.keep(can_id):
+            return False
+        dlc = int(mobj.group(3))
+        data = bytes.fromhex(mobj.group(4))[:dlc]
+
+        return (float(mobj.group(1)), can_id, data)
+
+    def _parseTRC(self, regx, line):
+        if line.startswith(";"):
+            # $STARTTIME is the number of days since 1899-12-30
+            if line.startswith(";$STARTTIME="):
+                days = float(line.split("=", 1)[1])
+                self.trc_start = (days - TRC_EPOCH_DAYS) * 86400.0
+            return None
+
+        mobj = regx.match(line)
+        if not mobj:
+            return None
+
+        can_id = int(mobj.group(2), 16)
+        if self.keep and not self.keep(can_id):
+            return False
+        dlc = int(mobj.group(3))
+        data = bytes.fromhex(mobj.group(4))[:dlc]
+
+        # TRC time offsets are in milliseconds
+        ts = self.trc_start + float(mobj.group(1)) / 1000.0
+
+        return (ts, can_id, data)
+
+    def parseTRC(self, line):
+        return self._parseTRC(REGX_TRC1, line)
+
+    def parseTRC2(self, line):
+        return self._parseTRC(REGX_TRC2, line)
+
+    def detect(self, lines_l):
+        # Pick the format whose parser accepts the most of the sample lines.
+        # The parsers are run on throw-away instances so that state such as
+        # $STARTTIME is picked up again during the real pass.
+        best = None
+        best_n = 0
+        for fmt in FORMAT_L:
+            probe = FrameReader(None, fmt)
+            parser = probe.parser_d[fmt]
+            n = 0
+            ts_l = []
+            for line in lines_l:
+                frame = parser(line)
+                if frame:
+                    n += 1
+                    ts_l.append(frame[0])
+
+            # -ta, -tz and -td lines look the same; -td timestamps are deltas
+            # and go up and down, -ta/-tz timestamps only go up
+            if fmt == "candump-t" and n:
+                if any(b < a for (a, b) in zip(ts_l, ts_l[1:])):
+                    fmt = "candump-td"
+
+            if n > best_n:
+                best = fmt
+                best_n = n
+
+        return best
+
+    def prescan(self, head_l, ifo, regx_l):
+        # Generator: the lines of head_l and then of the blocks read from
+        # ifo that any of regx_l (or a TRC $STARTTIME comment) hits, in input
+        # order. Skipped lines are counted in num_lines, num_filtered and
+        # num_skipped.
+        start_tag = ";$STARTTIME="
+        num_skipped = 0
+        try:
+            for line in head_l:
+                if line.startswith(start_tag)\
+                   or any(regx.search(line) for regx in regx_l):
+                    yield line
+                else:
+                    num_skipped += 1
+
+            tail = ""
+            while True:
+                block = ifo.read(PRESCAN_BLOCK)
+                if not block:
+                    break
+
+                # Only whole lines are scanned; the rest goes with the next
+                # block
+                end = block.rfind("\n") + 1
+                if not end:
+                    tail += block
+                    continue
+                block = tail + block
+                end += len(tail)
+                tail = block[end:]
+
+                num_lines = block.count("\n", 0, end)
+                if start_tag in block:
+                    # The TRC header comes before the frames it applies to
+                    for line in block[:end].splitlines(True):
+                        if line.startswith(start_tag):
+                            num_lines -= 1
+                            yield line
+
+                # Start of every line with a hit
+                pos_s = set()
+                for regx in regx_l:
+                    for mobj in regx.finditer(block, 0, end):
+                        pos_s.add(block.rfind("\n", 0, mobj.start()) + 1)
+
+                num_lines -= len(pos_s)
+                for pos in sorted(pos_s):
+                    yield block[pos:block.index("\n", pos) + 1]
+                num_skipped += num_lines
+
+            if tail:
+                if any(regx.search(tail) for regx in regx_l):
+                    yield tail
+                else:
+                    num_skipped += 1
+        finally:
+            self.num_lines += num_skipped
+            self.num_filtered += num_skipped
+            self.num_skipped += num_skipped
+
+    def __iter__(self):
+        ifo = self.ifo
+
+        head_l = []
+        if not self.fmt:
+            head_l = list(itertools.islice(ifo, DETECT_LINES))
+            self.fmt = self.detect(head_l)
+            if not self.fmt:
+                self.num_lines = len(head_l)
+                self.num_rejected = len(head_l)
+                return
+
+        regx_l = None
+        if self.id_filter and self.fmt not in NO_PRESCAN_L\
+           and hasattr(ifo, "read"):
+            regx_l = self.id_filter.prescanRegexes()
+
+        if regx_l:
+            ifo = self.prescan(head_l, ifo, regx_l)
+        elif head_l:
+            ifo = itertools.chain(head_l, ifo)
+
+        parser = self.parser_d[self.fmt]
+
+        num_lines = 0
+        num_frames = 0
+        num_filtered = 0
+        try:
+            for line in ifo:
+                num_lines += 1
+                frame = parser(line)
+                if frame:
+                    num_frames += 1
+                    yield frame
+                elif frame is False:
+                    num_filtered += 1
+        finally:
+            self.num_lines += num_lines
+            self.num_frames += num_frames
+            self.num_filtered += num_filtered
+            self.num_rejected += num_lines - num_frames - num_filtered
+
+
+def parseLine(line, fmt=None):
+    # Parse a single CAN message, e.g. one given on the command line
+    rdr = FrameReader([line], fmt)
+    for frame in rdr:
+        return frame
+
+    return None
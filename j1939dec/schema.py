@@ -0,0 +1,154 @@
+#
+# DB schema versions and migrations
+#
+# The schema version is kept in SQLite's own "PRAGMA user_version":
+#   0 = pgn, spn and sa tables as first built by the ingest scripts (Oct22)
+#   1 = indexes on pgn(pgn) and sa(sa, label), meta table
+#   2 = covering index on spn(pgn_id, spn, label) and precomputed decode
+#       columns on spn (dec_shift, dec_mask, dec_nbytes, dec_err_min,
+#       dec_na_min; see plan.SPNDesc)
+#
+# Every migration runs in its own transaction together with the version
+# bump, so an interrupted upgrade leaves the DB at the last completed
+# version. Migrations only add, so older tools keep working on newer DBs.
+#
+import os
+import time
+import sqlite3
+import urllib.request
+
+from j1939dec.plan import compileSPN
+
+
+#
+# Definitions
+#
+SCHEMA_VERSION = 2
+
+# Read-only connections map up to this much of the DB file
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Decode columns are only stored while every value fits in a signed 64-bit
+# SQLite integer; wider fields are compiled when the plan is loaded
+MAX_DEC_BITS = 62
+
+DEC_COLUMN_L = ["dec_shift", "dec_mask", "dec_nbytes", "dec_err_min",
+                "dec_na_min"]
+
+
+#
+# Subroutines
+#
+def openReadOnly(dbfile):
+    # The query tools never write: open the DB read-only (which also fails
+    # instead of creating an empty DB when the file is missing) and let
+    # SQLite read it through mmap
+    uri = "file:" + urllib.request.pathname2url(os.path.abspath(dbfile))\
+        + "?mode=ro"
+    dbcon = sqlite3.connect(uri, uri=True)
+    dbcon.execute("PRAGMA mmap_size = %d" % MMAP_SIZE)
+
+    return dbcon
+
+
+def getVersion(dbcon):
+    return dbcon.execute("PRAGMA user_version").fetchone()[0]
+
+
+def hasTable(dbcon, name):
+    q = "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return dbcon.execute(q, (name,)).fetchone()[0] > 0
+
+
+def fillDecodeColumns(dbcon):
+    # (Re)computes the decode columns of every spn row
+    q = ""\
+      + "SELECT "\
+        + "spn_id, "\
+        + "label, "\
+        + "spn, "\
+        + "byte_num, "\
+        + "bit_len, "\
+        + "bit_start, "\
+        + "scale_factor, "\
+        + "offset, "\
+        + "unit "\
+      + "FROM "\
+        + "spn"
+
+    row_l = []
+    for row in dbcon.execute(q).fetchall():
+        desc = compileSPN(*row[1:])
+        if desc.shift is None or desc.bit_len > MAX_DEC_BITS:
+            row_l.append((None, None, None, None, None, row[0]))
+        else:
+            row_l.append((desc.shift, desc.mask, desc.nbytes, desc.err_min,
+                          desc.na_min, row[0]))
+
+    dbcon.executemany("UPDATE spn SET "
+                      + " = ?, ".join(DEC_COLUMN_L)
+                      + " = ? WHERE spn_id = ?", row_l)
+
+    return len(row_l)
+
+
+def _migrate1(dbcon):
+    dbcon.execute("CREATE INDEX IF NOT EXISTS pgn_pgn ON pgn(pgn)")
+    if hasTable(dbcon, "sa"):
+        dbcon.execute("CREATE INDEX IF NOT EXISTS sa_sa ON sa(sa, label)")
+    dbcon.execute("CREATE TABLE IF NOT EXISTS meta ("
+                  + "key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _migrate2(dbcon):
+    # Covers the "associated SPNs" lookup of jjd.py -p; spn(spn, pgn_id)
+    # already covers jjd.py -p -s
+    dbcon.execute("CREATE INDEX IF NOT EXISTS spn_pgnid "
+                  + "ON spn(pgn_id, spn, label)")
+
+    col_s = set(row[1] for row in dbcon.execute("PRAGMA table_info(spn)"))
+    for col in DEC_COLUMN_L:
+        if col not in col_s:
+            dbcon.execute("ALTER TABLE spn ADD COLUMN " + col + " INTEGER")
+
+    fillDecodeColumns(dbcon)
+
+
+# (version, description, migration)
+MIGRATION_L = [
+    (1, "indexes on pgn(pgn) and sa(sa, label), meta table", _migrate1),
+    (2, "covering index on spn(pgn_id, spn, label), precomputed decode "
+        "columns", _migrate2)]
+
+
+def pendingMigrations(dbcon):
+    ver = getVersion(dbcon)
+    return [m for m in MIGRATION_L if m[0] > ver]
+
+
+def migrate(dbcon, progress=None):
+    # Upgrades the DB to SCHEMA_VERSION in place; returns the versions
+    # applied. progress(version, description, seconds) is called after each.
+    dbcon.commit()
+    level = dbcon.isolation_level
+    dbcon.isolation_level = None
+
+    applied_l = []
+    try:
+        for (ver, desc, func) in pendingMigrations(dbcon):
+            t0 = time.perf_counter()
+            dbcon.execute("BEGIN")
+            try:
+                func(dbcon)
+                dbcon.execute("PRAGMA user_version = %d" % ver)
+                dbcon.execute("COMMIT")
+            except BaseException:
+                dbcon.execute("ROLLBACK")
+                raise
+            applied_l.append(ver)
+            if progress:
+                progress(ver, desc, time.perf_counter() - t0)
+    finally:
+        dbcon.isolation_level = level
+
+    return applied_l
@@ -0,0 +1,391 @@
+#
+# Resident decode service
+#
+# Keeps the decode plan loaded in a pool of worker processes and decodes
+# batches sent over a Unix domain socket or a localhost HTTP endpoint, so
+# that a pipeline pays interpreter start-up and plan loading once instead of
+# per batch.
+#
+# A batch is either log text in any format FrameReader reads, or binary
+# frames: FRAME_REC records of (timestamp, CAN ID, DLC, 8 data bytes), with
+# a NaN timestamp for frames without one.
+#
+# Unix socket protocol: a request is one line of JSON followed by "length"
+# bytes of batch, the response one line of JSON followed by "length" bytes
+# of output. A connection can carry any number of requests. Request keys:
+#   op         "decode" (default) or "stats"
+#   format     "human" (default), "csv" or "jsonl"
+#   in_format  input log format (default: detected per batch)
+#   binary     true if the batch is FRAME_REC records
+#   tp         false to skip TP reassembly
+#   header     false to leave out the CSV header line
+#   length     number of batch bytes that follow
+#
+# HTTP: POST /decode with the batch as body (Content-Type
+# application/x-j1939-frames for binary frames) and the request keys as
+# query parameters; GET /stats. The output comes back as text/plain,
+# text/csv or application/x-ndjson (JSON Lines), after the format.
+#
+# reload() (SIGHUP in jds.py) loads the plan again and starts a new pool.
+# The old pool is closed rather than terminated, so the batches it has
+# already accepted are decoded before its workers exit.
+#
+import io
+import os
+import sys
+import json
+import math
+import time
+import signal
+import struct
+import threading
+import collections
+import socketserver
+import multiprocessing
+import urllib.parse
+import http.server
+
+from j1939dec.snapshot import loadPlan
+from j1939dec.reader import FORMAT_L, FrameReader
+from j1939dec.decode import decodeFrames
+from j1939dec.output import OUTPUT_FORMAT_L, formatHeader
+from j1939dec.tp import TPReassembler
+
+
+#
+# Definitions
+#
+# timestamp, can_id, dlc, data
+FRAME_REC = struct.Struct("<dIB8s")
+FRAMES_TYPE = "application/x-j1939-frames"
+
+# HTTP Content-Type of the output, per format (text/plain for "human")
+CONTENT_TYPE_D = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson"}
+
+MAX_BATCH = 64 * 1024 * 1024
+
+# Number of most recent requests the latency percentiles are taken over
+LATENCY_WINDOW = 4096
+
+# Plan of this (worker) process
+_plan = None
+
+
+#
+# Subroutines
+#
+def initWorker(dbfile, snap_file=None):
+    global _plan
+
+    # Forked workers inherit the plan loaded by DecodeService
+    if _plan is None:
+        _plan = loadPlan(dbfile, snap_file)
+
+    # Reloads and shutdown are up to the service process; a worker killed
+    # by a signal sent to the whole process group would lose its batch
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # The "Details" lines of the human readable output are jjd.py commands
+    sys.argv[0] = os.path.join(os.path.dirname(sys.argv[0]), "jjd.py")
+
+
+def iterFrameRecs(buf):
+    for (ts, can_id, dlc, data) in FRAME_REC.iter_unpack(buf):
+        yield (None if math.isnan(ts) else ts, can_id, data[:dlc])
+
+
+def packFrame(frame):
+    (ts, can_id, data) = frame
+    return FRAME_REC.pack(math.nan if ts is None else ts, can_id, len(data),
+                          data)
+
+
+def decodeBatch(job):
+    # Returns (output text, number of lines, number of frames)
+    (oformat, iformat, binary, reassemble, header, buf) = job
+
+    out = io.StringIO()
+    if header and formatHeader(oformat):
+        print(formatHeader(oformat), file=out)
+
+    if binary:
+        rdr = None
+        frames = iterFrameRecs(buf)
+    else:
+        rdr = FrameReader(io.StringIO(buf.decode(errors="replace")), iformat)
+        frames = rdr
+    if reassemble:
+        frames = TPReassembler().process(frames)
+
+    decodeFrames(frames, _plan, oformat, out)
+    if rdr:
+        return (out.getvalue(), rdr.num_lines, rdr.num_frames)
+
+    return (out.getvalue(), 0, len(buf) // FRAME_REC.size)
+
+
+def parseRequest(req_d):
+    # Validated decode job options from the request keys; raises ValueError
+    oformat = req_d.get("format") or "human"
+    if oformat not in OUTPUT_FORMAT_L:
+        raise ValueError("Unsupported output format [" + str(oformat) + "]")
+
+    iformat = req_d.get("in_format") or None
+    if iformat and iformat not in FORMAT_L:
+        raise ValueError("Unsupported input format [" + str(iformat) + "]")
+
+    return (None if oformat == "human" else oformat, iformat,
+            bool(req_d.get("binary", False)), bool(req_d.get("tp", True)),
+            bool(req_d.get("header", True)))
+
+
+def _flag(val):
+    return val.lower() not in ["0", "false", "no"]
+
+
+class DecodeService:
+    def __init__(self, dbfile, snap_file=None, jobs=None, log=None):
+        self.dbfile = dbfile
+        self.snap_file = snap_file
+        self.jobs = jobs or os.cpu_count() or 1
+        self.log = log
+
+        self.lock = threading.Lock()
+        self.pool = None
+        self.plan_desc = None
+        self.num_reloads = 0
+
+        self.start_time = time.time()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_lines = 0
+        self.num_frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.busy_time = 0.0
+        self.max_latency = 0.0
+        self.latency_l = collections.deque(maxlen=LATENCY_WINDOW)
+
+        self.pool = self._newPool()
+
+    def _newPool(self):
+        # The plan is loaded here first, so that a DB that cannot be loaded
+        # leaves the running pool in place, and forked workers share it
+        global _plan
+
+        plan = loadPlan(self.dbfile, self.snap_file, self.log)
+        _plan = plan
+        self.plan_desc = plan.describe()
+
+        return multiprocessing.Pool(self.jobs, initWorker,
+                                    (self.dbfile, self.snap_file))
+
+    def reload(self):
+        new_pool = self._newPool()
+        with self.lock:
+            old_pool = self.pool
+            self.pool = new_pool
+            self.num_reloads += 1
+
+        # Requests already handed to the old pool still complete
+        old_pool.close()
+        threading.Thread(target=old_pool.join, daemon=True).start()
+
+    def decode(self, req_d, buf):
+        # Returns (output bytes, number of lines, number of frames); raises
+        # ValueError for a bad request
+        t0 = time.perf_counter()
+        try:
+            job = parseRequest(req_d)
+            if job[2] and len(buf) % FRAME_REC.size:
+                raise ValueError("Binary batch is not a whole number of "
+                                 + str(FRAME_REC.size) + "-byte frames")
+            with self.lock:
+                res = self.pool.apply_async(decodeBatch, (job + (buf,),))
+            (text, num_lines, num_frames) = res.get()
+        except Exception:
+            with self.lock:
+                self.num_errors += 1
+            raise
+
+        data = text.encode()
+        secs = time.perf_counter() - t0
+        with self.lock:
+            self.num_requests += 1
+            self.num_lines += num_lines
+            self.num_frames += num_frames
+            self.bytes_in += len(buf)
+            self.bytes_out += len(data)
+            self.busy_time += secs
+            self.max_latency = max(self.max_latency, secs)
+            self.latency_l.append(secs)
+
+        return (data, num_lines, num_frames)
+
+    def stats(self):
+        with self.lock:
+            lat_l = sorted(self.latency_l)
+            stats_d = {
+                "uptime": time.time() - self.start_time,
+                "requests": self.num_requests,
+                "errors": self.num_errors,
+                "lines": self.num_lines,
+                "frames": self.num_frames,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "busy_seconds": self.busy_time,
+                "reloads": self.num_reloads,
+                "workers": self.jobs,
+                "plan": self.plan_desc}
+            max_lat = self.max_latency
+
+        stats_d["frames_per_sec"] = stats_d["frames"] / stats_d["uptime"]
+        stats_d["requests_per_sec"] = stats_d["requests"] / stats_d["uptime"]
+        stats_d["latency_ms"] = {"max": max_lat * 1000.0}
+        if lat_l:
+            stats_d["latency_ms"]["mean"] = sum(lat_l) / len(lat_l) * 1000.0
+            for (name, q) in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]:
+                stats_d["latency_ms"][name] = lat_l[
+                    min(len(lat_l) - 1, int(q * len(lat_l)))] * 1000.0
+
+        return stats_d
+
+    def close(self):
+        with self.lock:
+            pool = self.pool
+        pool.close()
+        pool.join()
+
+
+class UnixHandler(socketserver.StreamRequestHandler):
+    def reply(self, resp_d, data=b""):
+        resp_d["length"] = len(data)
+        self.wfile.write(json.dumps(resp_d).encode() + b"\n")
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            try:
+                req_d = json.loads(line)
+                length = int(req_d.get("length", 0))
+            except (ValueError, AttributeError) as e:
+                self.reply({"status": "error", "error": "Bad request header ["
+                            + str(e) + "]"})
+                return
+
+            if length < 0 or length > MAX_BATCH:
+                self.reply({"status": "error", "error": "Batch too large"})
+                return
+            buf = self.rfile.read(length)
+            if len(buf) != length:
+                return
+
+            if req_d.get("op", "decode") == "stats":
+                self.reply({"status": "ok"},
+                           json.dumps(service.stats()).encode())
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                (data, num_lines, num_frames) = service.decode(req_d, buf)
+            except ValueError as e:
+                self.reply({"status": "error", "error": str(e)})
+                continue
+            self.reply({"status": "ok", "lines": num_lines,
+                        "frames": num_frames,
+                        "ms": (time.perf_counter() - t0) * 1000.0}, data)
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        if os.path.exists(path):
+            # Left behind by a service that did not shut down cleanly
+            os.remove(path)
+        self.service = service
+        socketserver.UnixStreamServer.__init__(self, path, UnixHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class HTTPHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, code, data, ctype, hdr_d=None):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        for (k, v) in (hdr_d or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def replyError(self, code, msg):
+        self.reply(code, ("ERROR - " + msg + "\n").encode(), "text/plain")
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/stats":
+            self.replyError(404, "Not found")
+            return
+        self.reply(200, json.dumps(self.server.service.stats()).encode(),
+                   "application/json")
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/decode":
+            self.replyError(404, "Not found")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.replyError(411, "Content-Length required")
+            return
+        if length < 0 or length > MAX_BATCH:
+            self.replyError(413, "Batch too large")
+            return
+        buf = self.rfile.read(length)
+
+        req_d = {}
+        for (k, v) in urllib.parse.parse_qsl(url.query):
+            k = k.replace("-", "_")
+            req_d[k] = _flag(v) if k in ["tp", "header"] else v
+        ctype = self.headers.get("Content-Type", "")
+        req_d["binary"] = ctype.split(";")[0].strip() == FRAMES_TYPE
+
+        t0 = time.perf_counter()
+        try:
+            (data, num_lines, num_frames) = self.server.service.decode(req_d,
+                                                                       buf)
+        except ValueError as e:
+            self.replyError(400, str(e))
+            return
+
+        ctype = CONTENT_TYPE_D.get(req_d.get("format"), "text/plain")
+        self.reply(200, data, ctype + "; charset=utf-8", {
+            "X-Lines": num_lines,
+            "X-Frames": num_frames,
+            "X-Decode-Ms": "%0.3f" % ((time.perf_counter() - t0) * 1000.0)})
+
+    def log_message(self, fmt, *args):
+        # No access log; see /stats
+        pass
+
+
+class HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, service):
+        # Only ever bound to the loopback interface
+        self.service = service
+        http.server.ThreadingHTTPServer.__init__(self, ("127.0.0.1", port),
+                                                 HTTPHandler)
@@ -0,0 +1,324 @@
+#
+# Binary decode-table snapshot
+#
+# A snapshot is the decode plan (see plan.py) written out as one file of
+# fixed-width little-endian records, so that a decoder can memory-map it and
+# start without opening SQLite:
+#
+#   header   magic, format version, record counts, section offsets, and the
+#            size, change counter and SHA-256 of the DB it was made from
+#   pgn      PGN_REC per PGN, sorted by PGN: the PGN offset index; each
+#            record points at the PGN's run of SPN records
+#   spn      SPN_REC per SPN, with the shift, mask, byte span and sentinels
+#            already compiled
+#   sa       SA_REC per source address, sorted by address
+#   strings  labels, acronyms and units, each a u32 length and UTF-8 bytes
+#
+# SnapshotPlan has the interface of DecodePlan. Lookups binary-search the
+# mapped file and only the PGNs and SAs that actually occur in the traffic are
+# turned into Python objects (and then cached).
+#
+import os
+import mmap
+import time
+import struct
+import hashlib
+
+from j1939dec.plan import DecodePlan, SPNDesc, compileSPN
+from j1939dec.schema import openReadOnly
+
+
+#
+# Definitions
+#
+MAGIC = b"J1939SNP"
+SNAPSHOT_VERSION = 1
+
+# magic, version, flags, num_pgns, num_spns, num_sas, pgn_off, spn_off,
+# sa_off, str_off, str_len, db_size, db_counter, db_sha256, created
+HEADER = struct.Struct("<8sHHIIIIIIIIQI32sd")
+
+# pgn, first spn record, number of spn records, label, acronym
+PGN_REC = struct.Struct("<IIIII")
+
+# spn, label, unit, byte_num, bit_len, bit_start, shift, nbytes, pad, mask,
+# err_min, na_min, scale_factor, offset
+SPN_REC = struct.Struct("<IIIhhhhHHQQQdd")
+
+# sa, label
+SA_REC = struct.Struct("<II")
+
+NO_STR = 0xFFFFFFFF
+NO_VAL = -1
+
+# shift value of a field that is decodable but too wide for the 64-bit
+# record fields; it is compiled from byte_num/bit_len/bit_start on use
+WIDE_SHIFT = -2
+MAX_REC_BITS = 62
+
+# Offset of SQLite's file change counter in the DB header
+DB_COUNTER_OFF = 24
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+#
+# Subroutines
+#
+def dbFingerprint(dbfile, with_hash=True):
+    # (size, change counter, sha256) of a DB file. SQLite bumps the change
+    # counter on every write transaction (rollback journal mode), so size and
+    # counter are enough to tell that a DB has not changed.
+    size = os.path.getsize(dbfile)
+    with open(dbfile, "rb") as fo:
+        head = fo.read(100)
+        counter = struct.unpack_from(">I", head, DB_COUNTER_OFF)[0]\
+            if len(head) >= 28 else 0
+
+        digest = b""
+        if with_hash:
+            fo.seek(0)
+            hobj = hashlib.sha256()
+            for blk in iter(lambda: fo.read(HASH_BLOCK_SIZE), b""):
+                hobj.update(blk)
+            digest = hobj.digest()
+
+    return (size, counter, digest)
+
+
+def _shortVal(val):
+    return NO_VAL if val is None else val
+
+
+def _longVal(val):
+    return None if val == NO_VAL else val
+
+
+def exportSnapshot(dbcon, dbfile, snap_file):
+    # Writes the snapshot of the DB (dbcon open on dbfile) atomically;
+    # returns (number of PGNs, number of SPNs, number of SAs)
+    plan = DecodePlan(dbcon)
+
+    str_d = {}
+    str_b = bytearray()
+
+    def addStr(s):
+        if s is None:
+            return NO_STR
+        off = str_d.get(s)
+        if off is None:
+            off = len(str_b)
+            data = str(s).encode("utf-8")
+            str_b.extend(struct.pack("<I", len(data)))
+            str_b.extend(data)
+            str_d[s] = off
+        return off
+
+    pgn_b = bytearray()
+    spn_b = bytearray()
+    num_spns = 0
+    num_pgns = 0
+    for pgn in sorted(p for p in plan.pgn_d if isinstance(p, int)):
+        (label, acronym, spn_l) = plan.pgn_d[pgn]
+        pgn_b.extend(PGN_REC.pack(pgn, num_spns, len(spn_l), addStr(label),
+                                  addStr(acronym)))
+        num_pgns += 1
+        for i in spn_l:
+            if i.shift is None:
+                dec = (NO_VAL, 0, 0, 0, 0)
+            elif i.bit_len > MAX_REC_BITS:
+                dec = (WIDE_SHIFT, 0, 0, 0, 0)
+            else:
+                dec = (i.shift, i.nbytes, i.mask, i.err_min, i.na_min)
+            spn_b.extend(SPN_REC.pack(
+                i.spn if isinstance(i.spn, int) else 0, addStr(i.label),
+                addStr(i.unit), _shortVal(i.byte_num), _shortVal(i.bit_len),
+                _shortVal(i.bit_start), dec[0], dec[1], 0, dec[2], dec[3],
+                dec[4], i.scale_factor, i.offset))
+            num_spns += 1
+
+    sa_b = bytearray()
+    num_sas = 0
+    for sa in sorted(s for s in plan.sa_d if isinstance(s, int)):
+        sa_b.extend(SA_REC.pack(sa, addStr(plan.sa_d[sa])))
+        num_sas += 1
+
+    (db_size, db_counter, db_digest) = dbFingerprint(dbfile)
+
+    pgn_off = HEADER.size
+    spn_off = pgn_off + len(pgn_b)
+    sa_off = spn_off + len(spn_b)
+    str_off = sa_off + len(sa_b)
+
+    hdr = HEADER.pack(MAGIC, SNAPSHOT_VERSION, 0, num_pgns, num_spns,
+                      num_sas, pgn_off, spn_off, sa_off, str_off, len(str_b),
+                      db_size, db_counter, db_digest, time.time())
+
+    tmp_file = snap_file + ".tmp"
+    with open(tmp_file, "wb") as fo:
+        for blk in (hdr, pgn_b, spn_b, sa_b, str_b):
+            fo.write(blk)
+    os.replace(tmp_file, snap_file)
+
+    return (num_pgns, num_spns, num_sas)
+
+
+class SnapshotPlan:
+    def __init__(self, snap_file):
+        t0 = time.perf_counter()
+
+        self.snap_file = snap_file
+        with open(snap_file, "rb") as fo:
+            self.mm = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < HEADER.size:
+            raise ValueError(snap_file + ": Not a decode snapshot")
+        (magic, ver, flags, self.num_pgns, self.num_spns, self.num_sas,
+         self.pgn_off, self.spn_off, self.sa_off, self.str_off, str_len,
+         self.db_size, self.db_counter, self.db_digest,
+         self.created) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(snap_file + ": Not a decode snapshot")
+        if ver != SNAPSHOT_VERSION:
+            raise ValueError(snap_file + ": Unsupported snapshot version "
+                             + str(ver))
+        if len(self.mm) < self.str_off + str_len:
+            raise ValueError(snap_file + ": Truncated snapshot")
+
+        self.pgn_cache_d = {}
+        self.sa_cache_d = {}
+        self.load_time = time.perf_counter() - t0
+        self.footprint = 0
+
+    def isStale(self, dbfile):
+        # True if dbfile is not the DB the snapshot was made from. Only when
+        # the cheap size/change counter check fails is the DB hashed.
+        (size, counter, digest) = dbFingerprint(dbfile, False)
+        if size == self.db_size and counter == self.db_counter:
+            return False
+
+        return dbFingerprint(dbfile)[2] != self.db_digest
+
+    def getStr(self, off):
+        if off == NO_STR:
+            return None
+        pos = self.str_off + off
+        n = struct.unpack_from("<I", self.mm, pos)[0]
+        return self.mm[pos + 4:pos + 4 + n].decode("utf-8")
+
+    def _search(self, key, base, num, rec):
+        # Binary search of a table sorted on its first (u32) field
+        mm = self.mm
+        size = rec.size
+        lo = 0
+        hi = num
+        while lo < hi:
+            mid = (lo + hi) // 2
+            val = struct.unpack_from("<I", mm, base + mid * size)[0]
+            if val < key:
+                lo = mid + 1
+            elif val > key:
+                hi = mid
+            else:
+                return rec.unpack_from(mm, base + mid * size)
+
+        return None
+
+    def _spnDesc(self, n):
+        (spn, label, unit, byte_num, bit_len, bit_start, shift, nbytes, pad,
+         mask, err_min, na_min, scale_factor, offset) = SPN_REC.unpack_from(
+             self.mm, self.spn_off + n * SPN_REC.size)
+
+        label = self.getStr(label)
+        unit = self.getStr(unit)
+        byte_num = _longVal(byte_num)
+        bit_len = _longVal(bit_len)
+        bit_start = _longVal(bit_start)
+
+        if shift == WIDE_SHIFT:
+            return compileSPN(label, spn, byte_num, bit_len, bit_start,
+                              scale_factor, offset, unit)
+        if shift == NO_VAL:
+            shift = None
+
+        return SPNDesc(label, spn, byte_num, bit_len, bit_start,
+                       scale_factor, offset, unit, shift, mask, nbytes,
+                       err_min, na_min)
+
+    def _pgnInfo(self, rec):
+        (pgn, first, num, label, acronym) = rec
+        spn_l = [self._spnDesc(n) for n in range(first, first + num)]
+
+        return (self.getStr(label), self.getStr(acronym), spn_l)
+
+    def getPGN(self, pgn):
+        try:
+            return self.pgn_cache_d[pgn]
+        except KeyError:
+            pass
+
+        rec = None
+        if isinstance(pgn, int) and 0 <= pgn <= 0xFFFFFFFF:
+            rec = self._search(pgn, self.pgn_off, self.num_pgns, PGN_REC)
+        info = self._pgnInfo(rec) if rec else None
+        self.pgn_cache_d[pgn] = info
+
+        return info
+
+    def getSALabel(self, sa):
+        try:
+            return self.sa_cache_d[sa]
+        except KeyError:
+            pass
+
+        rec = None
+        if isinstance(sa, int) and 0 <= sa <= 0xFFFFFFFF:
+            rec = self._search(sa, self.sa_off, self.num_sas, SA_REC)
+        label = self.getStr(rec[1]) if rec else None
+        self.sa_cache_d[sa] = label
+
+        return label
+
+    def iterPGNs(self):
+        # Every (pgn, (label, acronym, [SPNDesc, ...])); this decodes the
+        # whole snapshot
+        for n in range(self.num_pgns):
+            rec = PGN_REC.unpack_from(self.mm, self.pgn_off + n * PGN_REC.size)
+            yield (rec[0], self.getPGN(rec[0]))
+
+    def describe(self):
+        return "Decode plan: %d PGNs, %d SPNs, %d SAs mapped from %s in "\
+               "%0.1f ms (%0.1f KiB file)" % (
+                   self.num_pgns, self.num_spns, self.num_sas,
+                   self.snap_file, self.load_time * 1000.0,
+                   len(self.mm) / 1024.0)
+
+    def close(self):
+        self.mm.close()
+
+
+def loadPlan(dbfile, snap_file=None, warn=None):
+    # The decode plan from snap_file if it was made from dbfile (or if there
+    # is no dbfile to check it against), otherwise from the DB itself.
+    # warn(msg) is told why a snapshot was not used.
+    if snap_file:
+        if not os.path.exists(snap_file):
+            if warn:
+                warn(snap_file + ": Not found, using " + dbfile)
+        else:
+            plan = SnapshotPlan(snap_file)
+            if not dbfile or not os.path.exists(dbfile):
+                return plan
+            if not plan.isStale(dbfile):
+                return plan
+            plan.close()
+            if warn:
+                warn(snap_file + ": Stale (made from a different " + dbfile
+                     + "), using the DB")
+
+    dbcon = openReadOnly(dbfile)
+    try:
+        plan = DecodePlan(dbcon)
+    finally:
+        dbcon.close()
+
+    return plan
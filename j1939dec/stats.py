@@ -0,0 +1,188 @@
+#
+# Decode statistics (jjd.py --stats)
+#
+# DecodeStats are StageTimers (j1939dec.profiling) that also count frames
+# per CAN ID and count the frames that cannot be decoded instead of
+# reporting each one. Handed to decodeStream()/decodeFrames(), they run the
+# timed loop of the stage timers, so the time of every frame is split into
+# the same stages as with --profile=stages:
+#
+#   read     reading lines from the input
+#   parse    parsing them, TP reassembly and the ID filter
+#   lookup   the CAN ID lookup
+#   extract  SPN extraction
+#   format   formatting the output
+#   write    writing it
+#
+# The per-PGN, per-SA and unknown-PGN counts are worked out from the
+# per-ID counts when a report is made. A report goes to STDERR every
+# "interval" seconds and at the end, and the final one can be written to a
+# JSON file.
+#
+import sys
+import json
+import time
+
+from j1939dec.output import splitID
+from j1939dec.profiling import StageTimers
+
+
+#
+# Definitions
+#
+STATS_INTERVAL = 10.0
+
+# Check the time for a periodic report every this many frames
+CHECK_FRAMES = 16384
+
+# PGNs and SAs listed in the STDERR report
+TOP_N = 10
+
+
+#
+# Subroutines
+#
+class DecodeStats(StageTimers):
+    def __init__(self, plan, interval=STATS_INTERVAL, err=None):
+        StageTimers.__init__(self, count_errors=True, count_ids=True)
+        self.plan = plan
+        self.interval = interval
+        self.err = err
+
+        self.rdr = None
+        self.fmt = None
+        self.id_filter = None
+        self.tp = None
+
+        self.t_start = time.perf_counter()
+        self.t_report = self.t_start
+
+    def run(self, frames, fmt, write):
+        # The timed decode loop of decodeFrames(); returns the number of
+        # frames
+        self.fmt = fmt
+        return StageTimers.run(self, frames, fmt, write,
+                               self.tick if self.interval else None,
+                               CHECK_FRAMES)
+
+    def tick(self):
+        if time.perf_counter() - self.t_report >= self.interval:
+            self.report()
+
+    def summary(self):
+        # All the statistics as a dict (as written to the JSON file)
+        elapsed = time.perf_counter() - self.t_start
+
+        pgn_d = {}
+        sa_d = {}
+        unknown_d = {}
+        num_reserved = 0
+        for (can_id, n) in self.id_count_d.items():
+            if (can_id >> 24) & 3:
+                num_reserved += n
+                continue
+            (pgn, dest_add, sa) = splitID(can_id)
+            sa_d[sa] = sa_d.get(sa, 0) + n
+            if self.plan.getPGN(pgn):
+                pgn_d[pgn] = pgn_d.get(pgn, 0) + n
+            else:
+                unknown_d[pgn] = unknown_d.get(pgn, 0) + n
+
+        stats_d = {"elapsed": elapsed}
+        if self.rdr:
+            stats_d["lines"] = self.rdr.num_lines
+            stats_d["rejected"] = self.rdr.num_rejected
+            stats_d["filtered"] = self.rdr.num_filtered
+            stats_d["skipped"] = self.rdr.num_skipped
+        stats_d["frames"] = self.num_frames
+        stats_d["decoded"] = sum(pgn_d.values())
+        stats_d["unknown"] = sum(unknown_d.values())
+        stats_d["reserved"] = num_reserved
+        stats_d["errors"] = self.num_errors
+        stats_d["frames_per_sec"] = self.num_frames / elapsed if elapsed\
+            else 0.0
+        stats_d["stages"] = {stage: t / 1e9
+                             for (stage, t) in self.stage_d.items()}
+
+        cache_d = {}
+        if self.fmt:
+            misses = self.fmt.num_lookups
+            cache_d["id"] = {"hits": self.num_frames - misses,
+                             "misses": misses,
+                             "ratio": 1.0 - misses / max(self.num_frames, 1)}
+        if self.id_filter:
+            cache_d["id_filter"] = {"ids": self.id_filter.num_tested}
+        stats_d["caches"] = cache_d
+        if self.tp:
+            tp = self.tp
+            stats_d["tp"] = {"completed": tp.num_completed,
+                             "timed_out": tp.num_timed_out,
+                             "evicted": tp.num_evicted,
+                             "aborted": tp.num_aborted,
+                             "orphans": tp.num_orphans,
+                             "invalid": tp.num_invalid,
+                             "open": len(tp.session_d)}
+
+        stats_d["pgns"] = sortCounts(pgn_d)
+        stats_d["sas"] = sortCounts(sa_d)
+        stats_d["unknown_pgns"] = sortCounts(unknown_d)
+
+        return stats_d
+
+    def report(self, final=False):
+        stats_d = self.summary()
+        self.t_report = time.perf_counter()
+
+        line_l = ["Stats%s: %0.2f s, %0.0f frames/s" % (
+            "" if final else " (running)", stats_d["elapsed"],
+            stats_d["frames_per_sec"])]
+        if "lines" in stats_d:
+            line_l.append("  Lines: %d read, %d rejected, %d filtered" % (
+                stats_d["lines"], stats_d["rejected"],
+                stats_d["filtered"] + stats_d["skipped"]))
+        line_l.append("  Frames: %d read, %d decoded, %d unknown PGN, "
+                      "%d reserved" % (stats_d["frames"], stats_d["decoded"],
+                                       stats_d["unknown"],
+                                       stats_d["reserved"]))
+
+        total = sum(stats_d["stages"].values()) or 1.0
+        line_l.append("  Stages: " + ", ".join(
+            "%s %0.2f s (%0.0f%%)" % (stage, t, 100.0 * t / total)
+            for (stage, t) in stats_d["stages"].items()))
+
+        cache_d = stats_d["caches"]
+        if "id" in cache_d:
+            line_l.append("  ID cache: %d hits, %d misses (%0.1f%% hits)" % (
+                cache_d["id"]["hits"], cache_d["id"]["misses"],
+                100.0 * cache_d["id"]["ratio"]))
+        if "id_filter" in cache_d:
+            line_l.append("  ID filter: %d IDs tested" % (
+                cache_d["id_filter"]["ids"],))
+        if self.tp:
+            line_l.append("  " + self.tp.describe())
+
+        for (name, key) in [("PGNs", "pgns"), ("SAs", "sas"),
+                            ("Unknown PGNs", "unknown_pgns")]:
+            count_d = stats_d[key]
+            if not count_d:
+                continue
+            more = len(count_d) - TOP_N
+            line_l.append("  %s: %s%s" % (name, ", ".join(
+                "%s (%d)" % item for item in list(count_d.items())[:TOP_N]),
+                ", ... (%d more)" % more if more > 0 else ""))
+
+        print("\n".join(line_l), file=self.err or sys.stderr)
+
+        return stats_d
+
+    def writeJSON(self, json_file, stats_d=None):
+        if stats_d is None:
+            stats_d = self.summary()
+        with open(json_file, "w") as fo:
+            json.dump(stats_d, fo, indent=2)
+            fo.write("\n")
+
+
+def sortCounts(count_d):
+    # Most frequent first
+    return dict(sorted(count_d.items(), key=lambda item: -item[1]))
@@ -0,0 +1,193 @@
+#
+# Columnar decoded-signal store
+#
+# Every decoded SPN is kept as two append-only binary columns, a timestamp
+# column and a value column, both float64 .npy files:
+#   <root>/<pgn>/<sa>/<spn>.ts.npy
+#   <root>/<pgn>/<sa>/<spn>.val.npy
+# plus <root>/manifest.json listing every signal with its label, unit and
+# number of samples.
+#
+# The .npy header is written with room to spare, so appending only rewrites
+# the shape in place. Nothing but the standard library is needed to write the
+# store; readers memory-map a single signal with numpy.load(mmap_mode="r")
+# (see openSignal()) without parsing anything.
+#
+import os
+import sys
+import ast
+import json
+from array import array
+
+
+#
+# Definitions
+#
+MANIFEST_FILE = "manifest.json"
+STORE_VERSION = 1
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_HEADER_SIZE = 128
+FLUSH_SIZE = 65536
+
+
+#
+# Subroutines
+#
+def _npyHeader(count):
+    hdr = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d,), }" % count
+    hdr = hdr.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - 1) + "\n"
+
+    return NPY_MAGIC + len(hdr).to_bytes(2, "little") + hdr.encode("latin1")
+
+
+def _npyCount(fo):
+    # Number of elements recorded in the header of an existing column
+    fo.seek(0)
+    head = fo.read(NPY_HEADER_SIZE)
+    if len(head) < NPY_HEADER_SIZE or not head.startswith(NPY_MAGIC):
+        raise ValueError("Not a column file written by this store")
+
+    hlen = int.from_bytes(head[8:10], "little")
+    hdr_d = ast.literal_eval(head[10:10 + hlen].decode("latin1"))
+
+    return hdr_d["shape"][0]
+
+
+def columnCount(fname):
+    # Number of elements of a column file, 0 if there is none
+    if not os.path.exists(fname):
+        return 0
+
+    with open(fname, "rb") as fo:
+        return _npyCount(fo)
+
+
+def appendColumn(fname, values, count=None):
+    # Append float64 values to a column file, creating it if needed. Data past
+    # the count in the header (left by an interrupted append), or past count
+    # if that is given, is cut off first, so the header is the only source of
+    # truth.
+    if os.path.exists(fname):
+        fo = open(fname, "r+b")
+        if count is None:
+            count = _npyCount(fo)
+        fo.truncate(NPY_HEADER_SIZE + count * 8)
+    else:
+        fo = open(fname, "w+b")
+        count = 0
+        fo.write(_npyHeader(0))
+
+    with fo:
+        fo.seek(NPY_HEADER_SIZE + count * 8)
+        if values.itemsize == 8 and sys.byteorder == "little":
+            fo.write(values.tobytes())
+        else:
+            swapped = array("d", values)
+            swapped.byteswap()
+            fo.write(swapped.tobytes())
+
+        # Only now that the data is in place does the header grow
+        count += len(values)
+        fo.seek(0)
+        fo.write(_npyHeader(count))
+
+    return count
+
+
+class ColumnStore:
+    def __init__(self, root, flush_size=FLUSH_SIZE):
+        self.root = root
+        self.flush_size = flush_size
+        self.buf_d = {}
+        self.signal_d = {}
+
+        os.makedirs(root, exist_ok=True)
+
+        man_file = os.path.join(root, MANIFEST_FILE)
+        if os.path.exists(man_file):
+            with open(man_file) as fo:
+                man_d = json.load(fo)
+            for sig in man_d["signals"]:
+                self.signal_d[(sig["pgn"], sig["sa"], sig["spn"])] = sig
+
+    def signalPath(self, pgn, sa, spn):
+        return os.path.join(self.root, str(pgn), str(sa), str(spn))
+
+    def append(self, pgn, sa, desc, ts, val):
+        key = (pgn, sa, desc.spn)
+        buf = self.buf_d.get(key)
+        if buf is None:
+            buf = (array("d"), array("d"))
+            self.buf_d[key] = buf
+            if key not in self.signal_d:
+                self.signal_d[key] = {
+                    "pgn": pgn, "sa": sa, "spn": desc.spn,
+                    "label": desc.label, "unit": desc.unit, "count": 0}
+
+        buf[0].append(float("nan") if ts is None else ts)
+        buf[1].append(val)
+
+        if len(buf[0]) >= self.flush_size:
+            self.flushSignal(key)
+
+    def appendFrame(self, rec):
+        # rec is what decode.decodeValues() returns
+        (ts, pgn, dest_add, sa, val_l) = rec
+        for (desc, val) in val_l:
+            self.append(pgn, sa, desc, ts, val)
+
+    def flushSignal(self, key):
+        (ts_buf, val_buf) = self.buf_d[key]
+        if not ts_buf:
+            return
+
+        base = self.signalPath(*key)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+
+        # A flush interrupted between the two columns leaves the timestamps
+        # one append ahead; both are cut back to the samples they have in
+        # common so that the new ones are appended as pairs
+        ts_file = base + ".ts.npy"
+        val_file = base + ".val.npy"
+        count = min(columnCount(ts_file), columnCount(val_file))
+        appendColumn(ts_file, ts_buf, count)
+        count = appendColumn(val_file, val_buf, count)
+
+        self.signal_d[key]["count"] = count
+        self.buf_d[key] = (array("d"), array("d"))
+
+    def close(self):
+        for key in list(self.buf_d):
+            self.flushSignal(key)
+
+        # The manifest is replaced atomically
+        man_d = {
+            "version": STORE_VERSION,
+            "layout": "<pgn>/<sa>/<spn>.ts.npy, <pgn>/<sa>/<spn>.val.npy",
+            "signals": [self.signal_d[k] for k in sorted(self.signal_d)]}
+        man_file = os.path.join(self.root, MANIFEST_FILE)
+        with open(man_file + ".tmp", "w") as fo:
+            json.dump(man_d, fo, indent=1)
+        os.replace(man_file + ".tmp", man_file)
+
+        return len(self.signal_d)
+
+
+def listSignals(root):
+    with open(os.path.join(root, MANIFEST_FILE)) as fo:
+        return json.load(fo)["signals"]
+
+
+def openSignal(root, pgn, sa, spn):
+    # Returns (timestamps, values) as read-only memory-mapped NumPy arrays
+    import numpy as np
+
+    base = os.path.join(root, str(pgn), str(sa), str(spn))
+    ts = np.load(base + ".ts.npy", mmap_mode="r")
+    val = np.load(base + ".val.npy", mmap_mode="r")
+
+    # A column may be one append ahead of the other after an interruption
+    n = min(len(ts), len(val))
+
+    return (ts[:n], val[:n])
@@ -0,0 +1,465 @@
+#
+# Synthetic Digital Annex and CAN traffic
+#
+# The SAE Digital Annex cannot be shipped, so load tests run against a
+# synthetic one. SynthDA builds a made-up but well-formed set of PGNs, SPNs
+# and source addresses from a seed and writes it in the layouts the ingest
+# scripts read: the "SPs & PGs" TSV export (NUM_FLDS columns, records
+# starting with four tabs and the PGN, quoted multi-line descriptions, "N/A"
+# trailer) and the source address sheet.
+#
+# TrafficGen then produces candump/ASC/TRC logs for that DA: every PGN is
+# sent by one or more source addresses at its transmission rate (with
+# jitter), SPN values do random walks within their valid range with the
+# odd "not available", and PGNs longer than 8 bytes go out as TP.CM BAM +
+# TP.DT sessions. Frames are generated one at a time in timestamp order, so
+# logs of any length are written in constant memory.
+#
+# Everything is a function of the seed and the options: the same command
+# gives the same DA and the same log, byte for byte.
+#
+import heapq
+import random
+from datetime import datetime
+
+from j1939dec.ingest import NUM_FLDS, NUM_SA_FLDS, PGN_FLD_MAP, SPN_FLD_MAP
+from j1939dec.reader import TRC_EPOCH_DAYS
+
+
+#
+# Definitions
+#
+DEFAULT_SEED = 1
+DEFAULT_START = 1715275504.0
+
+# SPN layouts and the field lengths (bits) they draw from:
+#   bits   status and switch fields within one byte
+#   bytes  byte aligned 1, 2 and 4 byte values
+#   span   unaligned fields that cross byte boundaries
+LAYOUT_D = {
+    "bits": [1, 2, 2, 2, 3, 4],
+    "bytes": [8, 8, 16, 16, 32],
+    "span": [10, 12, 12, 14, 20, 24]}
+DEFAULT_MIX = {"bits": 3, "bytes": 5, "span": 1}
+
+RATE_MS_L = [10, 20, 50, 100, 100, 100, 250, 500, 1000, 1000, 1000, 5000]
+TP_RATE_MS_L = [1000, 5000]
+
+# (scale factor, offset, unit)
+SCALING_L = [
+    (1, 0, ""), (0.125, 0, "rpm"), (1, -125, "%"), (0.4, 0, "%"),
+    (0.03125, -273, "deg C"), (1, -40, "deg C"), (2, 0, "kPa"),
+    (0.00390625, 0, "km/h"), (0.05, 0, "V"), (0.05, 0, "L/h"),
+    (0.1, 0, "km"), (1, 0, "count")]
+
+PF_TP_CM = 0xEC
+PF_TP_DT = 0xEB
+CM_BAM = 32
+
+# BAM packets are sent 50 ms apart (J1939-21 allows 50 to 200 ms)
+BAM_GAP = 0.05
+
+# Values that change per frame, and how often a value is "not available"
+STATIC_FRACTION = 0.3
+NA_PROB = 0.001
+
+# Lines per write
+WRITE_LINES = 4096
+
+
+#
+# Subroutines
+#
+def parseMix(val):
+    # "bits=3,bytes=5,span=1" -> {layout: weight}
+    mix_d = {}
+    for item in val.split(","):
+        (name, sep, weight) = item.partition("=")
+        name = name.strip()
+        if name not in LAYOUT_D:
+            raise ValueError("Unknown SPN layout [" + name + "]")
+        mix_d[name] = float(weight) if sep else 1.0
+
+    if sum(mix_d.values()) <= 0:
+        raise ValueError("SPN layout weights must add up to more than 0")
+
+    return mix_d
+
+
+def validMax(bit_len):
+    # Largest raw value that is neither "error" nor "not available"; same
+    # ranges as plan.compileSPN()
+    if bit_len == 1:
+        return 1
+    if bit_len <= 8:
+        return (1 << bit_len) - 3
+
+    return (0xFE << (bit_len - 8)) - 1
+
+
+def naValue(bit_len):
+    return (1 << bit_len) - 1
+
+
+def bitLenText(bit_len):
+    if bit_len % 8 == 0:
+        n = bit_len // 8
+        return str(n) + (" byte" if n == 1 else " bytes")
+
+    return str(bit_len) + " bits"
+
+
+class SynthSPN:
+    __slots__ = ("spn", "label", "pos", "bit_len", "scale_factor", "offset",
+                 "unit", "vmax", "step", "static")
+
+    def __init__(self, spn, label, pos, bit_len, scaling, static):
+        self.spn = spn
+        self.label = label
+        self.pos = pos
+        self.bit_len = bit_len
+        (self.scale_factor, self.offset, self.unit) = scaling
+        self.vmax = validMax(bit_len)
+        self.step = max(1, self.vmax // 64)
+        self.static = static
+
+    def startBit(self):
+        return "%d.%d" % (self.pos // 8 + 1, self.pos % 8 + 1)
+
+
+class SynthPGN:
+    __slots__ = ("pgn", "label", "acronym", "size", "rate", "spn_l")
+
+    def __init__(self, pgn, label, acronym, size, rate, spn_l):
+        self.pgn = pgn
+        self.label = label
+        self.acronym = acronym
+        self.size = size
+        self.rate = rate
+        self.spn_l = spn_l
+
+
+class SynthDA:
+    def __init__(self, seed=DEFAULT_SEED, num_pgns=500, max_spns=8,
+                 mix_d=None, multi=0.05, num_sas=8):
+        self.seed = seed
+        rnd = random.Random("da:%s" % seed)
+        mix_d = mix_d or DEFAULT_MIX
+        layout_l = list(mix_d)
+        weight_l = [mix_d[k] for k in layout_l]
+
+        # PDU2 PGNs (PF 240-255) first, then PDU1 (PF < 240, DA in the ID)
+        # without the TP, request and address claim PGNs
+        pdu2_l = list(range(0xF000, 0x10000))
+        pdu1_l = [pf << 8 for pf in range(0x01, 0xEA)]
+        rnd.shuffle(pdu2_l)
+        rnd.shuffle(pdu1_l)
+        if num_pgns > len(pdu2_l) + len(pdu1_l):
+            raise ValueError("At most " + str(len(pdu2_l) + len(pdu1_l))
+                             + " PGNs")
+
+        self.pgn_l = []
+        spn = 1
+        for n in range(num_pgns):
+            if n % 8 == 7 and pdu1_l:
+                pgn = pdu1_l.pop()
+            else:
+                pgn = pdu2_l.pop() if pdu2_l else pdu1_l.pop()
+
+            # Multi-packet PGNs are PDU2 so that they can be broadcast (BAM)
+            size = 8
+            if pgn >= 0xF000 and rnd.random() < multi:
+                size = rnd.randrange(9, 64)
+
+            spn_l = []
+            pos = 0
+            num_spns = rnd.randint(1, max_spns) if size == 8\
+                else rnd.randint(max_spns, 3 * max_spns)
+            while len(spn_l) < num_spns:
+                layout = rnd.choices(layout_l, weight_l)[0]
+                bit_len = rnd.choice(LAYOUT_D[layout])
+                if layout == "bytes" and pos % 8:
+                    pos += 8 - pos % 8
+                elif layout == "bits" and pos % 8 + bit_len > 8:
+                    pos += 8 - pos % 8
+                if pos + bit_len > size * 8:
+                    break
+
+                spn_l.append(SynthSPN(spn, "Synthetic SP %d" % spn, pos,
+                                      bit_len, rnd.choice(SCALING_L),
+                                      rnd.random() < STATIC_FRACTION))
+                spn += 1
+                pos += bit_len
+                # The odd reserved gap
+                if rnd.random() < 0.1:
+                    pos += rnd.choice([1, 2, 4, 8])
+
+            rate = rnd.choice(TP_RATE_MS_L if size > 8 else RATE_MS_L)
+            self.pgn_l.append(SynthPGN(pgn, "Synthetic PG %d" % (n + 1),
+                                       "SPG%d" % (n + 1), size, rate, spn_l))
+
+        # Source addresses, and the ones that send each PGN
+        self.sa_d = {}
+        for sa in sorted(rnd.sample(range(0, 0xFD), min(num_sas, 0xFD))):
+            self.sa_d[sa] = "Synthetic ECU %d" % sa
+        sa_l = list(self.sa_d)
+        self.sender_l = []
+        for pgn in self.pgn_l:
+            num = min(len(sa_l), rnd.choice([1, 1, 2, 3]))
+            for sa in rnd.sample(sa_l, num):
+                self.sender_l.append((pgn, sa))
+
+        self.num_spns = spn - 1
+
+    def sheetRows(self):
+        # The header and record rows of the "SPs & PGs" sheet, as lists of
+        # cell text (descriptions run over several lines, with tabs)
+        hdr_l = ["Revised", "PG Revised", "SP Revised",
+                 "SP to PG Map Revised"] + [""] * (NUM_FLDS - 4)
+        for (name, n) in PGN_FLD_MAP.items():
+            hdr_l[n] = name
+        for (name, n) in SPN_FLD_MAP.items():
+            hdr_l[n] = name
+        yield hdr_l
+
+        for pgn in self.pgn_l:
+            for i in pgn.spn_l:
+                flds_l = [""] * NUM_FLDS
+                flds_l[PGN_FLD_MAP["pgn"]] = str(pgn.pgn)
+                flds_l[PGN_FLD_MAP["label"]] = pgn.label
+                flds_l[PGN_FLD_MAP["acronym"]] = pgn.acronym
+                flds_l[PGN_FLD_MAP["description"]] = pgn.label + " ("\
+                    + str(pgn.size) + " bytes).\nSent every "\
+                    + str(pgn.rate) + " ms.\tSynthetic."
+                flds_l[SPN_FLD_MAP["transmission_rate"]] = str(pgn.rate)\
+                    + " ms"
+                flds_l[SPN_FLD_MAP["sp_start_bit"]] = i.startBit()
+                flds_l[SPN_FLD_MAP["spn"]] = str(i.spn)
+                flds_l[SPN_FLD_MAP["label"]] = i.label
+                flds_l[SPN_FLD_MAP["description"]] = i.label + ".\n"\
+                    + "Range 0 to " + str(i.vmax) + "\tSynthetic."
+                flds_l[SPN_FLD_MAP["bit_len"]] = bitLenText(i.bit_len)
+                flds_l[SPN_FLD_MAP["unit"]] = i.unit
+                flds_l[SPN_FLD_MAP["scale_factor"]] = str(i.scale_factor)
+                flds_l[SPN_FLD_MAP["offset"]] = str(i.offset)
+                yield flds_l
+
+    def writeTSV(self, fo):
+        # The "SPs & PGs" sheet as exported to TSV: multi-line cells are
+        # quoted, and the records are followed by the "N/A" trailer
+        fo.write("J1939 Digital Annex (synthetic, seed %s)\n\n" % self.seed)
+
+        num_rows = -1
+        for flds_l in self.sheetRows():
+            fo.write("\t".join(['"' + fld + '"' if "\n" in fld else fld
+                                 for fld in flds_l]) + "\n")
+            num_rows += 1
+
+        fo.write("\t\t\t\tN/A\n")
+
+        return num_rows
+
+    def writeSATSV(self, fo):
+        # A source address sheet as exported to TSV
+        fo.write("\t".join(["Revised", "Function ID", "Function Description",
+                            "", ""][:NUM_SA_FLDS]) + "\n")
+        for (sa, label) in self.sa_d.items():
+            fo.write("\t" + str(sa) + "\t" + label + "\t\t\n")
+
+        return len(self.sa_d)
+
+
+class TrafficGen:
+    def __init__(self, da, seed=DEFAULT_SEED, start=DEFAULT_START,
+                 rate_scale=1.0):
+        self.da = da
+        self.rnd = random.Random("traffic:%s" % seed)
+        self.start = start
+        self.rate_scale = rate_scale
+
+        self.num_frames = 0
+        self.num_tp_sessions = 0
+
+    def payload(self, pgn, val_l):
+        # Random walk of every SPN value; unused bits are 1s
+        rnd = self.rnd
+        pint = (1 << (pgn.size * 8)) - 1
+        for (n, i) in enumerate(pgn.spn_l):
+            val = val_l[n]
+            if not i.static:
+                val += rnd.randint(-i.step, i.step)
+                val = min(max(val, 0), i.vmax)
+                val_l[n] = val
+            if rnd.random() < NA_PROB:
+                val = naValue(i.bit_len)
+            mask = (1 << i.bit_len) - 1
+            pint = (pint & ~(mask << i.pos)) | (val << i.pos)
+
+        return pint.to_bytes(pgn.size, "little")
+
+    def frames(self, num_frames=None, duration=None):
+        # Generator of (timestamp, can_id, data) in timestamp order, until
+        # num_frames frames or duration seconds, whichever comes first
+        rnd = self.rnd
+        end = self.start + duration if duration else None
+
+        # Events: (time, sequence number, transmitter, TP packet or None)
+        event_l = []
+        tx_l = []
+        seq = 0
+        for (pgn, sa) in self.da.sender_l:
+            val_l = [rnd.randint(0, i.vmax) for i in pgn.spn_l]
+            period = pgn.rate / 1000.0 * self.rate_scale
+            if pgn.pgn < 0xF000:
+                da = rnd.choice([0xFF] + list(self.da.sa_d))
+                can_id = (pgn.pgn | da) << 8
+            else:
+                can_id = pgn.pgn << 8
+            prio = 3 if pgn.rate <= 20 else 6
+            can_id |= (prio << 26) | sa
+            tx_l.append((pgn, sa, can_id, period, val_l))
+            event_l.append((self.start + rnd.random() * period, seq,
+                            len(tx_l) - 1, None))
+            seq += 1
+        heapq.heapify(event_l)
+
+        n = 0
+        while event_l and (num_frames is None or n < num_frames):
+            (ts, _, tx, pkt) = heapq.heappop(event_l)
+            if end is not None and ts >= end:
+                break
+            (pgn, sa, can_id, period, val_l) = tx_l[tx]
+
+            if pkt is not None:
+                # TP.DT packet of a BAM session
+                (data, num) = pkt
+                seq_no = num + 1
+                chunk = data[num * 7:num * 7 + 7].ljust(7, b"\xff")
+                yield (ts, (7 << 26) | (PF_TP_DT << 16) | 0xFF00 | sa,
+                       bytes([seq_no]) + chunk)
+                if seq_no * 7 < len(data):
+                    heapq.heappush(event_l, (ts + BAM_GAP, seq, tx,
+                                             (data, num + 1)))
+                    seq += 1
+                n += 1
+                continue
+
+            # Next transmission, with up to 2 % jitter
+            heapq.heappush(event_l, (ts + period * (1.0 + (rnd.random()
+                                     - 0.5) * 0.04), seq, tx, None))
+            seq += 1
+
+            data = self.payload(pgn, val_l)
+            if pgn.size <= 8:
+                yield (ts, can_id, data)
+            else:
+                num_pkts = (len(data) + 6) // 7
+                yield (ts, (7 << 26) | (PF_TP_CM << 16) | 0xFF00 | sa, bytes([
+                    CM_BAM, len(data) & 0xFF, len(data) >> 8, num_pkts, 0xFF,
+                    pgn.pgn & 0xFF, (pgn.pgn >> 8) & 0xFF, pgn.pgn >> 16]))
+                heapq.heappush(event_l, (ts + BAM_GAP, seq, tx, (data, 0)))
+                seq += 1
+                self.num_tp_sessions += 1
+            n += 1
+
+        self.num_frames = n
+
+
+class LogWriter:
+    # One line per frame in any of the formats FrameReader reads
+    def __init__(self, fo, fmt, start=DEFAULT_START, channel="can0"):
+        self.fo = fo
+        self.fmt = fmt
+        self.start = start
+        self.channel = channel
+        self.prev_ts = start
+        self.num = 0
+
+        self.fmt_d = {
+            "candump": self.fmtCandump,
+            "candump-L": self.fmtCandumpL,
+            "candump-t": self.fmtCandumpT,
+            "candump-td": self.fmtCandumpTD,
+            "candump-tA": self.fmtCandumpTA,
+            "asc": self.fmtASC,
+            "trc1": self.fmtTRC1,
+            "trc2": self.fmtTRC2}
+        if fmt not in self.fmt_d:
+            raise ValueError("Unsupported log format [" + fmt + "]")
+        self.fmtLine = self.fmt_d[fmt]
+
+    def header(self):
+        when = datetime.fromtimestamp(self.start)
+        if self.fmt == "asc":
+            stamp = when.strftime("%a %b %d %I:%M:%S.000 ")\
+                + when.strftime("%p").lower() + when.strftime(" %Y")
+            self.fo.write("date " + stamp + "\nbase hex  timestamps absolute"
+                          "\ninternal events logged\nBegin Triggerblock "
+                          + stamp + "\n   0.000000 Start of measurement\n")
+        elif self.fmt in ["trc1", "trc2"]:
+            days = self.start / 86400.0 + TRC_EPOCH_DAYS
+            ver = "1.1" if self.fmt == "trc1" else "2.1"
+            self.fo.write(";$FILEVERSION=" + ver + "\n;$STARTTIME=%0.10f\n"
+                          % days)
+            if self.fmt == "trc2":
+                self.fo.write(";$COLUMNS=N,O,T,B,I,d,R,L,D\n")
+
+    def footer(self):
+        if self.fmt == "asc":
+            self.fo.write("End TriggerBlock\n")
+
+    @staticmethod
+    def hexBytes(data):
+        return " ".join("%02X" % b for b in data)
+
+    def fmtCandump(self, ts, can_id, data):
+        return "  %s  %08X   [%d]  %s" % (self.channel, can_id, len(data),
+                                          self.hexBytes(data))
+
+    def fmtCandumpL(self, ts, can_id, data):
+        return "(%0.6f) %s %08X#%s" % (ts, self.channel, can_id,
+                                       data.hex().upper())
+
+    def fmtCandumpT(self, ts, can_id, data):
+        return "(%0.6f)  %s" % (ts, self.fmtCandump(ts, can_id, data))
+
+    def fmtCandumpTD(self, ts, can_id, data):
+        delta = ts - self.prev_ts
+        self.prev_ts = ts
+        return "(%010.6f)  %s" % (delta, self.fmtCandump(ts, can_id, data))
+
+    def fmtCandumpTA(self, ts, can_id, data):
+        when = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")
+        return "(%s)  %s" % (when, self.fmtCandump(ts, can_id, data))
+
+    def fmtASC(self, ts, can_id, data):
+        return "   %0.6f 1  %Xx       Rx   d %d %s" % (
+            ts - self.start, can_id, len(data), self.hexBytes(data))
+
+    def fmtTRC1(self, ts, can_id, data):
+        return "%6d) %11.1f  Rx     %08X  %d  %s" % (
+            self.num, (ts - self.start) * 1000.0, can_id, len(data),
+            self.hexBytes(data))
+
+    def fmtTRC2(self, ts, can_id, data):
+        return "%7d %13.3f DT 1      %08X Rx - %d    %s" % (
+            self.num, (ts - self.start) * 1000.0, can_id, len(data),
+            self.hexBytes(data))
+
+    def write(self, frames):
+        # Returns the number of frames written
+        fo = self.fo
+        fmtLine = self.fmtLine
+        line_l = []
+        self.header()
+        for (ts, can_id, data) in frames:
+            self.num += 1
+            line_l.append(fmtLine(ts, can_id, data))
+            if len(line_l) >= WRITE_LINES:
+                fo.write("\n".join(line_l) + "\n")
+                line_l = []
+        if line_l:
+            fo.write("\n".join(line_l) + "\n")
+        self.footer()
+
+        return self.num
@@ -0,0 +1,201 @@
+#
+# J1939 transport protocol (TP.CM / TP.DT) reassembly
+#
+# Multi-packet messages (DM1 with several DTCs, software ID, VIN, ...) are
+# announced with a TP.CM BAM or RTS frame and sent as a sequence of TP.DT
+# frames with 7 payload bytes each. The reassembler sits between the reader
+# and the decoder: it swallows TP.CM/TP.DT frames and emits one
+# (timestamp, can_id, data) frame per completed message, with the CAN ID
+# rebuilt from the announced PGN so that the decoder sees a regular frame.
+#
+# Sessions are keyed by (SA, DA) and kept in an OrderedDict in order of last
+# activity. The table is bounded: timed out sessions are dropped from the
+# front, and when the table is full the least recently active session is
+# evicted. Each session owns one preallocated buffer that packets are copied
+# into at their final offset, so reassembly never re-copies a payload.
+#
+from collections import OrderedDict
+
+
+#
+# Definitions
+#
+PF_TP_CM = 0xEC
+PF_TP_DT = 0xEB
+
+CM_RTS = 16
+CM_CTS = 17
+CM_EOM_ACK = 19
+CM_BAM = 32
+CM_ABORT = 255
+
+# J1939-21 timeouts (seconds): T1 between BAM/DT packets, T2 after a CTS
+TIMEOUT_BAM = 0.75
+TIMEOUT_RTS = 1.25
+
+MAX_SESSIONS = 4096
+MAX_SIZE = 1785
+
+
+#
+# Subroutines
+#
+class TPSession:
+    __slots__ = ("can_id", "size", "num_pkts", "buf", "seen", "num_seen",
+                 "last_ts", "timeout")
+
+    def __init__(self, can_id, size, num_pkts, ts, timeout):
+        self.can_id = can_id
+        self.size = size
+        self.num_pkts = num_pkts
+        self.buf = bytearray(num_pkts * 7)
+        self.seen = bytearray(num_pkts)
+        self.num_seen = 0
+        self.last_ts = ts
+        self.timeout = timeout
+
+
+class TPReassembler:
+    def __init__(self, max_sessions=MAX_SESSIONS, pass_tp=False):
+        self.max_sessions = max_sessions
+        self.pass_tp = pass_tp
+        self.session_d = OrderedDict()
+
+        self.num_completed = 0
+        self.num_timed_out = 0
+        self.num_evicted = 0
+        self.num_aborted = 0
+        self.num_orphans = 0
+        self.num_invalid = 0
+
+    def expire(self, ts):
+        # Sessions are ordered by last activity, so expired ones are at the
+        # front
+        session_d = self.session_d
+        while session_d:
+            sess = next(iter(session_d.values()))
+            if ts - sess.last_ts <= sess.timeout:
+                break
+            session_d.popitem(last=False)
+            self.num_timed_out += 1
+
+    def openSession(self, key, frame, data):
+        ts = frame[0]
+        can_id = frame[1]
+        size = data[1] | (data[2] << 8)
+        num_pkts = data[3]
+        pgn = data[5] | (data[6] << 8) | (data[7] << 16)
+
+        if size < 9 or size > MAX_SIZE or num_pkts != (size + 6) // 7:
+            self.num_invalid += 1
+            return None
+
+        # Rebuild the CAN ID of the announced message: priority and SA from
+        # the TP.CM frame, PGN from its payload and, for PDU1 PGNs, the
+        # destination address of the session
+        (sa, da) = key
+        if ((pgn >> 8) & 0xFF) < 240:
+            pgn = (pgn & 0x3FF00) | da
+        msg_id = (can_id & 0x1C000000) | (pgn << 8) | sa
+
+        if data[0] == CM_BAM:
+            timeout = TIMEOUT_BAM
+        else:
+            timeout = TIMEOUT_RTS
+
+        session_d = self.session_d
+        if key in session_d:
+            # A new announcement replaces an unfinished session
+            del session_d[key]
+            self.num_aborted += 1
+        elif len(session_d) >= self.max_sessions:
+            session_d.popitem(last=False)
+            self.num_evicted += 1
+
+        sess = TPSession(msg_id, size, num_pkts, ts, timeout)
+        session_d[key] = sess
+
+        return sess
+
+    def procCM(self, frame, key, data):
+        ctrl = data[0]
+        if ctrl == CM_BAM or ctrl == CM_RTS:
+            if len(data) < 8:
+                self.num_invalid += 1
+                return
+            self.openSession(key, frame, data)
+        elif ctrl == CM_ABORT:
+            # Either side may abort a connection
+            (sa, da) = key
+            for k in (key, (da, sa)):
+                if self.session_d.pop(k, None):
+                    self.num_aborted += 1
+        # CTS and EndOfMsgAck carry no payload for a passive listener
+
+    def procDT(self, frame, key, data):
+        sess = self.session_d.get(key)
+        if sess is None or len(data) < 2:
+            self.num_orphans += 1
+            return None
+
+        seq = data[0]
+        if seq < 1 or seq > sess.num_pkts:
+            self.num_invalid += 1
+            return None
+
+        ts = frame[0]
+        if ts is not None:
+            sess.last_ts = ts
+        self.session_d.move_to_end(key)
+
+        if sess.seen[seq - 1]:
+            # Retransmitted packet
+            return None
+
+        pos = (seq - 1) * 7
+        chunk = data[1:8]
+        sess.buf[pos:pos + len(chunk)] = chunk
+        sess.seen[seq - 1] = 1
+        sess.num_seen += 1
+
+        if sess.num_seen < sess.num_pkts:
+            return None
+
+        del self.session_d[key]
+        self.num_completed += 1
+
+        return (ts, sess.can_id, bytes(sess.buf[:sess.size]))
+
+    def process(self, frames):
+        # Generator: passes regular frames through and replaces TP.CM/TP.DT
+        # frames with the reassembled messages
+        for frame in frames:
+            can_id = frame[1]
+            pf = (can_id >> 16) & 0xFF
+            if (pf != PF_TP_CM and pf != PF_TP_DT) or (can_id >> 24) & 3:
+                yield frame
+                continue
+
+            if self.pass_tp:
+                yield frame
+
+            ts = frame[0]
+            if ts is not None and self.session_d:
+                self.expire(ts)
+
+            key = (can_id & 0xFF, (can_id >> 8) & 0xFF)
+            data = frame[2]
+            if pf == PF_TP_CM:
+                if data:
+                    self.procCM(frame, key, data)
+            else:
+                msg = self.procDT(frame, key, data)
+                if msg:
+                    yield msg
+
+    def describe(self):
+        return "TP reassembly: %d completed, %d timed out, %d evicted, "\
+               "%d aborted, %d orphan packets, %d invalid, %d open" % (
+                   self.num_completed, self.num_timed_out, self.num_evicted,
+                   self.num_aborted, self.num_orphans, self.num_invalid,
+                   len(self.session_d))
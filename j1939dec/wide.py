@@ -0,0 +1,118 @@
+#
+# Wide (pivoted) time-series output
+#
+# Instead of one CSV line per SPN value, the wide writer emits one line per
+# time bucket with one column per selected signal. A signal is an SPN, or an
+# SPN from one source address only ("<spn>@<sa>"). Within a bucket the last
+# value wins; with forward-fill, a column keeps its last value until a new one
+# arrives. Only the current row and the last values are kept, so memory use
+# depends on the number of columns and not on the length of the log.
+#
+import csv
+import sys
+
+
+#
+# Definitions
+#
+BUCKET_SIZE = 0.1
+
+
+#
+# Subroutines
+#
+def parseSignals(spec):
+    # "190,84@0,0x54@0x0" -> [(190, None), (84, 0), (84, 0)]
+    sig_l = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        (spn, _, sa) = item.partition("@")
+        sig_l.append((int(spn, 0), int(sa, 0) if sa else None))
+
+    return sig_l
+
+
+class WideWriter:
+    def __init__(self, plan, sig_l, out=None, bucket=BUCKET_SIZE, ffill=False):
+        if out is None:
+            out = sys.stdout
+
+        self.out = out
+        self.bucket = bucket
+        self.ffill = ffill
+        self.num_cols = len(sig_l)
+
+        # spn -> [(column, sa or None), ...]
+        self.col_d = {}
+        for (n, (spn, sa)) in enumerate(sig_l):
+            self.col_d.setdefault(spn, []).append((n, sa))
+
+        self.row = [None] * self.num_cols
+        self.cur = None
+        self.num_rows = 0
+        self.num_untimed = 0
+
+        # Column titles come from the plan where the SPN is known
+        label_d = {}
+        for (pgn, (label, acronym, spn_l)) in plan.iterPGNs():
+            for i in spn_l:
+                label_d.setdefault(i.spn, (i.label, i.unit))
+
+        hdr_l = ["Epoch Timestamp"]
+        for (spn, sa) in sig_l:
+            (label, unit) = label_d.get(spn, ("SPN", ""))
+            title = "%s (%d)" % (label, spn)
+            if sa is not None:
+                title += "@%d" % sa
+            if unit:
+                title += " [%s]" % unit
+            hdr_l.append(title)
+
+        csv.writer(out, lineterminator="\n").writerow(hdr_l)
+
+    def flush(self):
+        if self.cur is None:
+            return
+
+        line = "%0.6f" % (self.cur * self.bucket)
+        for val in self.row:
+            if val is None:
+                line += ","
+            else:
+                line += ",%0.2f" % val
+        print(line, file=self.out)
+        self.num_rows += 1
+
+        if not self.ffill:
+            self.row = [None] * self.num_cols
+
+    def add(self, rec):
+        # rec is what decode.decodeValues() returns
+        (ts, pgn, dest_add, sa, val_l) = rec
+        if ts is None:
+            self.num_untimed += 1
+            return
+
+        hit = False
+        col_d = self.col_d
+        for (desc, val) in val_l:
+            for (n, col_sa) in col_d.get(desc.spn, ()):
+                if col_sa is not None and col_sa != sa:
+                    continue
+                if not hit:
+                    hit = True
+                    cur = int(ts // self.bucket)
+                    # A frame that is a little out of order is folded into
+                    # the current row rather than reopening an emitted one
+                    if self.cur is None or cur > self.cur:
+                        self.flush()
+                        self.cur = cur
+                self.row[n] = val
+
+    def close(self):
+        self.flush()
+        self.cur = None
+
+        return self.num_rows
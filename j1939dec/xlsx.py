@@ -0,0 +1,173 @@
+#
+# Minimal streaming .xlsx reader
+#
+# An .xlsx workbook is a zip archive of XML parts. The workbook part names
+# the sheets, the shared string table holds the text of string cells, and
+# every worksheet is one XML part with a <row> element per non-empty row.
+# Worksheets are parsed with iterparse() and every row is dropped from the
+# tree once it has been handed out, so memory use depends on the size of a
+# row (and of the shared string table), not on the size of the sheet.
+#
+# Only the standard library is used; formatting, formulas and dates are not
+# interpreted. Cells come back as text, with numbers written the short way
+# ("61444", "0.125", "1.1").
+#
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+
+
+#
+# Definitions
+#
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+WORKBOOK_PART = "xl/workbook.xml"
+WORKBOOK_RELS_PART = "xl/_rels/workbook.xml.rels"
+STRINGS_PART = "xl/sharedStrings.xml"
+
+
+#
+# Subroutines
+#
+def _colIndex(ref):
+    # "E12" -> 4
+    n = 0
+    for c in ref:
+        if c.isdigit():
+            break
+        n = n * 26 + (ord(c.upper()) - 64)
+
+    return n - 1
+
+
+def _numText(val):
+    try:
+        f = float(val)
+    except ValueError:
+        return val
+
+    if f.is_integer() and abs(f) < 1e15:
+        return str(int(f))
+
+    return repr(f)
+
+
+def _stringText(elem):
+    # Text of an <si> or <is> element: plain <t>, or the <t> of every rich
+    # text run <r>; phonetic runs (<rPh>) are left out
+    t = elem.find(NS_MAIN + "t")
+    if t is not None:
+        return t.text or ""
+
+    return "".join(r.findtext(NS_MAIN + "t") or ""
+                   for r in elem.iter(NS_MAIN + "r"))
+
+
+class XLSXReader:
+    def __init__(self, fname):
+        self.fname = fname
+        self.zf = zipfile.ZipFile(fname)
+        self.strings_l = None
+
+        # Sheet name -> worksheet part, in workbook order
+        rel_d = {}
+        with self.zf.open(WORKBOOK_RELS_PART) as fo:
+            for rel in ET.parse(fo).getroot().iter(NS_PKG_REL + "Relationship"):
+                target = rel.get("Target")
+                if target.startswith("/"):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join("xl", target))
+                rel_d[rel.get("Id")] = target
+
+        self.sheet_d = {}
+        with self.zf.open(WORKBOOK_PART) as fo:
+            for sheet in ET.parse(fo).getroot().iter(NS_MAIN + "sheet"):
+                self.sheet_d[sheet.get("name")] = rel_d[sheet.get(NS_REL + "id")]
+
+    def sheetNames(self):
+        return list(self.sheet_d)
+
+    def findSheet(self, name):
+        # Exact name first, then a name that starts with it (the DA has been
+        # known to carry trailing blanks in sheet names)
+        if name in self.sheet_d:
+            return name
+        for sheet in self.sheet_d:
+            if sheet.strip().lower().startswith(name.lower()):
+                return sheet
+
+        return None
+
+    def loadStrings(self):
+        self.strings_l = []
+        if STRINGS_PART not in self.zf.namelist():
+            return
+
+        with self.zf.open(STRINGS_PART) as fo:
+            for (event, elem) in ET.iterparse(fo):
+                if elem.tag == NS_MAIN + "si":
+                    self.strings_l.append(_stringText(elem))
+                    elem.clear()
+
+    def cellText(self, c):
+        ctype = c.get("t", "n")
+        if ctype == "inlineStr":
+            elem = c.find(NS_MAIN + "is")
+            return "" if elem is None else _stringText(elem)
+
+        val = c.findtext(NS_MAIN + "v")
+        if val is None:
+            return ""
+        if ctype == "s":
+            return self.strings_l[int(val)]
+        if ctype == "n":
+            return _numText(val)
+        if ctype == "b":
+            return "TRUE" if val == "1" else "FALSE"
+
+        # "str" (formula result) and "e" (error) are already text
+        return val
+
+    def iterRows(self, name):
+        # Generator: (row number, [cell text, ...]) for every row that has
+        # cells; missing cells in between come back as ""
+        if self.strings_l is None:
+            self.loadStrings()
+
+        sheet_data = None
+        with self.zf.open(self.sheet_d[name]) as fo:
+            for (event, elem) in ET.iterparse(fo, ("start", "end")):
+                if event == "start":
+                    if elem.tag == NS_MAIN + "sheetData":
+                        sheet_data = elem
+                    continue
+                if elem.tag != NS_MAIN + "row":
+                    continue
+
+                cells_l = []
+                for c in elem.iter(NS_MAIN + "c"):
+                    ref = c.get("r")
+                    if ref:
+                        col = _colIndex(ref)
+                        if col > len(cells_l):
+                            cells_l.extend([""] * (col - len(cells_l)))
+                    cells_l.append(self.cellText(c))
+
+                while cells_l and cells_l[-1] == "":
+                    cells_l.pop()
+
+                row_num = int(elem.get("r", 0))
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    elem.clear()
+
+                if cells_l:
+                    yield (row_num, cells_l)
+
+    def close(self):
+        self.zf.close()
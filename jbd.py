@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import os
+import sys
+import getopt
+
+from j1939dec.bulk import MANIFEST_FILE, decodeTree
+from j1939dec.reader import FORMAT_L
+
+#
+# Globals
+#
+DB_FILE="j1939da-pgn-spn-oct22.db"
+VERSION="20241223.00"
+
+#
+# Subroutines
+#
+def usage():
+    print("""
+Usage (Version: """ + VERSION + """):
+  """ + os.path.basename(sys.argv[0]) + """ [-d <sqlite3 DB file>] [-f csv|jsonl] [-j <jobs>] \
+[--in-format=<format>] [--snapshot=<file>] <input directory> <output directory>
+
+Flags:
+  -d = Location of SQLite3 DB file (default: j1939da-pgn-spn-oct22.db in same 
+       directory as this script)
+  -f = Output format, csv or jsonl (JSON Lines) (default: same output as
+       jjd.py without -f)
+  -j = Number of worker processes (default: number of CPU cores)
+
+  --in-format = Input log format (default: detected per file)
+  --snapshot = Workers map this snapshot (made by j1939-db-snapshot.py)
+       instead of loading the DB, if it matches the DB
+
+Description:
+  Decodes every file below the input directory into processed_<file name>
+  under the same relative path in the output directory. The output directory
+  is created if needed.
+
+  Completed files are recorded in """ + MANIFEST_FILE + """ in the output
+  directory. Running the same command again after an interruption only
+  decodes the files that are new, changed or not finished yet. Files that
+  cannot be decoded (not a log, not readable) are reported and left out of
+  the manifest, so they are tried again; the exit status is then 1.
+
+Example usage:
+  """ + os.path.basename(sys.argv[0]) + """ raw_j1939_cancaptures processed_j1939_cancaptures
+  """ + os.path.basename(sys.argv[0]) + """ -f csv -j 4 raw_j1939_cancaptures processed_j1939_cancaptures
+  """)
+
+
+def showProgress(ent):
+    if "error" in ent:
+        print("ERROR - " + ent["file"] + ": " + ent["error"])
+        sys.stdout.flush()
+        return
+
+    print("Decoded: " + ent["file"] + " (" + str(ent["frames"]) + " frames, "\
+          + str(ent["seconds"]) + " s)")
+    sys.stdout.flush()
+
+
+#
+# Main
+#
+dbfile  = None
+oformat = None
+iformat = None
+jobs    = None
+snap_file = None
+
+try:
+    (opts, args) = getopt.getopt(sys.argv[1:], "d:f:j:",
+                                 ["in-format=", "snapshot="])
+except getopt.GetoptError as e:
+    print("ERROR - getopt() [" + str(e) + "]")
+    usage()
+    sys.exit(1)
+
+for (k,v) in opts:
+    if k == "-d":
+        dbfile = v
+    elif k == "-f":
+        oformat = v
+    elif k == "-j":
+        try:
+            jobs = int(v)
+        except ValueError:
+            print("ERROR - Number of jobs must be an integer [" + v + "]")
+            sys.exit(1)
+    elif k == "--in-format":
+        iformat = v
+    elif k == "--snapshot":
+        snap_file = v
+
+if len(args) != 2:
+    usage()
+    sys.exit(1)
+
+(in_dir, out_dir) = args
+
+if not dbfile:
+    dbfile = DB_FILE
+if not os.path.exists(dbfile) and not (snap_file\
+                                       and os.path.exists(snap_file)):
+    print("ERROR - " + dbfile + ": Not found!")
+    sys.exit(1)
+
+if not os.path.isdir(in_dir):
+    print("ERROR - " + in_dir + ": Input directory not found!")
+    sys.exit(2)
+
+if oformat and oformat not in ["csv", "jsonl"]:
+    print("ERROR - Only CSV and JSON Lines output formats supported at this time!")
+    sys.exit(1)
+
+if iformat and iformat not in FORMAT_L:
+    print("ERROR - Unsupported input format [" + iformat + "]!")
+    sys.exit(1)
+
+os.makedirs(out_dir, exist_ok=True)
+
+(num_done, num_skipped, num_failed) = decodeTree(in_dir, out_dir, dbfile,
+                                                 oformat, iformat, jobs,
+                                                 showProgress,
+                                                 snap_file=snap_file)
+print(str(num_done) + " files decoded, " + str(num_skipped)\
+      + " files already done, " + str(num_failed) + " files failed")
+
+# Exit gracefully; files that failed are tried again on the next run
+if num_failed:
+    sys.exit(1)
+sys.exit(0)
@@ -4,29 +4,48 @@ import sys
 import getopt
 import sqlite3
 
+from j1939dec.canid import LRUCache
+from j1939dec.decoder import Decoder
+
 #
 # Globals
 #
 DB_FILE="j1939da-pgn-spn-oct22.db"
 VERSION="20241204.00"
 
+HEX_DIGIT_S = set("0123456789abcdefABCDEF")
+
 #
 # Subroutines
 #
 def usage():
     print("""
 Usage (Version: """ + VERSION + """):
-  """ + os.path.basename(sys.argv[0]) + """ [-d <sqlite3 DB file>] [-i -|<file>] [CAN ID]
+  """ + os.path.basename(sys.argv[0]) + """ [-d <sqlite3 DB file>] [-i -|<file>] [--summary] [--cache-stats] [--plan-stats] [--snapshot=<file>]
+     [--profile=cprofile|tracemalloc] [--profile-out=<file>] [CAN ID]
 
 Flags:
   -d = Location of SQLite3 DB file (default: j1939da-pgn-spn-oct22.db in same 
        directory as this script)
   -i = Input file containing CAN IDs, or read from STDIN if argument is \"-\"
 
+  --summary = With -i, write one line per distinct CAN ID instead of one
+       block per input line: the ID, the number of lines it is on, its PGN,
+       addresses and SPNs, most frequent IDs first
+  --cache-stats = Report hits and misses of the decoded CAN ID cache on STDERR
+  --plan-stats = Report decode plan load time and memory footprint on STDERR
+  --profile = Profile the decode with cProfile (a pstats file and a JSON
+       summary) or tracemalloc (a JSON report of the allocations and the end
+       snapshot), tagged with the input size and the DB version
+  --profile-out = Output file (default: jcd.pstats or jcd.tracemalloc.json)
+  --snapshot = Use a snapshot made by j1939-db-snapshot.py instead of loading
+       the DB; a snapshot that does not match the DB is not used
+
 Example usage:
   """ + os.path.basename(sys.argv[0])\
   + """ 18FEF121
   """ + os.path.basename(sys.argv[0]) + """ -i can-ids.txt
+  """ + os.path.basename(sys.argv[0]) + """ --summary -i can-ids.txt
   echo 0CF00203 | """ + os.path.basename(sys.argv[0]) + """ -i -
 
 Description:
@@ -36,104 +55,90 @@ Description:
   """)
 
 
-def procLine(can_id, dbcon):
-    prg_nm = sys.argv[0]
-    dest_add = None
+def warnSnapshot(msg):
+    print("WARNING - " + msg, file=sys.stderr)
 
-    if len(can_id) != 8:
-        ## Check if can_id is 7 characters long. If CAN ID starts with 0, candump 
-        ## seems to drop the 0. Let's add it in that case.
-        if len(can_id) == 7:
-            can_id = "0" + can_id
-        else:
-            print("ERROR - Invalid CAN ID [" + can_id + "]")
-            return False
-
-    pri_r_dp = can_id[0:2]
-    ival = int(pri_r_dp, 16)
-    if (ival & 3) != 0:
-        msg = "ERROR - Bits 25 and 24 (little-endian) of 29-bit CAN frame "\
-            + "not '00' is currently unsupported!"
-        print(msg)
-        return False
-
-    # Check and see if PDU1 or PDU2 format
-    pgn_b1 = can_id[2:4]
-    ival = int(pgn_b1, 16)
-    if ival < 240:
-        pgn = pgn_b1 + "00"
-        dest_add = can_id[4:6]
-    else:
-        pgn = can_id[2:6]
-
-    sa = can_id[6:8]
-
-    # Convert pgn and sa from hex to decimal
-    pgn = int(pgn, 16)
-    sa = int(sa, 16)
-
-    if dest_add:
-        dest_add = int(dest_add, 16)
-
-    q = ""\
-      + "SELECT "\
-        + "label, "\
-        + "acronym, "\
-        + "(SELECT label FROM sa WHERE sa = ?), "\
-        + "(SELECT label FROM sa WHERE sa = ?) "\
-      + "FROM "\
-        + "pgn "\
-      + "WHERE "\
-        + "pgn = ?"
-
-    source = ""
-
-    # Get a DB cursor
-    dbcur = dbcon.cursor()
-
-    if dbcur.execute(q, (sa, dest_add, pgn)):
-        row = dbcur.fetchone()
-        if row:
-            label = row[0]
-            acronym = row[1]
-            source = row[2]
-            if row[3]:
-                dest = row[3]
-        else:
-            print("ERROR - PGN=" + str(pgn) + " and/or SA=" + str(sa) + " not in DB!")
-            dbcur.close()
-            return None
-
-    q = ""\
-      + "select "\
-        + "spn.label, "\
-        + "spn.spn "\
-      + "FROM "\
-        + "pgn pgn, "\
-        + "spn spn "\
-      + "WHERE "\
-        + "pgn.pgn = ? "\
-        + "and pgn.pgn_id = spn.pgn_id"
-
-    dbcur.execute(q, (pgn,))
-    for n,i in enumerate(dbcur):
-        if n == 0:
-    	    # Print header
-    	    print("CAN ID,PGN,Acronym,Dest Add,Source Add,SPN")
-
-        print("%s," % can_id.strip(), end="")
-        print("%s (%s)," % (label, pgn), end="")
-        print("%s," % acronym, end="")
-        if dest_add:
-            print("%s (%d)," % (dest, dest_add), end="")
-        else:
-            print("GLOBAL (255),", end="")
-        print("%s (%d)," % (source, sa), end="")
-        print("%s (%s)" % (i[0], i[1]))
 
-    dbcur.close()
+def parseID(can_id):
+    # The CAN ID of the hex text, or None if it is not 7 or 8 hex digits
+    if len(can_id) == 7:
+        ## If CAN ID starts with 0, candump seems to drop the 0
+        can_id = "0" + can_id
+    elif len(can_id) != 8:
+        return None
+
+    # Checked here rather than by int(), which would raise a ValueError and
+    # also takes a "0x" prefix, a sign, blanks and underscores
+    if not HEX_DIGIT_S.issuperset(can_id):
+        return None
+
+    return int(can_id, 16)
+
+
+def dispAdd(label, add):
+    if add:
+        return "%s (%d)" % (label, add)
+
+    return "GLOBAL (255)"
+
+
+def formatID(can_id, dec):
+    # The lines written for a CAN ID of the input
+    can_id_num = parseID(can_id)
+    if can_id_num is None:
+        return "ERROR - Invalid CAN ID [" + can_id + "]\n"
+    if len(can_id) == 7:
+        can_id = "0" + can_id
+
+    (info, err) = dec.idInfo(can_id_num)
+    if err:
+        return err + "\n"
+
+    if not info.spn_l:
+        return ""
 
-    return None
+    # Print header, then one line per SPN
+    line_l = ["CAN ID,PGN,Acronym,Dest Add,Source Add,SPN"]
+    prefix = "%s,%s (%s),%s,%s,%s (%d)," % (
+        can_id, info.label, info.pgn, info.acronym,
+        dispAdd(info.dest, info.dest_add), info.source, info.sa)
+    for (label, spn) in info.spn_l:
+        line_l.append(prefix + "%s (%s)" % (label, spn))
+
+    return "\n".join(line_l) + "\n"
+
+
+def summarizeIDs(ifo, dec):
+    # Count the lines of each distinct CAN ID in one pass over the input,
+    # then write one line per ID, most frequent first
+    text_d = {}
+    for line in ifo:
+        line = line.rstrip()
+        text_d[line] = text_d.get(line, 0) + 1
+
+    # Differently written (7 digit, lower case) IDs are the same ID
+    count_d = {}
+    for (can_id, n) in text_d.items():
+        can_id_num = parseID(can_id)
+        key = can_id if can_id_num is None else can_id_num
+        count_d[key] = count_d.get(key, 0) + n
+
+    print("CAN ID,Count,Priority,PGN,Acronym,Dest Add,Source Add,SPNs")
+    for (key, n) in sorted(count_d.items(), key=lambda item: -item[1]):
+        if isinstance(key, str):
+            print("%s,%d,ERROR - Invalid CAN ID" % (key, n))
+            continue
+
+        (info, err) = dec.idInfo(key)
+        if err:
+            print("%08X,%d,%s" % (key, n, err))
+            continue
+
+        print("%08X,%d,%d,%s (%s),%s,%s,%s (%d),%s" % (
+            key, n, info.priority, info.label, info.pgn, info.acronym,
+            dispAdd(info.dest, info.dest_add), info.source, info.sa,
+            "; ".join("%s (%s)" % (label, spn)
+                      for (label, spn) in info.spn_l)))
 
 
 #
@@ -142,13 +147,21 @@ def procLine(can_id, dbcon):
 infile  = None
 dbfile  = None
 ifo     = None
+plan_stats = False
+snap_file  = None
+summary    = False
+cache_stats = False
+profile    = None
+profile_out = None
 
 if len(sys.argv) == 1:
     usage()
     sys.exit(0)
 
 try:
-    (opts, args) = getopt.getopt(sys.argv[1:], "i:d:")
+    (opts, args) = getopt.getopt(sys.argv[1:], "i:d:",
+                                  ["cache-stats", "plan-stats", "profile=",
+                                   "profile-out=", "snapshot=", "summary"])
 except getopt.GetoptError as e:
     print("ERROR - getopt() [" + str(e) + "]")
     usage()
@@ -162,30 +175,89 @@ for (k,v) in opts:
             ifo = open(v)
     elif k == "-d":
         dbfile = v
+    elif k == "--plan-stats":
+        plan_stats = True
+    elif k == "--snapshot":
+        snap_file = v
+    elif k == "--summary":
+        summary = True
+    elif k == "--cache-stats":
+        cache_stats = True
+    elif k == "--profile":
+        profile = v
+    elif k == "--profile-out":
+        profile_out = v
 
 if not dbfile:
     dbfile = DB_FILE
-    if not os.path.exists(dbfile):
-        print("ERROR - " + dbfile + ": Not found!")
+
+if not os.path.exists(dbfile) and not (snap_file\
+                                       and os.path.exists(snap_file)):
+    print("ERROR - " + dbfile + ": Not found!")
+    sys.exit(1)
+
+if summary and not ifo:
+    print("ERROR - --summary requires an input file (-i)!")
+    sys.exit(1)
+
+if profile or profile_out:
+    from j1939dec.profiling import defaultFile
+
+    # The stage timers are for jjd.py's log decode
+    if profile not in ["cprofile", "tracemalloc"]:
+        print("ERROR - --profile must be cprofile or tracemalloc!")
         sys.exit(1)
 
 # Open DB file
+dec = None
 try:
-    dbcon = sqlite3.connect(dbfile)
-
-    if ifo:
-        for n,line in enumerate(ifo, 1):
-            line = line.rstrip()
-            procLine(line, dbcon)
-            print("\n")
+    # Load the pgn, spn and sa tables (or map their snapshot) once instead of
+    # querying per CAN ID
+    dec = Decoder(dbfile, snap_file, warnSnapshot)
+    if plan_stats:
+        print(dec.plan.describe(), file=sys.stderr)
+
+    prof = None
+    if profile:
+        # Profile the decode, not the loading of the decode tables
+        dec.plan
+        prof = dec.profiler(profile, profile_out\
+                            or defaultFile(sys.argv[0], profile), ifo,
+                            {"program": os.path.basename(sys.argv[0]),
+                             "version": VERSION})
+        prof.start()
+
+    # Every distinct CAN ID is decoded once; the lines made from it are
+    # reused for all its other lines
+    if summary:
+        cache = dec.id_cache
+        summarizeIDs(ifo, dec)
+    elif ifo:
+        cache = LRUCache(lambda can_id: formatID(can_id, dec))
+        write = sys.stdout.write
+        for line in ifo:
+            write(cache.get(line.rstrip()))
+            write("\n\n")
     else:
-        procLine(args[0], dbcon)
+        cache = None
+        sys.stdout.write(formatID(args[0], dec))
+
+    if prof:
+        sys.stdout.flush()
+        prof.stop()
+        prof.write()
+        print(prof.describe(), file=sys.stderr)
+
+    if cache_stats and cache:
+        print(cache.describe(), file=sys.stderr)
 
 except sqlite3.DatabaseError as e:
     print("ERROR - DB Exception [" + str(e) + "]")
+except ValueError as e:
+    print("ERROR - " + str(e))
 finally:
-    # Close db connection
-    dbcon.close()
+    if dec:
+        dec.close()
     rc = 0
 
 if ifo:
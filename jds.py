@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import os
+import sys
+import signal
+import getopt
+import sqlite3
+import threading
+
+from j1939dec.service import DecodeService, HTTPServer, UnixServer
+
+#
+# Globals
+#
+DB_FILE="j1939da-pgn-spn-oct22.db"
+VERSION="20250110.00"
+
+#
+# Subroutines
+#
+def usage():
+    print("""
+Usage (Version: """ + VERSION + """):
+  """ + os.path.basename(sys.argv[0]) + """ [-d <sqlite3 DB file>] [-j <jobs>] [--snapshot=<file>] \
+[--unix=<socket>] [--http=<port>]
+
+Flags:
+  -d = Location of SQLite3 DB file (default: j1939da-pgn-spn-oct22.db in same
+       directory as this script)
+  -j = Number of worker processes (default: number of CPU cores)
+
+  --snapshot = Map this snapshot (made by j1939-db-snapshot.py) instead of
+       loading the DB, if it matches the DB
+  --unix = Serve on this Unix domain socket
+  --http = Serve HTTP on this port of 127.0.0.1
+
+Description:
+  Runs until interrupted, decoding batches of CAN log lines or binary frames
+  sent by clients. At least one of --unix and --http is required.
+
+  Unix socket: send one line of JSON, e.g.
+    {"format": "csv", "length": 5120}
+  followed by that many bytes of log text. The reply is one line of JSON with
+  the status and the output length, followed by the output.
+  {"op": "stats"} returns the counters.
+
+  HTTP: POST /decode?format=csv with the log text as body. Binary frames are
+  sent with Content-Type application/x-j1939-frames. GET /stats returns the
+  request, frame and byte counters, throughput and latency percentiles.
+
+  SIGHUP reloads the DB (or snapshot); batches already being decoded finish
+  with the old tables.
+
+Example usage:
+  """ + os.path.basename(sys.argv[0]) + """ --unix=/tmp/jds.sock --http=8939 &
+  curl --data-binary @can.log 'http://127.0.0.1:8939/decode?format=csv'
+  kill -HUP %1
+  """)
+
+
+def log(msg):
+    print("WARNING - " + msg, file=sys.stderr)
+
+
+#
+# Main
+#
+dbfile    = None
+jobs      = None
+snap_file = None
+unix_path = None
+http_port = None
+
+try:
+    (opts, args) = getopt.getopt(sys.argv[1:], "d:j:",
+                                 ["snapshot=", "unix=", "http="])
+except getopt.GetoptError as e:
+    print("ERROR - getopt() [" + str(e) + "]")
+    usage()
+    sys.exit(1)
+
+for (k,v) in opts:
+    if k == "-d":
+        dbfile = v
+    elif k == "-j":
+        try:
+            jobs = int(v)
+        except ValueError:
+            print("ERROR - Number of jobs must be an integer [" + v + "]")
+            sys.exit(1)
+    elif k == "--snapshot":
+        snap_file = v
+    elif k == "--unix":
+        unix_path = v
+    elif k == "--http":
+        try:
+            http_port = int(v)
+        except ValueError:
+            print("ERROR - HTTP port must be an integer [" + v + "]")
+            sys.exit(1)
+
+if args or not (unix_path or http_port):
+    usage()
+    sys.exit(1)
+
+if not dbfile:
+    dbfile = DB_FILE
+if not os.path.exists(dbfile) and not (snap_file\
+                                       and os.path.exists(snap_file)):
+    print("ERROR - " + dbfile + ": Not found!")
+    sys.exit(1)
+
+try:
+    service = DecodeService(dbfile, snap_file, jobs, log)
+except (sqlite3.DatabaseError, ValueError) as e:
+    print("ERROR - " + str(e))
+    sys.exit(1)
+print(service.plan_desc, file=sys.stderr)
+
+server_l = []
+try:
+    if unix_path:
+        server_l.append(UnixServer(unix_path, service))
+        print("Serving on " + unix_path, file=sys.stderr)
+    if http_port:
+        server_l.append(HTTPServer(http_port, service))
+        print("Serving on http://127.0.0.1:" + str(http_port) + "/",
+              file=sys.stderr)
+except OSError as e:
+    print("ERROR - " + str(e))
+    for server in server_l:
+        server.server_close()
+    service.close()
+    sys.exit(1)
+
+for server in server_l:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+# Signals are handled in this thread only; the servers keep answering while
+# a reload loads the new tables
+reload_evt = threading.Event()
+stop_evt = threading.Event()
+signal.signal(signal.SIGHUP, lambda sig, frm: reload_evt.set())
+signal.signal(signal.SIGTERM, lambda sig, frm: stop_evt.set())
+signal.signal(signal.SIGINT, lambda sig, frm: stop_evt.set())
+
+while not stop_evt.is_set():
+    if reload_evt.wait(1.0):
+        reload_evt.clear()
+        try:
+            service.reload()
+            print("Reloaded: " + service.plan_desc, file=sys.stderr)
+        except (sqlite3.DatabaseError, ValueError, OSError) as e:
+            print("ERROR - Reload failed, keeping the loaded tables ["\
+                  + str(e) + "]", file=sys.stderr)
+
+for server in server_l:
+    server.shutdown()
+    server.server_close()
+service.close()
+
+# Exit gracefully
+sys.exit(0)
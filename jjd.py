@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 import os
-import re
 import sys
 import getopt
 import sqlite3
 
+from j1939dec.decoder import Decoder
+from j1939dec.snapshot import SnapshotPlan
+from j1939dec.decode import decodeValues, procFrame
+from j1939dec.reader import FORMAT_L, FrameReader, parseLine
+from j1939dec.parallel import decodeParallel
+from j1939dec.output import FLUSH_L, FLUSH_THROUGHPUT, formatHeader
+from j1939dec.tp import TPReassembler
+from j1939dec.idfilter import IDFilter, parseIntList, parseMasks, parseRanges,\
+     readerFilter
+
 #
 # Globals
 #
@@ -18,21 +27,138 @@ def usage():
     print("""
 Usage (Version: """ + VERSION + """):
   """ + os.path.basename(sys.argv[0]) + """ [-d <sqlite3 DB file>] [-i -|<file>] [-p <pgn>] \
-[-s <spn>] [-a <src add>] [-f csv] [CAN message]
+[-s <spn>] [-a <src add>] [-f csv|jsonl|wide|npz|npy] [-o <file>] [-j <jobs>] [--parallel] \
+[--parts] [--spns=<list>] [--bucket=<seconds>] [--ffill] \
+[--in-format=<format>] [--no-tp] [--plan-stats] [--snapshot=<file>] \
+[--live] [--tcp=[<host>:]<port>] [--udp=[<host>:]<port>] [--queue=<lines>] \
+[--drop-oldest] [--flush=throughput|latency] [--pgn=<list>] [--sa=<list>] \
+[--da=<list>] [--prio=<list>] [--id-mask=<id>/<mask>] [--id-range=<id>-<id>] \
+[--changes] [--deadband=<list>] [--heartbeat=<seconds>] \
+[--window=<seconds>] [--slide=<seconds>] [--percentiles=<list>] \
+[--stats] [--stats-json=<file>] [--stats-interval=<seconds>] \
+[--profile=cprofile|tracemalloc|stages] [--profile-out=<file>] [CAN message]
 
 Flags:
   -a = Source address (as integer or hexadecimal with leading 0x)
   -d = Location of SQLite3 DB file (default: j1939da-pgn-spn-oct22.db in same 
        directory as this script)
-  -f = Output format (currently, only CSV supported)
+  -f = Output format:
+       csv = one line per SPN value
+       jsonl = JSON Lines, one object per SPN value with the keys ts, pgn,
+             da, sa, spn, label, value and unit (always in that order)
+       wide = one CSV line per time bucket, one column per --spns signal
+       npz = NumPy batch decode; one float64 value array and one timestamp
+             array per PGN/SA/SPN, written to the -o file (requires NumPy)
+       npy = Columnar store in the -o directory: <pgn>/<sa>/<spn>.ts.npy and
+             <spn>.val.npy per signal plus manifest.json; appends to an
+             existing store and can be memory-mapped with numpy.load()
   -i = Input file containing raw CAN messages, or read from 
        STDIN if argument is \"-\"
+  -j = Number of worker processes for parallel decoding (implies --parallel)
+  -o = Output file (required with -f npz; output directory with -f npy;
+       default for other formats: STDOUT)
   -p = PGN number (as integer or hexadecimal with leading 0x)
   -s = SPN number
 
-Sample CAN messages (2 supported formats):
+  --spns = Comma separated signals for -f wide: <spn> (any source address) or
+       <spn>@<src add>, e.g. 190,84@0
+  --bucket = Time bucket size in seconds for -f wide (default: 0.1)
+  --ffill = With -f wide, hold the last value of a signal in the following
+       buckets instead of leaving them empty
+  --in-format = Input log format (default: detected from the first lines):
+       candump, candump-L, candump-t (-ta/-tz), candump-td, candump-tA, asc,
+       trc1 (PEAK TRC 1.x), trc2 (PEAK TRC 2.x)
+  --parallel = Decode the -i file in line-aligned chunks on all CPU cores;
+       output stays in input order (requires -f csv or -f jsonl and
+       -i <file>)
+  --parts = With --parallel, write ordered part files <-o file>.00000,
+       <-o file>.00001, ... (with -f csv, each with a CSV header) instead of
+       one file
+  --no-tp = Decode TP.CM/TP.DT frames as they are instead of reassembling
+       multi-packet (BAM and RTS/CTS) messages first
+  --plan-stats = Report decode plan load time and memory footprint on STDERR
+  --snapshot = Decode with a snapshot made by j1939-db-snapshot.py instead of
+       loading the DB; a snapshot that does not match the DB is not used
+  --live = Live decoding of -i - (STDIN): output is written as soon as the
+       input goes quiet, and in large writes while it keeps coming; reports
+       dropped lines and receive-to-output latency on STDERR at the end
+  --tcp = Live decoding of lines sent to this TCP port (default host:
+       127.0.0.1); runs until interrupted
+  --udp = Live decoding of lines sent as datagrams to this UDP port
+  --queue = Number of received lines held for the decoder in live mode
+       (default: 10000); when full, reading stops (or, for UDP, datagrams
+       are dropped)
+  --drop-oldest = In live mode, drop the oldest queued line instead of
+       waiting when the queue is full
+  --flush = When decoded output is written out (default: throughput):
+       throughput = in blocks of 1 MiB
+       latency = after every CAN message, e.g. for -i - from a pipe
+       With -f csv and -f jsonl, messages that cannot be decoded are
+       reported on STDERR, so the output only holds rows
+
+  Decode filters (-p and -a look up the DB; these select what is decoded).
+  Lists are comma separated integers, hexadecimal with leading 0x, or
+  ranges <low>-<high>; all given filters must match:
+  --pgn = PGNs to decode (PDU1 PGNs without the destination address)
+  --sa = Source addresses to decode
+  --da = Destination addresses to decode (255 also selects PDU2 PGNs)
+  --prio = Priorities (0-7) to decode
+  --id-mask = Decode CAN IDs for which (CAN ID & mask) == (id & mask), e.g.
+       0x00FEF100/0x00FFFF00; a comma separated list matches any of them
+  --id-range = Decode CAN IDs in this range, e.g. 0x18FEF100-0x18FEF1FF
+  The filters test the CAN ID of every line before its payload is parsed.
+  With --pgn and/or --sa, lines are first scanned for the wanted IDs, and
+  lines without them are skipped unparsed (except for ASC and candump -td
+  logs).
+
+  Change-only output (-f csv, jsonl or npy; not with --parallel):
+  --changes = Write an SPN value only when it differs from the last value
+       written for the same source address and SPN
+  --deadband = Comma separated <spn>:<deadband>, where the deadband is an
+       absolute value, a percentage of the last value written (e.g. 2%),
+       or both (e.g. 1+2%); "*" sets the deadband of all other SPNs. A
+       value is written when it differs by more than its deadband
+       (implies --changes)
+  --heartbeat = Also write a value when this many seconds have passed since
+       its signal was last written (implies --changes)
+
+  Windowed aggregation (-f csv or jsonl; not with --parallel or --changes):
+  --window = Write one line per source address, SPN and time window of this
+       many seconds (count, min, max, mean and percentiles) instead of
+       every value
+  --slide = Start a window every this many seconds (sliding windows); the
+       window must be a multiple of it. Default: the window (tumbling
+       windows)
+  --percentiles = Comma separated percentiles to write (default: 50,95,99),
+       within 1% of the exact values
+
+  Statistics (-i with the default, CSV or JSON Lines output; not with
+  --parallel or live decoding):
+  --stats = Report on STDERR, at the end and every --stats-interval seconds:
+       lines read and rejected, frames decoded, frames/sec, time spent
+       reading, parsing, in the ID lookup, SPN extraction, formatting and
+       writing, frame counts per PGN and SA, unknown PGNs (instead of one
+       error per frame) and ID cache hits
+  --stats-json = Write the final statistics to this JSON file
+  --stats-interval = Seconds between reports during the run (default: 10;
+       0 reports at the end only)
+
+  Profiling:
+  --profile = Profile the decode with cProfile (a pstats file and a JSON
+       summary), tracemalloc (a JSON report of the allocations and the end
+       snapshot) or per-stage timers (a JSON report of the time spent
+       reading, parsing, looking up IDs, extracting SPNs, formatting and
+       writing; -i with CSV or JSON Lines output, on one core). The files
+       are tagged with the input size and the DB version. With --parallel,
+       only the main process is profiled
+  --profile-out = Output file (default: jjd.pstats, jjd.tracemalloc.json or
+       jjd.stages.json)
+
+Sample CAN messages:
  can0  18FEF121   [8]  C7 FF FF C3 00 FF FF F0
  (1715275504.474510) can0 0CF00203#CC0000FFF00000FF
+ (1715275504.474510)  can0  18FEF121   [8]  C7 FF FF C3 00 FF FF F0
+ 0.474510 1  18FEF121x       Rx   d 8 C7 FF FF C3 00 FF FF F0
 
 Example usage:
   """ + os.path.basename(sys.argv[0])\
@@ -43,364 +169,112 @@ Example usage:
   """ + os.path.basename(sys.argv[0]) + """ -p 61443
   """ + os.path.basename(sys.argv[0]) + """ -p OxF003
   """ + os.path.basename(sys.argv[0]) + """ -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f npz -o can-msgs.npz -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f wide --spns=190,84,110@0 --bucket=0.5 --ffill -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f npy -o can-msgs.store -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f csv --parallel -o can-msgs.csv -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f csv -j 8 --parts -o can-msgs.csv -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f csv --pgn=61444 --sa=0 -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f csv --deadband=190:25,110:1,*:0.5% --heartbeat=60 -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f csv --window=60 --slide=10 --percentiles=50,99 -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f csv --stats --stats-json=stats.json -o can-msgs.csv -i can-msgs.txt
+  """ + os.path.basename(sys.argv[0]) + """ -f csv --profile=stages -o can-msgs.csv -i can-msgs.txt
   echo \"(1715275504.474510) can0 0CF00203#CC0000FFF00000FF\" | """\
   + os.path.basename(sys.argv[0]) + """ -i -
+  candump -L can0 | """ + os.path.basename(sys.argv[0]) + """ -f csv --live --drop-oldest -i -
+  """ + os.path.basename(sys.argv[0]) + """ -f csv --udp=9939
   """ + os.path.basename(sys.argv[0]) + """ -a 249
   """ + os.path.basename(sys.argv[0]) + """ -a 0xF9
   """)
 
 
-def procLine(line, dbcon, oformat):
-    can_id = None
-    can_data = None
-    dest_add = None
-    dest = None
-    prg_nm = sys.argv[0]
-    has_time = False
-
-    # Sample line:
-    #  can0  18FEF121   [8]  C7 FF FF C3 00 FF FF F0
-    # or
-    #  (1715275504.466376) can0 0C0B2A17#FDFFFFFFFFFFFFEA
-    #
-    # Guess the format
-    regx1 = re.compile("\s*can\d+\s+(\w+)\s+\[\d+\]\s+(.*)")
-    regx2 = re.compile("\((\d+\.\d+)\) can\d+ (\w+)#(\w+)")
-    mobj = re.match(regx1, line)
-    if (mobj):
-        can_id = mobj.group(1)
-        can_data = mobj.group(2)
-    else:
-        mobj = re.match(regx2, line)
-        if (mobj):
-            epoch_ts = mobj.group(1)
-            has_time = True
-            can_id = mobj.group(2)
-            can_data = mobj.group(3)
-            can_data = " ".join(can_data[i:i+2] for i in range(0, len(can_data), 2))
-
-    if can_id and can_data:
-        pass
-    else:
-        print("ERROR - Unsupported CAN message!")
-        return None
-
-    if len(can_id) != 8:
-        ## Check if can_id is 7 characters long. If CAN ID starts with 0, candump 
-        ## seems to drop the 0. Let's add it in that case.
-        if len(can_id) == 7:
-            can_id = "0" + can_id
-        else:
-            print("ERROR - Invalid CAN ID [" + line + "]")
-            return False
-
-    pri_r_dp = can_id[0:2]
-    ival = int(pri_r_dp, 16)
-    if (ival & 3) != 0:
-        msg = "ERROR - Bits 25 and 24 (little-endian) of 29-bit CAN frame "\
-            + "not '00' is currently unsupported!"
-        print(msg)
-        return False
-
-    if oformat:
-        print("Epoch Timestamp,PGN,Dest Add,Source Add,SPN,Value,Unit")
-
-    # Check and see if PDU1 or PDU2 format
-    pgn_b1 = can_id[2:4]
-    ival = int(pgn_b1, 16)
-    if ival < 240:
-        pgn = pgn_b1 + "00"
-        dest_add = can_id[4:6]
-    else:
-        pgn = can_id[2:6]
-
-    sa = can_id[6:8]
-    data_l = can_data.split()
-
-    # Convert pgn and sa from hex to decimal
-    pgn = int(pgn, 16)
-    sa = int(sa, 16)
-
-    if dest_add:
-        dest_add = int(dest_add, 16)
-
-    q = ""\
-      + "SELECT "\
-        + "label, "\
-        + "acronym, "\
-        + "(SELECT label FROM sa WHERE sa = ?), "\
-        + "(SELECT label FROM sa WHERE sa = ?) "\
-      + "FROM "\
-        + "pgn "\
-      + "WHERE "\
-        + "pgn = ?"
-
-    source = ""
-
-    # Get a DB cursor
-    dbcur = dbcon.cursor()
-
-    if dbcur.execute(q, (sa, dest_add, pgn)):
-        row = dbcur.fetchone()
-        if row:
-            label = row[0]
-            acronym = row[1]
-            source = row[2]
-            if row[3]:
-                dest = row[3]
-        else:
-            print("ERROR - PGN=" + str(pgn) + " and/or SA=" + str(sa) + " not in DB!")
-            dbcur.close()
-            return None
+def warnSnapshot(msg):
+    print("WARNING - " + msg, file=sys.stderr)
 
-    if oformat:
-        if not dest_add:
-            dest_add = 255
 
-        pgn_part = epoch_ts + "," + str(pgn) + "," + str(dest_add) + ","\
-                 + str(sa)
+def readFrames(ifo, args, iformat, tp, id_filter):
+    # The frames of the -i input, or of the CAN message on the command line,
+    # after TP reassembly and the ID filter
+    if ifo:
+        rdr = FrameReader(ifo, iformat, readerFilter(id_filter, tp))
     else:
-        print("%12s: %s\n" % ("Raw CAN msg", line.strip()))
-        print("%12s: %s (%s)" % ("PGN", label, pgn))
-        print("%12s: %s" % ("Acronym", acronym))
-        cmd = prg_nm + " -p " + str(pgn)
-        print("%12s: %s" % ("PGN Details", cmd))
-        print("%12s: %s (%d)" % ("Source Add", source, sa))
-        if dest_add:
-            print("%12s: %s (%d)" % ("Dest Add", dest, dest_add))
-        print("\n")
+        rdr = [parseLine(args[0], iformat)]
 
-    q = ""\
-      + "select "\
-        + "spn.label, "\
-        + "spn.spn, "\
-        + "spn.byte_num, "\
-        + "spn.bit_len, "\
-        + "spn.bit_start, "\
-        + "spn.scale_factor, "\
-        + "spn.offset, "\
-        + "spn.unit "\
-      + "FROM "\
-        + "pgn pgn, "\
-        + "spn spn "\
-      + "WHERE "\
-        + "pgn.pgn = ? "\
-        + "and pgn.pgn_id = spn.pgn_id"
-
-    dbcur.execute(q, (pgn,))
-    for i in dbcur:
-
-        spn_part = ""
-        if not i[2]:
-            if oformat:
-                spn_part += ","
-            else:
-                # Skip if SPN is NULL
-                print("%12s: %s" % ("SPN", "NULL"))
-            continue
-
-        # Skip if byte number is greater than length of CAN
-        # message data
-        if i[2] > len(data_l):
-            # Skip
-            continue
-
-        bnum = i[2] - 1
-        if data_l[bnum] == "FF":
-            continue
-
-        blen = i[3]
-        bstart = i[4] - 1
-        
-        if oformat:
-            spn_part += "," + str(i[1])
-        else:
-            print("%12s: %s (%s)" % ("SPN", i[0], i[1]))
-
-        if blen <= 8:
-            # Convert byte in CAN data message to decimal and then to binary
-            val = int(data_l[bnum], 16)
-            bval = format(val, '08b')
-
-            # Since bit position in a byte are counted from right to left, 
-            # we have to do some tricky math to extract the value
-            end = 8 - bstart
-            start = end - blen
-
-            bval = bval[start:end]
-            val = int(bval, 2)
-            val = val * i[5]
-            val = val + i[6]
-            unit = i[7]
-            if oformat:
-                spn_part += "," + ("%0.2f" % val)
-                if len(unit) == 0:
-                    spn_part += "," + unit
-                else:
-                    spn_part += ","
-            else:
-                print("%12s: %sb (%s, %d)" % ("Binary Val", bval, hex(int(bval, 2)), int(bval, 2)))
-                if len(unit) == 0:
-                    print("%12s: %0.2f" % ("Value", val))
-                else:
-                    print("%12s: %0.2f (%s)" % ("Value", val, unit))
-        else:
-            # Check and see if bit length is > 8 and a multiple of 8. If so, proceed.
-            mod_val = blen % 8
-            div_val = int(blen / 8)
-            val_l = []
-            if mod_val == 0 and div_val > 1 and div_val <= 4:
-                for bpos in range(0, div_val):
-                    val_l.append(data_l[bnum + bpos])
-
-                val_l.reverse()
-                hexv = "".join(val_l)
-                val = int(hexv, 16)
-                val = val * i[5]
-                val = val + i[6]
-                unit = i[7]
-
-                if oformat:
-                    spn_part += "," + ("%0.2f" % val)
-                    if len(unit) == 0:
-                        spn_part += ","
-                    else:
-                        spn_part += "," + unit
-                else:
-                    print("%12s: 0x%s (%d)" % ("Hex Val", hexv, int(hexv, 16)))
-                    if len(unit) == 0:
-                        print("%12s: %0.2f" % ("Value", val))
-                    else:
-                        print("%12s: %0.2f (%s)" % ("Value", val, unit))
-
-        if oformat:
-            print(pgn_part + spn_part)
-        else:
-            cmd = prg_nm + " -p " + str(pgn) + " -s " + str(i[1])
-            print("%12s: %s" % ("Details", cmd))
-            print("\n")
-
-    dbcur.close()
-
-    return None
+    frames = (frame for frame in rdr if frame)
+    if tp:
+        frames = tp.process(frames)
+    if id_filter:
+        frames = id_filter.filter(frames)
 
+    return frames
 
 
-def dispSPNInfo(dbcon, pgn_num, spn_num):
-    q = ""\
-      + "SELECT "\
-        + "spn, "\
-        + "label, "\
-        + "sp_start_bit, "\
-        + "byte_num, "\
-        + "bit_len, "\
-        + "bit_start, "\
-        + "scale_factor, "\
-        + "offset, "\
-        + "transmission_rate, "\
-        + "description "\
-      + "FROM "\
-        + "spn "\
-      + "WHERE pgn_id = (SELECT pgn_id FROM pgn WHERE pgn = ?) AND spn = ?"
-
-    dbcur = dbcon.cursor()
-    dbcur.execute(q, (pgn_num, spn_num))
-    for i in dbcur:
-        print("%14s: %s (%s)" % ("SPN", i[1], i[0]))
-        print("%14s: %s" % ("SP Start Bit", i[2]))
-        print("%14s: %s" % ("Byte Num", i[3]))
-        print("%14s: %s" % ("Bit Len", i[4]))
-        print("%14s: %s" % ("Bit Start", i[5]))
-        print("%14s: %s" % ("Scale Factor", i[6]))
-        print("%14s: %s\n" % ("Offset", i[7]))
-        print("%s:" % ("Transmission Rate",))
-        print("  %s\n" % (i[8],))
-        print("%s:" % ("Description",))
-        print("  %s" % (i[9].strip('"')))
+def warnRejected(fmt, num_lines, num_rejected):
+    if num_rejected:
+        print("WARNING - " + str(num_rejected) + " of " + str(num_lines)\
+              + " lines are not supported CAN messages [Format: " + str(fmt)\
+              + "]", file=sys.stderr)
 
-    # Close DB cursor
-    dbcur.close()
 
-    return None
+def parseNum(num):
+    # Check if the number is supplied as a hexadecimal value
+    if num.startswith("0x"):
+        return int(num, 16)
 
+    return int(num)
 
-def dispSAInfo(src_add):
-    q = ""\
-      + "SELECT "\
-        + "sa, "\
-        + "label "\
-      + "FROM "\
-        + "sa "\
-      + "WHERE sa = ?"
 
-    dbcur = dbcon.cursor()
+def dispSPNInfo(dec, pgn_num, spn_num):
+    i = dec.spnInfo(parseNum(pgn_num), parseNum(spn_num))
+    if i:
+        print("%14s: %s (%s)" % ("SPN", i.label, i.spn))
+        print("%14s: %s" % ("SP Start Bit", i.sp_start_bit))
+        print("%14s: %s" % ("Byte Num", i.byte_num))
+        print("%14s: %s" % ("Bit Len", i.bit_len))
+        print("%14s: %s" % ("Bit Start", i.bit_start))
+        print("%14s: %s" % ("Scale Factor", i.scale_factor))
+        print("%14s: %s\n" % ("Offset", i.offset))
+        print("%s:" % ("Transmission Rate",))
+        print("  %s\n" % (i.transmission_rate,))
+        print("%s:" % ("Description",))
+        print("  %s" % (i.description.strip('"')))
 
-    # Check if source address is supplied with leading hexadecimal designator
-    if src_add.startswith("0x"):
-        src_add = int(src_add, 16)
+    return None
 
-    dbcur.execute(q, (src_add, ))
-    for i in dbcur:
-        print("%14s: %s" % ("Source Add", i[0]))
-        print("%14s: %s" % ("Name", i[1]))
 
-    # Close DB cursor
-    dbcur.close()
+def dispSAInfo(dec, src_add):
+    src_add = parseNum(src_add)
+    label = dec.saInfo(src_add)
+    if label is not None:
+        print("%14s: %s" % ("Source Add", src_add))
+        print("%14s: %s" % ("Name", label))
 
     return None
 
 
-def dispPGNInfo(dbcon, pgn):
+def dispPGNInfo(dec, pgn):
     prg_nm = sys.argv[0]
 
-    q = ""\
-      + "SELECT "\
-        + "pgn, "\
-        + "acronym, "\
-        + "label, "\
-        + "description "\
-      + "FROM "\
-        + "pgn "\
-      + "WHERE pgn = ?"
-
-    dbcur = dbcon.cursor()
-
-    # Check if PGN is supplied as a hexadecimal value
-    if pgn.startswith("0x"):
-        pgn = int(pgn, 16)
-
-    dbcur.execute(q, (pgn, ))
-    for i in dbcur:
-        print("%14s: %s" % ("PGN", i[0]))
-        print("%14s: %s" % ("Acronym", i[1]))
-        print("%14s: %s" % ("Label", i[2]))
+    pgn = parseNum(pgn)
+    i = dec.pgnInfo(pgn)
+    if i:
+        print("%14s: %s" % ("PGN", i.pgn))
+        print("%14s: %s" % ("Acronym", i.acronym))
+        print("%14s: %s" % ("Label", i.label))
         print("")
         print("%s" % ("Description:",))
-        print("%s" % (i[3],))
+        print("%s" % (i.description,))
 
     # Get associated SPNs
-    q = ""\
-      + "SELECT "\
-        + "spn, "\
-        + "label "\
-      + "FROM "\
-        + "spn "\
-      + "WHERE pgn_id = (SELECT pgn_id FROM pgn WHERE pgn = ?)"
-
     print("\n\nAssociated SPNs:")
-    dbcur = dbcon.cursor()
-    dbcur.execute(q, (pgn, ))
-    for n,i in enumerate(dbcur, 1):
+    for n,(spn, label) in enumerate(dec.pgnSPNs(pgn), 1):
         print("(%d)" % (n,))
-        print("%12s: %s" % ("SPN", i[0]))
-        print("%12s: %s" % ("Label", i[1]))
-        cmd = prg_nm + " -p " + str(pgn) + " -s " + str(i[0])
+        print("%12s: %s" % ("SPN", spn))
+        print("%12s: %s" % ("Label", label))
+        cmd = prg_nm + " -p " + str(pgn) + " -s " + str(spn)
         print("%12s: %s" % ("Details", cmd))
         print("\n")
 
-    # Close DB cursor
-    dbcur.close()
-
     return None
 
 
@@ -415,13 +289,54 @@ pgn_num = None
 spn_num = None
 src_add = None
 oformat = None
+iformat = None
+ofile   = None
+jobs    = None
+parts   = False
+reassemble = True
+plan_stats = False
+snap_file  = None
+wide_sigs  = None
+bucket     = None
+ffill      = False
+live       = False
+tcp_addr   = None
+udp_addr   = None
+queue_size = None
+drop_oldest = False
+flush      = FLUSH_THROUGHPUT
+filter_d   = {}
+changes    = None
+deadbands  = None
+heartbeat  = None
+agg        = None
+window     = None
+slide      = None
+percentiles = None
+stats      = None
+stats_show = False
+stats_json = None
+stats_interval = None
+prof       = None
+profile    = None
+profile_out = None
 
 if len(sys.argv) == 1:
     usage()
     sys.exit(0)
 
 try:
-    (opts, args) = getopt.getopt(sys.argv[1:], "a:d:f:i:p:s:")
+    (opts, args) = getopt.getopt(sys.argv[1:], "a:d:f:i:j:o:p:s:",
+                                  ["bucket=", "drop-oldest", "ffill",
+                                   "flush=", "in-format=", "live", "no-tp",
+                                   "parallel", "pgn=", "sa=", "da=", "prio=",
+                                   "id-mask=", "id-range=", "changes",
+                                   "deadband=", "heartbeat=",
+                                   "window=", "slide=", "percentiles=",
+                                   "stats", "stats-json=", "stats-interval=",
+                                   "profile=", "profile-out=",
+                                   "parts", "plan-stats", "queue=",
+                                   "snapshot=", "spns=", "tcp=", "udp="])
 except getopt.GetoptError as e:
     print("ERROR - getopt() [" + str(e) + "]")
     usage()
@@ -433,66 +348,440 @@ for (k,v) in opts:
     elif k == "-f":
         oformat = v
     elif k == "-i":
+        infile = v
         if v == "-":
             ifo = sys.stdin
         else:
             ifo = open(v)
+    elif k == "-j":
+        try:
+            jobs = int(v)
+        except ValueError:
+            print("ERROR - Number of jobs must be an integer [" + v + "]")
+            sys.exit(1)
+    elif k == "--parallel":
+        if jobs is None:
+            jobs = 0
+    elif k == "--parts":
+        parts = True
+    elif k == "--no-tp":
+        reassemble = False
     elif k == "-d":
         dbfile = v
+    elif k == "-o":
+        ofile = v
     elif k == "-p":
         pgn_num = v
     elif k == "-s":
         spn_num = v
+    elif k == "--in-format":
+        iformat = v
+    elif k == "--plan-stats":
+        plan_stats = True
+    elif k == "--snapshot":
+        snap_file = v
+    elif k == "--spns":
+        wide_sigs = v
+    elif k == "--bucket":
+        bucket = v
+    elif k == "--ffill":
+        ffill = True
+    elif k == "--live":
+        live = True
+    elif k == "--tcp":
+        tcp_addr = v
+    elif k == "--udp":
+        udp_addr = v
+    elif k == "--queue":
+        queue_size = v
+    elif k == "--drop-oldest":
+        drop_oldest = True
+    elif k == "--flush":
+        flush = v
+    elif k in ["--pgn", "--sa", "--da", "--prio", "--id-mask", "--id-range"]:
+        filter_d[k] = v
+    elif k == "--changes":
+        deadbands = deadbands or ""
+    elif k == "--deadband":
+        deadbands = v
+    elif k == "--heartbeat":
+        heartbeat = v
+    elif k == "--window":
+        window = v
+    elif k == "--slide":
+        slide = v
+    elif k == "--percentiles":
+        percentiles = v
+    elif k == "--stats":
+        stats_show = True
+    elif k == "--stats-json":
+        stats_json = v
+    elif k == "--stats-interval":
+        stats_interval = v
+    elif k == "--profile":
+        profile = v
+    elif k == "--profile-out":
+        profile_out = v
 
 if not dbfile:
     dbfile = DB_FILE
-    if not os.path.exists(dbfile):
-        print("ERROR - " + dbfile + ": Not found!")
-        sys.exit(1)
+
+# A snapshot can stand in for the DB when decoding, but not for the -p, -s
+# and -a lookups
+if not os.path.exists(dbfile) and (pgn_num or src_add or not snap_file\
+                                   or not os.path.exists(snap_file)):
+    print("ERROR - " + dbfile + ": Not found!")
+    sys.exit(1)
+
+if iformat and iformat not in FORMAT_L:
+    print("ERROR - Unsupported input format [" + iformat + "]!")
+    sys.exit(1)
 
 if oformat:
-    if oformat not in ["csv"]:
-        print("ERROR - Only CSV output format supported at this time!")
+    if oformat not in ["csv", "jsonl", "wide", "npz", "npy"]:
+        print("ERROR - Only CSV, JSON Lines, wide CSV, NPZ and NPY output formats supported at this time!")
+        sys.exit(1)
+
+if flush not in FLUSH_L:
+    print("ERROR - Unsupported flush policy [" + flush + "]!")
+    sys.exit(1)
+
+id_filter = None
+if filter_d:
+    try:
+        id_filter = IDFilter(
+            parseIntList(filter_d.get("--pgn", ""), 0x3FFFF),
+            parseIntList(filter_d.get("--sa", ""), 255),
+            parseIntList(filter_d.get("--da", ""), 255),
+            parseIntList(filter_d.get("--prio", ""), 7),
+            parseMasks(filter_d.get("--id-mask", "")),
+            parseRanges(filter_d.get("--id-range", "")))
+    except ValueError as e:
+        print("ERROR - Invalid decode filter [" + str(e) + "]")
+        sys.exit(1)
+
+if deadbands is not None or heartbeat:
+    from j1939dec.changes import ChangeFilter, parseDeadbands
+
+    if oformat not in ["csv", "jsonl", "npy"] or jobs is not None:
+        print("ERROR - Change-only output requires -f csv, jsonl or npy, without --parallel!")
+        sys.exit(1)
+
+    try:
+        (band_d, default) = parseDeadbands(deadbands or "")
+        heartbeat = float(heartbeat) if heartbeat else None
+    except ValueError as e:
+        print("ERROR - Invalid --deadband or --heartbeat value [" + str(e) + "]")
+        sys.exit(1)
+
+    changes = ChangeFilter(band_d, default, heartbeat)
+
+if window or slide or percentiles:
+    from j1939dec.aggregate import WindowAggregator, parsePercentiles
+
+    if not window:
+        print("ERROR - --slide and --percentiles require --window!")
+        sys.exit(1)
+    if oformat not in ["csv", "jsonl"] or jobs is not None or changes\
+       or live or tcp_addr or udp_addr:
+        print("ERROR - Windowed aggregation requires -f csv or jsonl, without --parallel, --changes or live decoding!")
+        sys.exit(1)
+
+    try:
+        window = float(window)
+        slide = float(slide) if slide else None
+        pct_l = parsePercentiles(percentiles) if percentiles else None
+        if window <= 0 or (slide is not None and slide <= 0):
+            raise ValueError("Window and slide must be positive")
+        agg = WindowAggregator(None, oformat, window, slide, pct_l)
+    except ValueError as e:
+        print("ERROR - Invalid --window, --slide or --percentiles value [" + str(e) + "]")
+        sys.exit(1)
+
+if oformat == "npz":
+    if not ofile:
+        print("ERROR - NPZ output format requires an output file (-o)!")
         sys.exit(1)
 
+    try:
+        from j1939dec import batch
+    except ImportError as e:
+        print("ERROR - NPZ output format requires NumPy [" + str(e) + "]")
+        sys.exit(1)
+
+if oformat == "wide":
+    from j1939dec.wide import BUCKET_SIZE, WideWriter, parseSignals
+
+    try:
+        wide_sigs = parseSignals(wide_sigs or "")
+        bucket = float(bucket) if bucket else BUCKET_SIZE
+    except ValueError as e:
+        print("ERROR - Invalid --spns or --bucket value [" + str(e) + "]")
+        sys.exit(1)
+
+    if not wide_sigs or bucket <= 0:
+        print("ERROR - Wide output format requires --spns and a positive --bucket!")
+        sys.exit(1)
+elif wide_sigs or bucket or ffill:
+    print("ERROR - --spns, --bucket and --ffill require wide output (-f wide)!")
+    sys.exit(1)
+
+if oformat == "npy":
+    if not ofile:
+        print("ERROR - NPY output format requires an output directory (-o)!")
+        sys.exit(1)
+
+    from j1939dec.store import ColumnStore
+
+if jobs is not None:
+    if not infile or infile == "-":
+        print("ERROR - Parallel decoding requires an input file (-i <file>)!")
+        sys.exit(1)
+    if oformat not in ["csv", "jsonl"]:
+        print("ERROR - Parallel decoding requires CSV or JSON Lines output (-f csv|jsonl)!")
+        sys.exit(1)
+
+if parts and (jobs is None or not ofile):
+    print("ERROR - --parts requires parallel decoding and an output file (-o)!")
+    sys.exit(1)
+
+if tcp_addr or udp_addr:
+    live = True
+
+if stats_show or stats_json or stats_interval:
+    from j1939dec.stats import STATS_INTERVAL, DecodeStats
+
+    if not ifo or oformat not in [None, "csv", "jsonl"] or jobs is not None\
+       or live or changes or agg:
+        print("ERROR - --stats requires -i with the default, CSV or JSON Lines output, without --parallel or live decoding!")
+        sys.exit(1)
+
+    try:
+        stats_interval = float(stats_interval) if stats_interval\
+            else STATS_INTERVAL
+    except ValueError as e:
+        print("ERROR - Invalid --stats-interval value [" + str(e) + "]")
+        sys.exit(1)
+
+if profile or profile_out:
+    from j1939dec.profiling import PROFILE_L, defaultFile
+
+    if profile not in PROFILE_L:
+        print("ERROR - --profile must be one of " + ", ".join(PROFILE_L) + "!")
+        sys.exit(1)
+    if profile == "stages" and (not ifo or oformat not in ["csv", "jsonl"]\
+       or jobs is not None or live or changes or agg or stats_show\
+       or stats_json):
+        print("ERROR - --profile=stages requires -i with CSV or JSON Lines output, without --parallel, live decoding, --changes, --window or --stats!")
+        sys.exit(1)
+
+if live:
+    import signal
+    import asyncio
+    from j1939dec.live import QUEUE_SIZE, LiveDecoder, parseAddress
+
+    if infile and infile != "-":
+        print("ERROR - Live decoding reads STDIN (-i -), --tcp or --udp!")
+        sys.exit(1)
+    if not (infile or tcp_addr or udp_addr):
+        print("ERROR - Live decoding requires -i -, --tcp or --udp!")
+        sys.exit(1)
+    if oformat not in [None, "csv", "jsonl"] or jobs is not None:
+        print("ERROR - Live decoding supports the default, CSV and JSON Lines output only!")
+        sys.exit(1)
+
+    try:
+        queue_size = int(queue_size) if queue_size else QUEUE_SIZE
+        if tcp_addr:
+            tcp_addr = parseAddress(tcp_addr)
+        if udp_addr:
+            udp_addr = parseAddress(udp_addr)
+    except ValueError as e:
+        print("ERROR - Invalid --queue, --tcp or --udp value [" + str(e) + "]")
+        sys.exit(1)
+
+    if queue_size < 1:
+        print("ERROR - --queue must be at least 1!")
+        sys.exit(1)
+elif queue_size or drop_oldest:
+    print("ERROR - --queue and --drop-oldest require live decoding!")
+    sys.exit(1)
+
 # Open DB file
+dec = None
 try:
-    dbcon = sqlite3.connect(dbfile)
-
-    #dbcur = dbcon.cursor()
+    dec = Decoder(dbfile, snap_file, warnSnapshot)
 
     # If "-p" and "-s" flags used, query and return SPN info
     if pgn_num and spn_num:
-        dispSPNInfo(dbcon, pgn_num, spn_num)
+        dispSPNInfo(dec, pgn_num, spn_num)
         sys.exit(0)
 
     # If "-p" is the only flag used, query and return PGN info and all the  
     # SPNs (and associated info) covered by that PGN
     if pgn_num:
-        dispPGNInfo(dbcon, pgn_num)
+        dispPGNInfo(dec, pgn_num)
         sys.exit(0)
 
     if src_add:
-        dispSAInfo(src_add)
+        dispSAInfo(dec, src_add)
         sys.exit(0)
 
-    if ifo:
-        for n,line in enumerate(ifo, 1):
-            line = line.rstrip()
-            if not oformat:
-                print("\n\n===Begin CAN message #" + str(n) + "===\n")
-            procLine(line, dbcon, oformat)
-
-            if not oformat:
-                print("===End CAN message #" + str(n) + "===\n\n")
+    # Load the pgn, spn and sa tables once, or map the snapshot made from
+    # them. Past this point, decoding does not go back to the DB.
+    plan = dec.plan
+    if not isinstance(plan, SnapshotPlan):
+        snap_file = None
+    if plan_stats:
+        print(plan.describe(), file=sys.stderr)
+
+    ofo = sys.stdout
+    if ofile and oformat not in ["npz", "npy"]:
+        if parts:
+            ofo = None
+        else:
+            ofo = open(ofile, "w")
+
+    header = formatHeader(oformat) if oformat in ["csv", "jsonl"] else None
+    if agg:
+        header = agg.header()
+    if header and ofo and not live:
+        print(header, file=ofo)
+
+    # Multi-packet messages are reassembled ahead of the decoder
+    tp = None
+    if reassemble:
+        tp = TPReassembler()
+
+    if profile:
+        prof = dec.profiler(profile, profile_out\
+                            or defaultFile(sys.argv[0], profile), ifo,
+                            {"program": os.path.basename(sys.argv[0]),
+                             "version": VERSION,
+                             "output_format": oformat or "human"})
+        prof.start()
+
+    if live:
+        live_dec = LiveDecoder(plan, oformat, iformat, tp, queue_size,
+                               "drop-oldest" if drop_oldest else "block", ofo,
+                               id_filter, changes)
+
+        async def runLive():
+            loop = asyncio.get_running_loop()
+            for sig in [signal.SIGINT, signal.SIGTERM]:
+                loop.add_signal_handler(sig, live_dec.stop)
+            await live_dec.run(bool(infile), tcp_addr, udp_addr, header)
+
+        try:
+            asyncio.run(runLive())
+        except OSError as e:
+            print("ERROR - " + str(e), file=sys.stderr)
+        print(live_dec.describe(), file=sys.stderr)
+    elif oformat == "npz":
+        frames = readFrames(ifo, args, iformat, tp, id_filter)
+        cols_d = batch.decodeFrames(plan, frames)
+        n = batch.saveColumns(cols_d, ofile)
+        print(str(n) + " SPN columns written to " + ofile, file=sys.stderr)
+    elif oformat == "wide":
+        frames = readFrames(ifo, args, iformat, tp, id_filter)
+
+        wide = WideWriter(plan, wide_sigs, ofo, bucket, ffill)
+        for frame in frames:
+            rec = decodeValues(frame, plan)
+            if rec:
+                wide.add(rec)
+        wide.close()
+        if wide.num_untimed:
+            print("WARNING - " + str(wide.num_untimed) + " frames without "\
+                  + "timestamps skipped", file=sys.stderr)
+    elif agg:
+        frames = readFrames(ifo, args, iformat, tp, id_filter)
+
+        agg.out = ofo
+        for frame in frames:
+            rec = decodeValues(frame, plan)
+            if rec:
+                agg.add(rec)
+        agg.close()
+        print(agg.describe(), file=sys.stderr)
+    elif oformat == "npy":
+        frames = readFrames(ifo, args, iformat, tp, id_filter)
+
+        store = ColumnStore(ofile)
+        for frame in frames:
+            rec = decodeValues(frame, plan)
+            if rec and changes:
+                rec = changes.filterRecord(rec)
+            if rec:
+                store.appendFrame(rec)
+        n = store.close()
+        print(str(n) + " signals in store " + ofile, file=sys.stderr)
+    elif jobs is not None:
+        if ofo:
+            ofo.flush()
+        res = decodeParallel(infile, dbfile, oformat, ofo, jobs, iformat,
+                             ofile if parts else None, reassemble=reassemble,
+                             snap_file=snap_file, id_filter=id_filter)
+        if res:
+            (fmt, num_lines, num_frames, num_rejected, num_parts) = res
+            warnRejected(fmt, num_lines, num_rejected)
+            if parts:
+                print(str(num_parts) + " part files written to " + ofile\
+                      + ".*", file=sys.stderr)
+        else:
+            print("WARNING - Input format cannot be split into chunks. "\
+                  + "Decoding on one core.", file=sys.stderr)
+            if parts:
+                ofo = open(ofile + ".00000", "w")
+                if header:
+                    print(header, file=ofo)
+            rdr = dec.writeFile(ifo, oformat, ofo, iformat, reassemble,
+                                flush, id_filter)
+            warnRejected(rdr.fmt, rdr.num_lines, rdr.num_rejected)
+    elif ifo:
+        if stats_show or stats_json:
+            # Periodic reports only go to STDERR with --stats
+            stats = DecodeStats(plan, stats_interval if stats_show else 0)
+        rdr = dec.writeFile(ifo, oformat, ofo, iformat, reassemble, flush,
+                            id_filter, changes, stats,
+                            prof.timers if prof else None)
+        warnRejected(rdr.fmt, rdr.num_lines, rdr.num_rejected)
     else:
-        procLine(args[0], dbcon, oformat)
+        frame = parseLine(args[0], iformat)
+        if frame:
+            if not id_filter or id_filter.test(frame[1]):
+                procFrame(frame, plan, oformat, ofo)
+        else:
+            print("ERROR - Unsupported CAN message!", file=ofo)
+
+    if prof:
+        if ofo:
+            ofo.flush()
+        prof.stop()
+        prof.write()
+        print(prof.describe(), file=sys.stderr)
+
+    if changes:
+        print(changes.describe(), file=sys.stderr)
+
+    if stats:
+        if ofo:
+            ofo.flush()
+        stats_d = stats.report(True) if stats_show else stats.summary()
+        if stats_json:
+            stats.writeJSON(stats_json, stats_d)
+
+    if ofo and ofo is not sys.stdout:
+        ofo.close()
 
 except sqlite3.DatabaseError as e:
     print("ERROR - DB Exception [" + str(e) + "]")
+except ValueError as e:
+    print("ERROR - " + str(e))
 finally:
     # Close db connection
-    dbcon.close()
+    if dec:
+        dec.close()
     rc = 0
 
 if ifo:
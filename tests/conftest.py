@@ -0,0 +1,244 @@
+#
+# Shared fixtures: a synthetic DA (j1939dec.synth) ingested into a DB with
+# the ingest scripts, and a log of traffic for it
+#
+import os
+import sys
+import copy
+import sqlite3
+import zipfile
+import subprocess
+from xml.sax.saxutils import escape
+
+import pytest
+
+# The scripts and j1939dec are used from the checkout
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from j1939dec.ingest import DA_SHEET, PGN_FLD_MAP, SA_SHEET_L
+from j1939dec.synth import LogWriter, SynthDA, SynthPGN, TrafficGen
+from j1939dec.tp import TPReassembler
+
+
+#
+# Definitions
+#
+# The ingest scripts as they were before the bulk loader, schema versions
+# and .xlsx support, kept as the reference the current ones must match
+LEGACY_DIR = os.path.join("tests", "legacy")
+
+SEED = 7
+NUM_PGNS = 60
+NUM_FRAMES = 3000
+
+
+#
+# Subroutines
+#
+def scriptEnv():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+
+    return env
+
+
+def runScript(script, *args, input=None, cwd=None):
+    # Runs one of the repo's scripts; returns the CompletedProcess
+    return subprocess.run([sys.executable, os.path.join(REPO_DIR, script)]
+                          + [str(arg) for arg in args], input=input,
+                          capture_output=True, text=True, env=scriptEnv(),
+                          cwd=cwd, timeout=120)
+
+
+def startScript(script, *args, **kw):
+    # Starts one of the repo's scripts; returns the Popen
+    return subprocess.Popen([sys.executable, os.path.join(REPO_DIR, script)]
+                            + [str(arg) for arg in args], env=scriptEnv(),
+                            **kw)
+
+
+def buildDB(da, tmp_dir, name="da"):
+    # The TSVs of a SynthDA ingested into <name>.db; returns the DB file
+    da_tsv = os.path.join(tmp_dir, name + ".tsv")
+    sa_tsv = os.path.join(tmp_dir, name + "-sa.tsv")
+    dbfile = os.path.join(tmp_dir, name + ".db")
+    with open(da_tsv, "w") as fo:
+        da.writeTSV(fo)
+    with open(sa_tsv, "w") as fo:
+        da.writeSATSV(fo)
+
+    res = runScript("j1939-pgn-spn-ingest.py", "-o", dbfile, da_tsv)
+    assert res.returncode == 0, res.stdout + res.stderr
+    res = runScript("j1939-source-add-ingest.py", "-d", dbfile, sa_tsv)
+    assert res.returncode == 0, res.stdout + res.stderr
+
+    return dbfile
+
+
+def buildLegacyDB(da, tmp_dir):
+    # The same DB built by the legacy scripts (schema version 0); they write
+    # da.db to the current directory
+    da_tsv = os.path.join(tmp_dir, "da.tsv")
+    sa_tsv = os.path.join(tmp_dir, "da-sa.tsv")
+    with open(da_tsv, "w") as fo:
+        da.writeTSV(fo)
+    with open(sa_tsv, "w") as fo:
+        da.writeSATSV(fo)
+
+    res = runScript(os.path.join(LEGACY_DIR, "j1939-pgn-spn-ingest.py"),
+                    da_tsv, cwd=tmp_dir)
+    assert res.returncode == 0, res.stdout + res.stderr
+    dbfile = os.path.join(tmp_dir, "da.db")
+    res = runScript(os.path.join(LEGACY_DIR, "j1939-source-add-ingest.py"),
+                    "-d", dbfile, sa_tsv)
+    assert res.returncode == 0, res.stdout + res.stderr
+
+    return dbfile
+
+
+def _cellXML(ref, text):
+    # Numbers as numeric cells, everything else as inline strings
+    try:
+        float(text)
+        return '<c r="%s"><v>%s</v></c>' % (ref, text)
+    except ValueError:
+        return '<c r="%s" t="inlineStr"><is><t xml:space="preserve">%s</t>'\
+            '</is></c>' % (ref, escape(text))
+
+
+def _colName(n):
+    name = ""
+    n += 1
+    while n:
+        (n, rem) = divmod(n - 1, 26)
+        name = chr(ord("A") + rem) + name
+
+    return name
+
+
+def _sheetXML(row_l):
+    xml_l = ['<?xml version="1.0" encoding="UTF-8"?>'
+             '<worksheet xmlns="http://schemas.openxmlformats.org/'
+             'spreadsheetml/2006/main"><sheetData>']
+    for (r, cells_l) in enumerate(row_l, 1):
+        xml_l.append('<row r="%d">' % r)
+        xml_l.extend(_cellXML(_colName(c) + str(r), text)
+                     for (c, text) in enumerate(cells_l) if text)
+        xml_l.append("</row>")
+    xml_l.append("</sheetData></worksheet>")
+
+    return "".join(xml_l)
+
+
+def writeXLSX(da, xlsx_file):
+    # The DA workbook: the "SPs & PGs" sheet and a source address sheet
+    sa_row_l = [["Revised", "Function ID", "Function Description"]]
+    sa_row_l += [["", str(sa), label] for (sa, label) in da.sa_d.items()]
+    sheet_l = [
+        (DA_SHEET, [["J1939 Digital Annex (synthetic)"]]
+         + list(da.sheetRows()) + [[""] * PGN_FLD_MAP["pgn"] + ["N/A"]]),
+        (SA_SHEET_L[0], sa_row_l)]
+
+    ns_main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    ns_rel = "http://schemas.openxmlformats.org/officeDocument/2006/"\
+        + "relationships"
+    with zipfile.ZipFile(xlsx_file, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("xl/workbook.xml", '<?xml version="1.0"?>'
+                    '<workbook xmlns="%s" xmlns:r="%s"><sheets>' % (
+                        ns_main, ns_rel) + "".join(
+                    '<sheet name="%s" sheetId="%d" r:id="rId%d"/>' % (
+                        escape(name), n, n)
+                    for (n, (name, row_l)) in enumerate(sheet_l, 1))
+                    + "</sheets></workbook>")
+        zf.writestr("xl/_rels/workbook.xml.rels", '<?xml version="1.0"?>'
+                    '<Relationships xmlns="http://schemas.openxmlformats.org/'
+                    'package/2006/relationships">' + "".join(
+                    '<Relationship Id="rId%d" Target="worksheets/sheet%d.xml"'
+                    ' Type="%s/worksheet"/>' % (n, n, ns_rel)
+                    for n in range(1, len(sheet_l) + 1))
+                    + "</Relationships>")
+        for (n, (name, row_l)) in enumerate(sheet_l, 1):
+            zf.writestr("xl/worksheets/sheet%d.xml" % n, _sheetXML(row_l))
+
+    return xlsx_file
+
+
+def reviseDA(da):
+    # A copy of a SynthDA as a later DA revision would change it: a PGN
+    # removed, one relabelled, an SPN rescaled, an SPN dropped and a new PGN
+    da = copy.deepcopy(da)
+    da.pgn_l.pop(3)
+    da.pgn_l[5].label += " (revised)"
+    spn = da.pgn_l[6].spn_l[0]
+    spn.scale_factor *= 2
+    if len(da.pgn_l[7].spn_l) > 1:
+        da.pgn_l[7].spn_l.pop()
+    pgn_s = set(pgn.pgn for pgn in da.pgn_l)
+    new_pgn = min(set(range(0xF000, 0x10000)) - pgn_s)
+    new_spn = copy.deepcopy(da.pgn_l[0].spn_l[0])
+    new_spn.spn = da.num_spns + 1
+    new_spn.label = "Synthetic SP %d" % new_spn.spn
+    da.pgn_l.append(SynthPGN(new_pgn, "Synthetic PG new", "SPGNEW", 8, 100,
+                             [new_spn]))
+    da.num_spns += 1
+
+    return da
+
+
+def dbRows(dbfile):
+    # What a DB decodes with, without its row ids: PGNs (first row wins),
+    # SPNs by (PGN, SPN), source addresses
+    dbcon = sqlite3.connect(dbfile)
+    pgn_d = {}
+    for row in dbcon.execute("SELECT pgn, label, acronym, description "
+                             "FROM pgn ORDER BY pgn_id"):
+        pgn_d.setdefault(row[0], row[1:])
+    col_l = [row[1] for row in dbcon.execute("PRAGMA table_info(spn)")
+             if row[1] not in ["spn_id", "pgn_id"]]
+    spn_d = {}
+    for row in dbcon.execute("SELECT pgn.pgn, " + ", ".join(
+            "spn." + col for col in col_l) + " FROM spn JOIN pgn "
+            "ON spn.pgn_id = pgn.pgn_id ORDER BY spn.spn_id"):
+        spn_d.setdefault((row[0], row[1]), row[2:])
+    sa_l = []
+    if dbcon.execute("SELECT count(*) FROM sqlite_master "
+                     "WHERE name = 'sa'").fetchone()[0]:
+        sa_l = sorted(dbcon.execute("SELECT sa, label FROM sa").fetchall())
+    dbcon.close()
+
+    return (pgn_d, spn_d, sa_l)
+
+
+def synthFrames(da, num_frames=NUM_FRAMES):
+    # The frames of the synthetic traffic, TP messages reassembled
+    return list(TPReassembler().process(TrafficGen(da, SEED).frames(
+        num_frames)))
+
+
+def writeLog(da, log_file, fmt="candump-L", num_frames=NUM_FRAMES):
+    with open(log_file, "w") as fo:
+        LogWriter(fo, fmt).write(TrafficGen(da, SEED).frames(num_frames))
+
+    return log_file
+
+
+@pytest.fixture(scope="session")
+def synth_da():
+    # Multi-packet PGNs included, for TP reassembly
+    return SynthDA(SEED, num_pgns=NUM_PGNS, multi=0.2)
+
+
+@pytest.fixture(scope="session")
+def data_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("j1939")
+
+
+@pytest.fixture(scope="session")
+def dbfile(synth_da, data_dir):
+    return buildDB(synth_da, str(data_dir))
+
+
+@pytest.fixture(scope="session")
+def log_file(synth_da, data_dir):
+    return writeLog(synth_da, str(data_dir / "synth.log"))
@@ -0,0 +1,115 @@
+import io
+import json
+import math
+import random
+
+import pytest
+
+from conftest import SEED
+
+from j1939dec.aggregate import ACCURACY, WindowAggregator, parsePercentiles
+from j1939dec.plan import compileSPN
+
+
+PCT_L = [0.0, 25.0, 50.0, 95.0, 100.0]
+
+
+def synthRecords(num_recs=3000):
+    # decodeValues() records of two SAs with three SPNs each, about every
+    # 0.1 s; values of both signs, zeros and a constant signal
+    rnd = random.Random(SEED)
+    spn_l = [compileSPN("SP %d" % spn, spn, 1, 8, 1, 1, 0, "u")
+             for spn in [10, 11, 12]]
+    rec_l = []
+    ts = 1000.0 + rnd.random()
+    for n in range(num_recs):
+        ts += rnd.expovariate(10.0)
+        val_l = [(spn_l[0], rnd.gauss(0.0, 50.0)),
+                 (spn_l[1], rnd.choice([0.0, rnd.uniform(1.0, 1e6)])),
+                 (spn_l[2], 42.0)]
+        del val_l[rnd.randint(1, 3):]
+        rec_l.append((ts, 0xFEF1, 255, n % 2 * 0x10, val_l))
+
+    return rec_l
+
+
+def aggregate(rec_l, window, slide=None):
+    out = io.StringIO()
+    agg = WindowAggregator(out, "jsonl", window, slide, PCT_L)
+    for rec in rec_l:
+        agg.add(rec)
+    agg.close()
+
+    return (agg, [json.loads(line) for line in out.getvalue().splitlines()])
+
+
+def referenceWindows(rec_l, window, slide):
+    # {(start, sa, spn): sorted values} of every aligned window
+    slide = slide or window
+    num_panes = int(round(window / slide))
+    win_d = {}
+    for (ts, pgn, dest_add, sa, val_l) in rec_l:
+        idx = int(ts // slide)
+        for end_idx in range(idx + 1, idx + 1 + num_panes):
+            start = (end_idx - num_panes) * slide
+            for (i, val) in val_l:
+                win_d.setdefault((start, sa, i.spn), []).append(val)
+
+    return {key: sorted(val_l) for (key, val_l) in win_d.items()}
+
+
+@pytest.mark.parametrize("window,slide", [(60.0, None), (10.0, None),
+                                          (60.0, 20.0), (30.0, 5.0)])
+def testMatchesReference(window, slide):
+    rec_l = synthRecords()
+    (agg, row_l) = aggregate(rec_l, window, slide)
+    ref_d = referenceWindows(rec_l, window, slide)
+
+    assert sorted((row["start"], row["sa"], row["spn"]) for row in row_l)\
+        == sorted(ref_d)
+    for row in row_l:
+        val_l = ref_d[(row["start"], row["sa"], row["spn"])]
+        assert row["end"] == row["start"] + window
+        assert row["start"] % (slide or window) == 0.0
+        assert (row["pgn"], row["unit"]) == (0xFEF1, "u")
+        assert row["count"] == len(val_l)
+        assert (row["min"], row["max"]) == (val_l[0], val_l[-1])
+        assert row["mean"] == pytest.approx(sum(val_l) / len(val_l))
+
+        # p0 and p100 are exact, the others within ACCURACY of the value at
+        # their rank
+        assert (row["p0"], row["p100"]) == (val_l[0], val_l[-1])
+        for pct in PCT_L[1:-1]:
+            want = val_l[math.floor(pct / 100.0 * (len(val_l) - 1))]
+            assert abs(row["p%g" % pct] - want)\
+                <= ACCURACY * abs(want) + 1e-9
+
+    assert agg.num_values == sum(len(rec[4]) for rec in rec_l)
+    assert agg.num_late == 0
+
+
+def testLateAndUntimed():
+    i = compileSPN("SP", 1, 1, 8, 1, 1, 0, "u")
+    rec_l = [(100.0, 0xFEF1, 255, 0, [(i, 1.0)]),
+             (125.0, 0xFEF1, 255, 0, [(i, 2.0)]),
+             # Out of order within the pane: counted
+             (121.0, 0xFEF1, 255, 0, [(i, 3.0)]),
+             # Before the pane being filled: late
+             (119.0, 0xFEF1, 255, 0, [(i, 4.0)]),
+             (None, 0xFEF1, 255, 0, [(i, 5.0)])]
+    (agg, row_l) = aggregate(rec_l, 10.0)
+
+    assert [(row["start"], row["count"], row["max"]) for row in row_l]\
+        == [(100.0, 1, 1.0), (120.0, 2, 3.0)]
+    assert (agg.num_values, agg.num_late, agg.num_untimed) == (3, 1, 1)
+
+
+def testWindowNotMultipleOfSlide():
+    with pytest.raises(ValueError):
+        WindowAggregator(io.StringIO(), "csv", 60.0, 25.0)
+
+
+def testParsePercentiles():
+    assert parsePercentiles("50, 95,99.9,") == [50.0, 95.0, 99.9]
+    with pytest.raises(ValueError):
+        parsePercentiles("101")
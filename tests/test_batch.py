@@ -0,0 +1,55 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import SEED
+
+from j1939dec import batch
+from j1939dec.decode import decodeValues
+from j1939dec.decoder import Decoder
+from j1939dec.synth import TrafficGen
+from j1939dec.tp import TPReassembler
+
+
+def lineColumns(plan, frames):
+    # The columns of batch.decodeFrames(), made with the line decoder
+    col_d = {}
+    for frame in frames:
+        rec = decodeValues(frame, plan)
+        if not rec:
+            continue
+        (ts, pgn, dest_add, sa, val_l) = rec
+        for (i, val) in val_l:
+            col = col_d.setdefault((pgn, sa, i.spn), ([], []))
+            col[0].append(math.nan if ts is None else ts)
+            col[1].append(val)
+
+    return col_d
+
+
+def testBatchMatchesLineDecoder(synth_da, dbfile):
+    # Reassembled TP payloads (longer than 8 bytes) and frames cut short of
+    # their PGN's length decode as they do in the line decoder
+    frames = list(TPReassembler().process(
+        TrafficGen(synth_da, SEED).frames(5000)))
+    assert any(len(data) > 8 for (ts, can_id, data) in frames)
+    for n in range(0, len(frames), 7):
+        (ts, can_id, data) = frames[n]
+        frames[n] = (ts, can_id, data[:n % 8])
+
+    with Decoder(dbfile) as dec:
+        want_d = lineColumns(dec.plan, frames)
+        # Small blocks, so that columns are joined across blocks
+        got_d = batch.decodeFrames(dec.plan, frames, 1000)
+
+    assert sorted(got_d) == sorted(want_d)
+    # SPNs past byte 8 are there
+    long_s = set((pgn.pgn, spn.spn) for pgn in synth_da.pgn_l
+                 for spn in pgn.spn_l if spn.pos >= 64)
+    assert long_s & set((pgn, spn) for (pgn, sa, spn) in got_d)
+    for (key, (ts_l, val_l)) in want_d.items():
+        (ts, val) = got_d[key]
+        assert np.array_equal(ts, np.array(ts_l), equal_nan=True)
+        assert np.array_equal(val, np.array(val_l))
@@ -0,0 +1,41 @@
+import os
+import json
+import shutil
+
+from conftest import runScript
+
+from j1939dec.bulk import MANIFEST_FILE, hashFile
+
+
+def testBadFilesDoNotEndRun(dbfile, log_file, tmp_path):
+    # A file that is not a log and one that cannot be read are reported; the
+    # others are decoded and recorded, and only the bad ones are retried
+    in_dir = tmp_path / "in"
+    out_dir = tmp_path / "out"
+    os.makedirs(in_dir / "sub")
+    shutil.copyfile(log_file, in_dir / "a.log")
+    shutil.copyfile(log_file, in_dir / "sub" / "b.log")
+    (in_dir / "notes.txt").write_text("not a CAN log\n" * 10)
+    os.symlink(tmp_path / "missing.log", in_dir / "gone.log")
+
+    res = runScript("jbd.py", "-d", dbfile, "-f", "csv", "-j", 2, in_dir,
+                    out_dir)
+    assert res.returncode == 1, res.stdout
+    line_l = res.stdout.splitlines()
+    assert "ERROR - notes.txt: Unknown log format" in line_l
+    assert any(line.startswith("ERROR - gone.log: ") for line in line_l)
+    assert line_l[-1] == "2 files decoded, 0 files already done, "\
+        "2 files failed"
+
+    with open(out_dir / MANIFEST_FILE) as fo:
+        ent_l = [json.loads(line) for line in fo]
+    assert sorted(ent["file"] for ent in ent_l) == ["a.log", "sub/b.log"]
+    for ent in ent_l:
+        assert ent["sha256"] == hashFile(in_dir / ent["file"])
+    assert os.path.exists(out_dir / "sub" / "processed_b.log")
+    assert not os.path.exists(out_dir / "processed_notes.txt")
+
+    res = runScript("jbd.py", "-d", dbfile, "-f", "csv", in_dir, out_dir)
+    assert res.returncode == 1
+    assert res.stdout.splitlines()[-1] == "0 files decoded, 2 files already "\
+        "done, 2 files failed"
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import runScript
+
+from j1939dec.idfilter import IDFilter, parseIntList, parseMasks, parseRanges
+
+
+def testParseIntList():
+    # Decimal (leading zeros too) or hex with 0x, single values or ranges
+    assert parseIntList("061444, 0xFEF1") == [61444, 0xFEF1]
+    assert parseIntList("00-03", 255) == [0, 1, 2, 3]
+    assert parseIntList("0X1e-0x20,") == [30, 31, 32]
+    for spec in ["FEF1", "0x", "1-", "0b11", "3-1"]:
+        with pytest.raises(ValueError):
+            parseIntList(spec)
+    with pytest.raises(ValueError):
+        parseIntList("256", 255)
+
+
+def testParseMasksAndRanges():
+    assert parseMasks("0x00FEF100/0x00FFFF00") == [(0x00FEF100, 0x00FFFF00)]
+    assert parseRanges("0x18FEF100-0x18FEF1FF, 010-020")\
+        == [(0x18FEF100, 0x18FEF1FF), (10, 20)]
+    for spec in ["0x10", "0x20-0x10", "0xZZ-0x20"]:
+        with pytest.raises(ValueError):
+            parseRanges(spec)
+
+
+def testFilter():
+    id_filter = IDFilter(pgn_l=[0xFEF1], sa_l=[0x21])
+    assert id_filter.test(0x18FEF121)
+    assert not id_filter.test(0x18FEF100)
+    assert not id_filter.test(0x18FEF221)
+
+
+def testInvalidFilterIsReported(dbfile, log_file):
+    res = runScript("jjd.py", "-d", dbfile, "-f", "csv", "--pgn=0xZZ", "-i",
+                    log_file)
+    assert res.returncode == 1
+    assert res.stdout.startswith("ERROR - Invalid decode filter [Invalid "
+                                 "number [0xZZ]]")
+    assert "Traceback" not in res.stderr
@@ -0,0 +1,139 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import buildDB, buildLegacyDB, dbRows, reviseDA, runScript,\
+     writeXLSX
+
+from j1939dec.ingest import updateDB
+from j1939dec.schema import SCHEMA_VERSION, getVersion, pendingMigrations
+
+
+def testUpdateMatchesFreshBuild(synth_da, dbfile, tmp_path):
+    # -u with the next revision gives the tables a fresh build of it has
+    rev_da = reviseDA(synth_da)
+    fresh = buildDB(rev_da, str(tmp_path), "fresh")
+
+    upd = str(tmp_path / "upd.db")
+    shutil.copy(dbfile, upd)
+    res = runScript("j1939-pgn-spn-ingest.py", "-u", upd, "-r", "rev2",
+                    "-c", tmp_path / "changes.json", tmp_path / "fresh.tsv")
+    assert res.returncode == 0, res.stdout
+    assert dbRows(upd) == dbRows(fresh)
+    assert "PGNs: 1 added, 1 changed, 1 removed" in res.stdout
+
+
+def testChangeLogRequiresUpdate(synth_da, tmp_path):
+    da_tsv = tmp_path / "da.tsv"
+    with open(da_tsv, "w") as fo:
+        synth_da.writeTSV(fo)
+    res = runScript("j1939-pgn-spn-ingest.py", "-o", tmp_path / "da.db",
+                    "-c", tmp_path / "changes.json", da_tsv)
+    assert res.returncode == 1
+    assert res.stdout.startswith("ERROR - -c (change log) requires -u!")
+    assert not os.path.exists(tmp_path / "da.db")
+
+
+def testUpdateIsOneTransaction(synth_da, tmp_path):
+    # A DB without an sa table, updated from a DA with SAs (as from an
+    # .xlsx): a failure after the SA diff leaves the DB as it was
+    da_tsv = tmp_path / "old.tsv"
+    with open(da_tsv, "w") as fo:
+        synth_da.writeTSV(fo)
+    old = str(tmp_path / "old.db")
+    res = runScript("j1939-pgn-spn-ingest.py", "-o", old, da_tsv)
+    assert res.returncode == 0, res.stdout
+    before = dbRows(old)
+
+    new_con = sqlite3.connect(buildDB(reviseDA(synth_da), str(tmp_path),
+                                      "new"))
+    dbcon = sqlite3.connect(old)
+    with pytest.raises(sqlite3.Error):
+        # Not a value SQLite can store
+        updateDB(dbcon, new_con, True, {"da_revision": ["rev2"]})
+    dbcon.close()
+    new_con.close()
+
+    assert dbRows(old) == before
+    assert before[2] == []
+
+
+def stripQuotes(rows):
+    # The TSV export quotes multi-line cells, and the TSV loader turns the
+    # tabs in them into blanks; .xlsx cells are taken as they are
+    (pgn_d, spn_d, sa_l) = rows
+
+    def norm(row, n):
+        row = list(row)
+        row[n] = row[n].strip('"').replace("\t", " ")
+        return tuple(row)
+
+    return ({pgn: norm(row, 2) for (pgn, row) in pgn_d.items()},
+            {key: norm(row, 9) for (key, row) in spn_d.items()}, sa_l)
+
+
+def testMatchesLegacyIngest(synth_da, dbfile, tmp_path):
+    # The bulk loader writes the rows the original scripts wrote; the
+    # decode columns of the current schema come after them
+    legacy = dbRows(buildLegacyDB(synth_da, str(tmp_path)))
+    current = dbRows(dbfile)
+
+    assert current[0] == legacy[0]
+    assert current[2] == legacy[2]
+    assert sorted(current[1]) == sorted(legacy[1])
+    for (key, row) in legacy[1].items():
+        assert current[1][key][:len(row)] == row
+
+
+def testXLSXMatchesTSV(synth_da, dbfile, tmp_path):
+    xlsx_file = writeXLSX(synth_da, str(tmp_path / "da.xlsx"))
+    xlsx_db = str(tmp_path / "xlsx.db")
+    res = runScript("j1939-pgn-spn-ingest.py", "-o", xlsx_db, xlsx_file)
+    assert res.returncode == 0, res.stdout
+    assert "ERROR" not in res.stdout
+
+    assert stripQuotes(dbRows(xlsx_db)) == stripQuotes(dbRows(dbfile))
+
+
+def testMigrateLegacyDB(synth_da, dbfile, tmp_path):
+    # A schema version 0 DB, migrated, has the tables of a fresh build
+    legacy = buildLegacyDB(synth_da, str(tmp_path))
+    res = runScript("j1939-db-migrate.py", legacy)
+    assert res.returncode == 0, res.stdout
+
+    dbcon = sqlite3.connect(legacy)
+    assert getVersion(dbcon) == SCHEMA_VERSION
+    index_s = set(row[0] for row in dbcon.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"))
+    dbcon.close()
+    assert {"pgn_pgn", "sa_sa", "spn_pgnid"} <= index_s
+    assert dbRows(legacy) == dbRows(dbfile)
+
+    # Nothing left to do the second time
+    res = runScript("j1939-db-migrate.py", "-n", legacy)
+    assert res.returncode == 0
+    dbcon = sqlite3.connect(legacy)
+    assert not pendingMigrations(dbcon)
+    dbcon.close()
+
+
+def testFailedBuild(tmp_path):
+    # The DB error is reported, and no DB or temporary file is left behind
+    tsv_file = tmp_path / "da.tsv"
+    tsv_file.write_text("")
+    res = runScript("j1939-pgn-spn-ingest.py", "-o",
+                    tmp_path / "missing" / "da.db", tsv_file)
+    assert res.returncode == 1
+    assert res.stdout.startswith("ERROR - DB Exception [")
+    assert "Traceback" not in res.stderr
+
+    xlsx_file = tmp_path / "da.xlsx"
+    xlsx_file.write_bytes(b"not a workbook")
+    res = runScript("j1939-pgn-spn-ingest.py", "-o", tmp_path / "x.db",
+                    xlsx_file)
+    assert res.returncode == 1
+    assert "Not a usable .xlsx workbook" in res.stdout
+    assert "Traceback" not in res.stderr
+    assert sorted(os.listdir(tmp_path)) == ["da.tsv", "da.xlsx"]
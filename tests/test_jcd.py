@@ -0,0 +1,43 @@
+from conftest import runScript
+
+
+def canIDs(da):
+    # A valid CAN ID of every sender of the DA
+    id_l = []
+    for (pgn, sa) in da.sender_l:
+        if pgn.pgn >= 0xF000:
+            id_l.append("%08X" % ((6 << 26) | (pgn.pgn << 8) | sa))
+        else:
+            id_l.append("%08X" % ((6 << 26) | ((pgn.pgn | 0xFF) << 8) | sa))
+
+    return id_l
+
+
+def testSummaryWithInvalidIDs(synth_da, dbfile, tmp_path):
+    # Lines that are not hex IDs are reported, the others still decoded
+    id_l = canIDs(synth_da)[:5]
+    id_file = tmp_path / "ids.txt"
+    id_file.write_text("\n".join(id_l + ["ZZZZZZZZ", "0x12345", id_l[0]])
+                       + "\n")
+
+    res = runScript("jcd.py", "-d", dbfile, "--summary", "-i", id_file)
+    assert res.returncode == 0
+    line_l = res.stdout.splitlines()
+    assert line_l[0].startswith("CAN ID,Count,")
+    assert line_l[1].startswith(id_l[0] + ",2,")
+    for can_id in id_l[1:]:
+        assert any(line.startswith(can_id + ",1,") for line in line_l)
+    assert "ZZZZZZZZ,1,ERROR - Invalid CAN ID" in line_l
+    assert "0x12345,1,ERROR - Invalid CAN ID" in line_l
+
+
+def testLinesWithInvalidIDs(synth_da, dbfile, tmp_path):
+    id_l = canIDs(synth_da)[:2]
+    id_file = tmp_path / "ids.txt"
+    id_file.write_text("\n".join([id_l[0], "ZZZZZZZZ", id_l[1]]) + "\n")
+
+    res = runScript("jcd.py", "-d", dbfile, "-i", id_file)
+    assert res.returncode == 0
+    assert "ERROR - Invalid CAN ID [ZZZZZZZZ]" in res.stdout
+    for can_id in id_l:
+        assert "\n" + can_id + "," in res.stdout
@@ -0,0 +1,127 @@
+import time
+import signal
+import socket
+import asyncio
+import threading
+import subprocess
+
+from conftest import runScript, startScript
+
+from j1939dec.decoder import Decoder
+from j1939dec.live import FrameQueue, LiveDecoder
+
+
+def waitFor(cond, timeout=10.0):
+    end = time.time() + timeout
+    while not cond():
+        assert time.time() < end, "Timed out"
+        time.sleep(0.05)
+
+
+def testLiveStdin(dbfile, log_file):
+    # Live mode decodes STDIN to the end and exits cleanly, with the Decoder
+    # closed
+    with open(log_file) as fo:
+        lines = fo.read()
+    res = runScript("jjd.py", "-d", dbfile, "-f", "csv", "--live", "-i", "-",
+                    input=lines)
+    assert res.returncode == 0, res.stderr
+    assert "Traceback" not in res.stderr
+
+    once = runScript("jjd.py", "-d", dbfile, "-f", "csv", "-i", log_file)
+    assert once.returncode == 0
+    assert res.stdout == once.stdout
+
+
+def testLiveStopsOnSignal(dbfile, log_file, tmp_path):
+    # SIGINT/SIGTERM end a live run whose input keeps coming
+    with open(log_file, "rb") as fo:
+        data = fo.read()
+    out_file = tmp_path / "out.csv"
+
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        with open(out_file, "wb") as ofo:
+            proc = startScript("jjd.py", "-d", dbfile, "-f", "csv", "--live",
+                               "-i", "-", stdin=subprocess.PIPE, stdout=ofo,
+                               stderr=subprocess.PIPE)
+
+            def feed():
+                try:
+                    while True:
+                        proc.stdin.write(data)
+                        proc.stdin.flush()
+                except (BrokenPipeError, ValueError, OSError):
+                    pass
+
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            waitFor(lambda: out_file.stat().st_size > 100000)
+
+            proc.send_signal(sig)
+            try:
+                rc = proc.wait(timeout=10)
+            finally:
+                proc.kill()
+            err = proc.stderr.read().decode()
+            proc.stderr.close()
+            assert rc == 0, err
+            assert "Traceback" not in err
+            assert err.startswith("Live: ")
+
+
+def testLiveTCPStop(dbfile, tmp_path):
+    # stop() ends the run with a TCP client still sending
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    line = b"(1715275504.000000) can0 18FEF121#0102030405060708\n"
+
+    async def send():
+        for n in range(100):
+            try:
+                (reader, writer) = await asyncio.open_connection("127.0.0.1",
+                                                                 port)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        try:
+            while True:
+                writer.write(line * 100)
+                await writer.drain()
+        except OSError:
+            pass
+
+    async def main(live_dec):
+        run = asyncio.ensure_future(live_dec.run(tcp_addr=("127.0.0.1",
+                                                           port)))
+        sender = asyncio.ensure_future(send())
+        while live_dec.num_lines < 10000:
+            await asyncio.sleep(0.01)
+
+        live_dec.stop()
+        await asyncio.wait_for(run, 10)
+        await asyncio.wait_for(sender, 10)
+
+    with Decoder(dbfile) as dec, open(tmp_path / "out.csv", "w") as ofo:
+        live_dec = LiveDecoder(dec.plan, "csv", queue_size=1000, ofo=ofo)
+        asyncio.run(main(live_dec))
+
+    assert live_dec.frame_q.closed and live_dec.frame_q.empty()
+    assert not live_dec.client_s
+
+
+def testClosedQueueRefusesItems():
+    async def main():
+        frame_q = FrameQueue(2)
+        await frame_q.put(1)
+        await frame_q.put(2)
+        # A producer waiting for room gives up when the queue is closed
+        blocked = asyncio.ensure_future(frame_q.put(3))
+        await asyncio.sleep(0)
+        frame_q.close()
+        await asyncio.wait_for(blocked, 1)
+        assert not frame_q.putNowait(4)
+
+        return [await frame_q.get() for n in range(3)]
+
+    assert asyncio.run(main()) == [1, 2, None]
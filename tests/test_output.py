@@ -0,0 +1,74 @@
+import io
+import json
+
+from conftest import synthFrames
+
+from j1939dec.changes import ChangeFilter
+from j1939dec.decode import decodeFrames, decodeValues
+from j1939dec.decoder import Decoder
+from j1939dec.profiling import StageTimers
+
+
+def decodeText(frames, plan, oformat, **kw):
+    out = io.StringIO()
+    decodeFrames(frames, plan, oformat, out, **kw)
+
+    return out.getvalue()
+
+
+def testJSONLMatchesDecodeValues(synth_da, dbfile):
+    frames = synthFrames(synth_da)
+    with Decoder(dbfile) as dec:
+        plan = dec.plan
+        want_l = []
+        for frame in frames:
+            rec = decodeValues(frame, plan)
+            if rec:
+                (ts, pgn, dest_add, sa, val_l) = rec
+                want_l += [(ts, pgn, dest_add, sa, i.spn, val)
+                           for (i, val) in val_l]
+        text = decodeText(frames, plan, "jsonl")
+
+    got_l = [(row["ts"], row["pgn"], row["da"], row["sa"], row["spn"],
+              row["value"]) for row in map(json.loads, text.splitlines())]
+    assert got_l == want_l
+
+
+def testStageTimersMatchFormat(synth_da, dbfile):
+    # The timed loop gives the output of the formatter, also for frames that
+    # cannot be decoded
+    frames = synthFrames(synth_da)
+    frames[100:100] = [(1.0, 0x18ABCD21, bytes(8)), (1.0, 0x1BFEF121, b"")]
+    with Decoder(dbfile) as dec:
+        for oformat in [None, "csv", "jsonl"]:
+            timers = StageTimers()
+            assert decodeText(frames, dec.plan, oformat, timers=timers)\
+                == decodeText(frames, dec.plan, oformat)
+            assert (timers.num_frames, timers.num_errors) == (len(frames), 2)
+
+
+def testChangesMatchFilterRecord(synth_da, dbfile):
+    # Change-only CSV rows are the values ChangeFilter.filterRecord() (as
+    # used for -f npy) passes on
+    frames = synthFrames(synth_da)
+    with Decoder(dbfile) as dec:
+        plan = dec.plan
+        changes = ChangeFilter(default=(0.0, 0.01), heartbeat=5.0)
+        want_l = []
+        for frame in frames:
+            rec = decodeValues(frame, plan)
+            if rec:
+                rec = changes.filterRecord(rec)
+            if rec:
+                (ts, pgn, dest_add, sa, val_l) = rec
+                # CSV writes destination address 0 as 255
+                want_l += ["%0.6f,%d,%d,%d" % (ts, pgn, dest_add or 255, sa)
+                           + ",%d,%0.2f" % (i.spn, val) for (i, val) in val_l]
+        text = decodeText(frames, plan, "csv",
+                          changes=ChangeFilter(default=(0.0, 0.01),
+                                               heartbeat=5.0))
+        num_rows = len(decodeText(frames, plan, "csv").splitlines())
+
+    got_l = [line.rsplit(",", 1)[0] for line in text.splitlines()]
+    assert 0 < len(got_l) < num_rows
+    assert got_l == want_l
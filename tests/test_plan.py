@@ -0,0 +1,99 @@
+import random
+import sqlite3
+
+import pytest
+
+from conftest import SEED, buildLegacyDB
+
+from j1939dec.decode import decodeValues
+from j1939dec.decoder import Decoder
+from j1939dec.plan import DecodePlan, compileSPN
+
+
+def canID(pgn, sa):
+    # PDU1 PGNs go to the global address
+    if pgn.pgn >= 0xF000:
+        return (6 << 26) | (pgn.pgn << 8) | sa
+
+    return (6 << 26) | ((pgn.pgn | 0xFF) << 8) | sa
+
+
+def bitValues(pgn, data):
+    # {spn: value} of the payload, read bit by bit with the layout of the
+    # synthetic DA; "error" and "not available" values are left out
+    val_d = {}
+    for i in pgn.spn_l:
+        if (i.pos + i.bit_len + 7) // 8 > len(data):
+            continue
+        raw = 0
+        for b in range(i.bit_len):
+            pos = i.pos + b
+            raw |= ((data[pos // 8] >> (pos % 8)) & 1) << b
+        if raw > i.vmax:
+            continue
+        val_d[i.spn] = raw * i.scale_factor + i.offset
+
+    return val_d
+
+
+@pytest.mark.parametrize("args,want", [
+    # 1-bit field: no "error" range, 2 is beyond every raw value
+    ((1, 1, 1), (0, 0x1, 1, 2, 2)),
+    # 2 bits at 1.3: 3 is "not available", 2 "error"
+    ((1, 2, 3), (2, 0x3, 1, 2, 3)),
+    # A byte at 5.1
+    ((5, 8, 1), (32, 0xFF, 5, 0xFE, 0xFF)),
+    # 4 bits across nothing but the last byte
+    ((8, 4, 5), (60, 0xF, 8, 0xE, 0xF)),
+    # 2 bytes at 2.1: the most significant byte has the sentinels
+    ((2, 16, 1), (8, 0xFFFF, 3, 0xFE00, 0xFF00)),
+    # 10 bits at 3.3, spanning two bytes
+    ((3, 10, 3), (18, 0x3FF, 4, 0x3F8, 0x3FC)),
+    # 4 bytes at 1.1
+    ((1, 32, 1), (0, 0xFFFFFFFF, 4, 0xFE000000, 0xFF000000)),
+    # Past the classic 8 bytes (TP payload)
+    ((12, 8, 1), (88, 0xFF, 12, 0xFE, 0xFF))])
+def testCompileSPN(args, want):
+    (byte_num, bit_len, bit_start) = args
+    i = compileSPN("SP", 1, byte_num, bit_len, bit_start, 0.5, -40, "C")
+    assert (i.shift, i.mask, i.nbytes, i.err_min, i.na_min) == want
+    assert (i.scale_factor, i.offset, i.unit) == (0.5, -40.0, "C")
+
+
+def testCompileSPNWithoutPosition():
+    # No start position or length: not decodable, defaults for the rest
+    i = compileSPN("SP", 1, None, 8, 1, "", "", None)
+    assert i.shift is None
+    assert (i.scale_factor, i.offset, i.unit) == (1.0, 0.0, "")
+
+    # No start bit: bit 1
+    assert compileSPN("SP", 1, 2, 4, None, 1, 0, "").shift == 8
+
+
+def testDecodeMatchesBitLayout(synth_da, dbfile):
+    rnd = random.Random(SEED)
+    sa = next(iter(synth_da.sa_d))
+    with Decoder(dbfile) as dec:
+        for pgn in synth_da.pgn_l:
+            for n in range(20):
+                data = bytes(rnd.getrandbits(8) for _ in range(pgn.size))
+                # The odd short frame
+                if n % 5 == 4:
+                    data = data[:rnd.randrange(len(data))]
+                rec = decodeValues((1.0, canID(pgn, sa), data), dec.plan)
+                (ts, pgn_num, dest_add, rec_sa, val_l) = rec
+                assert (pgn_num, dest_add, rec_sa) == (pgn.pgn, 255, sa)
+                got_d = {i.spn: val for (i, val) in val_l}
+                assert got_d == pytest.approx(bitValues(pgn, data))
+
+
+def testLegacyDBCompilesSamePlan(synth_da, dbfile, tmp_path):
+    # Rows without the precomputed decode columns compile to the same plan
+    def planTables(dbfile):
+        dbcon = sqlite3.connect(dbfile)
+        plan = DecodePlan(dbcon)
+        dbcon.close()
+        return (plan.pgn_d, plan.sa_d)
+
+    assert planTables(buildLegacyDB(synth_da, str(tmp_path)))\
+        == planTables(dbfile)
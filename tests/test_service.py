@@ -0,0 +1,39 @@
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from j1939dec.service import DecodeService, HTTPServer
+
+
+@pytest.fixture(scope="module")
+def http_url(dbfile):
+    service = DecodeService(dbfile, jobs=1)
+    server = HTTPServer(0, service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def post(url, data):
+    req = urllib.request.Request(url, data=data, method="POST")
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        return (resp.headers.get_content_type(), resp.read().decode())
+
+
+@pytest.mark.parametrize("oformat,ctype", [
+    ("human", "text/plain"), ("csv", "text/csv"),
+    ("jsonl", "application/x-ndjson")])
+def testHTTPContentType(http_url, log_file, oformat, ctype):
+    with open(log_file, "rb") as fo:
+        batch = fo.read()
+    (got_ctype, text) = post(http_url + "/decode?format=" + oformat, batch)
+    assert got_ctype == ctype
+    assert text
+    if oformat == "jsonl":
+        row_l = [json.loads(line) for line in text.splitlines()]
+        assert list(row_l[0]) == ["ts", "pgn", "da", "sa", "spn", "label",
+                                  "value", "unit"]
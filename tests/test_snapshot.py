@@ -0,0 +1,71 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import runScript, synthFrames
+
+from j1939dec.decode import decodeValues
+from j1939dec.plan import DecodePlan
+from j1939dec.snapshot import SnapshotPlan, loadPlan
+
+
+@pytest.fixture(scope="module")
+def snap_file(dbfile, tmp_path_factory):
+    snap_file = str(tmp_path_factory.mktemp("snap") / "da.snap")
+    res = runScript("j1939-db-snapshot.py", dbfile, snap_file)
+    assert res.returncode == 0, res.stdout
+
+    return snap_file
+
+
+def testSnapshotMatchesDB(synth_da, dbfile, snap_file):
+    dbcon = sqlite3.connect(dbfile)
+    db_plan = DecodePlan(dbcon)
+    dbcon.close()
+    snap_plan = SnapshotPlan(snap_file)
+
+    assert dict(snap_plan.iterPGNs()) == db_plan.pgn_d
+    for sa in range(256):
+        assert snap_plan.getSALabel(sa) == db_plan.getSALabel(sa)
+    for frame in synthFrames(synth_da):
+        assert decodeValues(frame, snap_plan) == decodeValues(frame, db_plan)
+    snap_plan.close()
+
+
+def testStaleSnapshot(dbfile, snap_file, tmp_path):
+    # A copy of the DB is the same DB; any change to it is not
+    db_copy = str(tmp_path / "da.db")
+    shutil.copyfile(dbfile, db_copy)
+    res = runScript("j1939-db-snapshot.py", "-c", db_copy, snap_file)
+    assert res.returncode == 0, res.stdout
+
+    warn_l = []
+    plan = loadPlan(db_copy, snap_file, warn_l.append)
+    assert isinstance(plan, SnapshotPlan) and not warn_l
+    plan.close()
+
+    dbcon = sqlite3.connect(db_copy)
+    dbcon.execute("UPDATE pgn SET label = 'Changed' WHERE pgn_id = 1")
+    dbcon.commit()
+    dbcon.close()
+
+    res = runScript("j1939-db-snapshot.py", "-c", db_copy, snap_file)
+    assert res.returncode == 1
+    assert "stale" in res.stdout
+
+    plan = loadPlan(db_copy, snap_file, warn_l.append)
+    assert isinstance(plan, DecodePlan)
+    assert len(warn_l) == 1 and "Stale" in warn_l[0]
+    assert "Changed" in [info[0] for info in plan.pgn_d.values()]
+
+
+def testNotASnapshot(dbfile, tmp_path):
+    bad_file = tmp_path / "bad.snap"
+    bad_file.write_bytes(b"J1939SNP" + bytes(200))
+    with pytest.raises(ValueError):
+        SnapshotPlan(str(bad_file))
+
+    res = runScript("j1939-db-snapshot.py", "-c", dbfile, str(bad_file))
+    assert res.returncode == 1
+    assert res.stdout.startswith("ERROR - ")
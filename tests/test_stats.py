@@ -0,0 +1,39 @@
+import json
+
+from conftest import runScript
+
+from j1939dec.profiling import STAGE_L
+
+
+def testStatsCountErrors(dbfile, log_file, tmp_path):
+    # Frames of unknown PGNs are counted, not listed, and the output is
+    # otherwise that of a run without --stats
+    with open(log_file) as fo:
+        line_l = fo.readlines()
+    bad_l = ["(1715275600.%06d) can0 18ABCD21#0102030405060708\n" % n
+             for n in range(50)]
+    in_file = tmp_path / "in.log"
+    in_file.write_text("".join(line_l[:1000] + bad_l + line_l[1000:]))
+    json_file = tmp_path / "stats.json"
+
+    for oformat in [[], ["-f", "csv"]]:
+        res = runScript("jjd.py", "-d", dbfile, *oformat, "--stats",
+                        "--stats-json=" + str(json_file), "-i", in_file)
+        assert res.returncode == 0, res.stderr
+        assert "not in DB" not in res.stdout + res.stderr
+
+        plain = runScript("jjd.py", "-d", dbfile, *oformat, "-i", in_file)
+        if oformat:
+            assert res.stdout == plain.stdout
+        else:
+            assert res.stdout.count("===Begin CAN message")\
+                == plain.stdout.count("===Begin CAN message") - len(bad_l)
+
+        with open(json_file) as fo:
+            stats_d = json.load(fo)
+        assert list(stats_d["stages"]) == STAGE_L
+        assert stats_d["errors"] == stats_d["unknown"] == len(bad_l)
+        assert stats_d["unknown_pgns"] == {str(0xAB00): len(bad_l)}
+        assert stats_d["frames"] == stats_d["decoded"] + stats_d["unknown"]\
+            + stats_d["reserved"]
+        assert "  Stages: read " in res.stderr
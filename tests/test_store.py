@@ -0,0 +1,49 @@
+import os
+from array import array
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from j1939dec.plan import compileSPN
+from j1939dec.store import ColumnStore, appendColumn, columnCount,\
+     listSignals, openSignal
+
+
+DESC = compileSPN("SP 190", 190, 4, 16, 1, 0.125, 0, "rpm")
+
+
+def storeSamples(root, ts_l):
+    # One signal, its value twice the timestamp
+    store = ColumnStore(root, flush_size=7)
+    for ts in ts_l:
+        store.append(0xF004, 0, DESC, ts, ts * 2.0)
+    store.close()
+
+
+def testAppend(tmp_path):
+    root = str(tmp_path / "store")
+    storeSamples(root, range(20))
+    storeSamples(root, range(20, 30))
+
+    assert [sig["count"] for sig in listSignals(root)] == [30]
+    (ts, val) = openSignal(root, 0xF004, 0, 190)
+    assert list(ts) == list(range(30))
+    assert list(val) == [n * 2.0 for n in range(30)]
+
+
+def testInterruptedFlush(tmp_path):
+    # The timestamps of a flush made it to disk, the values did not: the
+    # next run must not pair its values with those timestamps
+    root = str(tmp_path / "store")
+    storeSamples(root, range(10))
+    base = os.path.join(root, str(0xF004), "0", "190")
+    appendColumn(base + ".ts.npy", array("d", [100.0, 101.0, 102.0]))
+    assert columnCount(base + ".ts.npy") == 13
+
+    storeSamples(root, range(10, 20))
+    assert columnCount(base + ".ts.npy") == columnCount(base + ".val.npy")\
+        == 20
+    (ts, val) = openSignal(root, 0xF004, 0, 190)
+    assert list(val) == [t * 2.0 for t in ts]
+    assert list(ts) == list(range(20))
@@ -0,0 +1,145 @@
+from j1939dec.tp import CM_ABORT, CM_BAM, CM_RTS, PF_TP_CM, PF_TP_DT,\
+     TIMEOUT_BAM, TPReassembler
+
+
+def cmFrame(ts, sa, da, ctrl, size, pgn, num_pkts=None, prio=7):
+    if num_pkts is None:
+        num_pkts = (size + 6) // 7
+    can_id = (prio << 26) | (PF_TP_CM << 16) | (da << 8) | sa
+
+    return (ts, can_id, bytes([ctrl, size & 0xFF, size >> 8, num_pkts & 0xFF,
+                               0xFF, pgn & 0xFF, (pgn >> 8) & 0xFF,
+                               pgn >> 16]))
+
+
+def dtFrames(ts, sa, da, data, gap=0.05):
+    # The TP.DT packets of data, the last one padded with 0xFF
+    frame_l = []
+    for n in range((len(data) + 6) // 7):
+        chunk = data[n * 7:n * 7 + 7].ljust(7, b"\xff")
+        frame_l.append((ts + n * gap, (7 << 26) | (PF_TP_DT << 16) | (da << 8)
+                        | sa, bytes([n + 1]) + chunk))
+
+    return frame_l
+
+
+def bamFrames(ts, sa, data, pgn=0xFECA, prio=6):
+    return [cmFrame(ts, sa, 0xFF, CM_BAM, len(data), pgn, prio=prio)]\
+        + dtFrames(ts + 0.05, sa, 0xFF, data)
+
+
+def testBAM():
+    data = bytes(range(20))
+    reg = (0.01, 0x18FEF100, bytes(8))
+    frame_l = [reg] + bamFrames(0.0, 0x21, data) + [reg]
+
+    tp = TPReassembler()
+    out_l = list(tp.process(frame_l))
+
+    # Regular frames pass, the message comes with the last packet
+    assert out_l == [reg, (frame_l[-2][0], (6 << 26) | (0xFECA << 8) | 0x21,
+                           data), reg]
+    assert tp.num_completed == 1
+    assert not tp.session_d
+
+
+def testPassTP():
+    frame_l = bamFrames(0.0, 0x21, bytes(10))
+    out_l = list(TPReassembler(pass_tp=True).process(frame_l))
+    assert out_l[:-1] == frame_l
+    assert out_l[-1][2] == bytes(10)
+
+
+def testInterleavedSessions():
+    # Sessions of two SAs at once, and a retransmitted packet
+    data1 = bytes(range(30))
+    data2 = bytes(range(100, 117))
+    frame_l = sorted(bamFrames(0.0, 0x10, data1)
+                     + bamFrames(0.01, 0x20, data2, pgn=0xFEEC))
+    frame_l.insert(3, frame_l[2])
+
+    tp = TPReassembler()
+    out_l = list(tp.process(frame_l))
+    assert sorted((can_id & 0xFF, data) for (ts, can_id, data) in out_l)\
+        == [(0x10, data1), (0x20, data2)]
+    assert tp.num_completed == 2
+
+
+def testRTSToPDU1PGN():
+    # The DA of the connection goes into the rebuilt PDU1 ID
+    data = bytes(range(9))
+    frame_l = [cmFrame(0.0, 0x00, 0x3D, CM_RTS, len(data), 0xEF00)]\
+        + dtFrames(0.1, 0x00, 0x3D, data)
+
+    out_l = list(TPReassembler().process(frame_l))
+    assert out_l == [(frame_l[-1][0], (7 << 26) | (0xEF3D << 8) | 0x00,
+                      data)]
+
+
+def testMissingPacket():
+    frame_l = bamFrames(0.0, 0x21, bytes(20))
+    del frame_l[2]
+
+    tp = TPReassembler()
+    assert not list(tp.process(frame_l))
+    assert tp.num_completed == 0
+    assert len(tp.session_d) == 1
+
+
+def testTimeout():
+    # A packet after the BAM timeout belongs to no session
+    frame_l = bamFrames(0.0, 0x21, bytes(20))
+    frame_l[-1] = (frame_l[-2][0] + TIMEOUT_BAM + 0.01,) + frame_l[-1][1:]
+
+    tp = TPReassembler()
+    assert not list(tp.process(frame_l))
+    assert (tp.num_timed_out, tp.num_orphans) == (1, 1)
+    assert not tp.session_d
+
+
+def testAbort():
+    # Either side may abort; later packets are orphans
+    data = bytes(20)
+    for (sa, da) in [(0x00, 0x3D), (0x3D, 0x00)]:
+        frame_l = [cmFrame(0.0, 0x00, 0x3D, CM_RTS, len(data), 0xEF00)]\
+            + dtFrames(0.1, 0x00, 0x3D, data)
+        frame_l.insert(2, (0.12, (7 << 26) | (PF_TP_CM << 16) | (da << 8)
+                           | sa, bytes([CM_ABORT, 1, 0xFF, 0xFF, 0xFF, 0x00,
+                                        0xEF, 0x00])))
+
+        tp = TPReassembler()
+        assert not list(tp.process(frame_l))
+        assert (tp.num_aborted, tp.num_orphans) == (1, 2)
+
+
+def testNewAnnouncementReplacesSession():
+    data = bytes(range(20))
+    frame_l = bamFrames(0.0, 0x21, bytes(20))[:2] + bamFrames(0.2, 0x21, data)
+
+    tp = TPReassembler()
+    assert [frame[2] for frame in tp.process(frame_l)] == [data]
+    assert (tp.num_aborted, tp.num_completed) == (1, 1)
+
+
+def testInvalidAnnouncements():
+    # Sizes outside 9 - 1785 and packet counts that do not fit the size
+    frame_l = [cmFrame(0.0, 0x21, 0xFF, CM_BAM, 8, 0xFECA),
+               cmFrame(0.0, 0x22, 0xFF, CM_BAM, 1786, 0xFECA),
+               cmFrame(0.0, 0x23, 0xFF, CM_BAM, 20, 0xFECA, num_pkts=4)]
+
+    tp = TPReassembler()
+    assert not list(tp.process(frame_l))
+    assert tp.num_invalid == 3
+    assert not tp.session_d
+
+
+def testEviction():
+    # A full table drops its least recently active session
+    frame_l = [cmFrame(0.0, sa, 0xFF, CM_BAM, 20, 0xFECA)
+               for sa in [1, 2, 3]]
+    frame_l += dtFrames(0.1, 1, 0xFF, bytes(20))
+
+    tp = TPReassembler(max_sessions=2)
+    assert not list(tp.process(frame_l))
+    assert (tp.num_evicted, tp.num_orphans) == (1, 3)
+    assert list(tp.session_d) == [(2, 0xFF), (3, 0xFF)]